@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+# idf_surface_match.py over many building files. A pool of worker processes
+# each takes file after file, so the interpreter and modules are loaded once
+# per worker rather than once per file. Each input gets its own matches file
+# in the output directory, and manifest.json there records how every file
+# went and how long it took.
+
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import idf_surface_match
+import idf_surfaces
+import surface_match
+
+# Memory a worker needs beyond its input: interpreter, modules and buffers
+WORKER_BASE_MEMORY = 64 * 1024 * 1024
+
+# Peak memory of a worker per byte of its input. idf_surface_match.py peaks
+# near 10 bytes per input byte on benchmark.py buildings, above about 35 MB.
+MEMORY_PER_INPUT_BYTE = 16
+
+
+def input_files(paths: List[str], manifests: List[str]) -> List[str]:
+    # Input files from paths, directories standing for the .idf and .tsv
+    # files in them, and from manifests, files listing one input per line.
+    # Duplicates are dropped, the first place a file turns up is its order.
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith(('.idf', '.tsv'))))
+        else:
+            files.append(path)
+
+    for manifest in manifests:
+        base = os.path.dirname(manifest)
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    files.append(os.path.join(base, line))
+
+    seen = set()
+    unique = []
+    for path in files:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+
+def output_paths(files: List[str], output_dir: str) -> List[str]:
+    # Output file of each input: its name with .matches.tsv for the
+    # extension, numbered when two inputs share a name or would be written
+    # over by it
+    inputs = {os.path.abspath(path) for path in files}
+    paths = []
+    taken = set()
+    for path in files:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        output = os.path.join(output_dir, f'{stem}.matches.tsv')
+        count = 1
+        while output in taken or os.path.abspath(output) in inputs:
+            count += 1
+            output = os.path.join(output_dir, f'{stem}-{count}.matches.tsv')
+        taken.add(output)
+        paths.append(output)
+    return paths
+
+
+def available_memory() -> Optional[int]:
+    # Bytes of memory available to new processes, None if it can't be told
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def available_cores() -> int:
+    # Cores this process may run on
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def worker_memory(files: List[str]) -> int:
+    # Estimated peak memory of a worker, enough for the largest input
+    largest = 0
+    for path in files:
+        try:
+            largest = max(largest, os.path.getsize(path))
+        except OSError:
+            pass
+    return WORKER_BASE_MEMORY + largest * MEMORY_PER_INPUT_BYTE
+
+
+def pool_size(file_count: int, cores: int, memory: Optional[int], per_worker: int, limit: Optional[int] = None) -> int:
+    # Workers to start: no more than the files, the cores, the limit if one
+    # is given, or as many as fit in memory if it is known. At least one.
+    workers = min(file_count, cores)
+    if limit is not None:
+        workers = min(workers, limit)
+    if memory is not None:
+        workers = min(workers, memory // max(per_worker, 1))
+    return max(1, workers)
+
+
+def match_file(path: str, output: str, construction_filter: Optional[str], options: Dict[str, Any]) -> Dict[str, Any]:
+    # Match one input into the output file, returning its manifest entry.
+    # .idf files are read as IDF text, others as tab separated objects.
+    entry: Dict[str, Any] = {'input': path, 'output': output, 'worker': os.getpid()}
+    start = time.perf_counter()
+    try:
+        if path.lower().endswith('.idf'):
+            zones, surfaces = idf_surfaces.read_idf(idf_surfaces.idf_file_lines(path))
+        else:
+            with open(path) as f:
+                zones, surfaces = idf_surfaces.read_objects(f)
+        names, coords, vertices, starts = idf_surface_match.surface_table(zones, surfaces, construction_filter)
+        parsed = time.perf_counter()
+
+        with open(output, 'w') as f:
+            lines = surface_match.print_matches(names, coords, vertices, starts, options, file=f)
+        matched = time.perf_counter()
+
+        entry.update({'ok': True, 'surfaces': len(names), 'matches': lines,
+                      'parse_seconds': round(parsed - start, 6), 'match_seconds': round(matched - parsed, 6)})
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        # A missing zone or a short object shows up as a KeyError or IndexError
+        entry.update({'ok': False, 'error': f'{type(e).__name__}: {e}'})
+        if os.path.exists(output):
+            os.remove(output)
+
+    entry['seconds'] = round(time.perf_counter() - start, 6)
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    entry['worker_peak_rss'] = peak if sys.platform == 'darwin' else peak * 1024
+    return entry
+
+
+def _match_task(task):
+    return task[0], match_file(*task[1:])
+
+
+def match_files(files: List[str], output_dir: str, construction_filter: Optional[str], options: Dict[str, Any],
+                workers: int) -> List[Dict[str, Any]]:
+    # Manifest entries of the files, in input order. The largest files go
+    # first, so a big one doesn't start last and hold up the end of the run.
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = output_paths(files, output_dir)
+
+    def size(k: int) -> int:
+        try:
+            return os.path.getsize(files[k])
+        except OSError:
+            return 0
+
+    order = sorted(range(len(files)), key=size, reverse=True)
+    tasks = [(k, files[k], outputs[k], construction_filter, options) for k in order]
+
+    entries: List[Optional[Dict[str, Any]]] = [None] * len(files)
+    if workers == 1:
+        for task in tasks:
+            k, entry = _match_task(task)
+            entries[k] = entry
+    else:
+        # print_matches sets the tolerances from the options in each worker
+        with multiprocessing.Pool(workers) as pool:
+            for k, entry in pool.imap_unordered(_match_task, tasks):
+                entries[k] = entry
+    return entries
+
+
+def main():
+    if '-h' in sys.argv or '--help' in sys.argv:
+        print('Usage: batch_match.py [-c CONSTRUCTION] [-2] [--all] [--pairwise] [--box] [--metrics] [--backend python|numpy]')
+        print('                      [--tol NORMAL[,OFFSET]] [--workers N] [--memory MB] [--manifest LIST] [-o DIR] [input ...]')
+        print('Matches each input as idf_surface_match.py does, 3 vertex surfaces being triangles as')
+        print('with --triangles, into DIR/<input name>.matches.tsv, DIR defaulting to matches. Inputs')
+        print('are .idf files, tab separated object files, directories of them, or listed one per line')
+        print('in LIST. DIR/manifest.json records the surfaces, matches, timing or error of each input.')
+        print('Workers default to the cores, fewer if each would not have 16 times its largest input')
+        print('in memory, or MB megabytes with --memory.')
+        sys.exit(0)
+
+    options = surface_match.match_options(sys.argv)
+    # Each worker matches one file at a time, and per file indexes and
+    # profiles don't apply
+    options['jobs'] = 1
+    options['index'] = None
+    options['profile'] = None
+    # As in idf_surface_match.py, matched as with --triangles
+    options['corner_boxes'] = False
+
+    if options['backend'] == 'numpy' and importlib.util.find_spec('numpy') is None:
+        print('The numpy backend requires NumPy to be installed', file=sys.stderr)
+        sys.exit(1)
+
+    construction_filter = None
+    output_dir = 'matches'
+    limit = None
+    per_worker = None
+    manifests = []
+    paths = []
+
+    # Options taking a value, so the value isn't mistaken for an input,
+    # including those of surface_match.py that are set aside above
+    with_value = {'-c', '-o', '--workers', '--memory', '--manifest', '--backend', '--jobs', '-j', '--index', '--tol'}
+    idx = 1
+    while idx < len(sys.argv):
+        arg = sys.argv[idx]
+        if arg in with_value:
+            if idx + 1 >= len(sys.argv):
+                print(f'{arg} requires a value', file=sys.stderr)
+                sys.exit(1)
+            value = sys.argv[idx + 1]
+            if arg == '-c':
+                construction_filter = value
+            elif arg == '-o':
+                output_dir = value
+            elif arg == '--manifest':
+                manifests.append(value)
+            elif arg in ('--workers', '--memory'):
+                try:
+                    number = int(value)
+                except ValueError:
+                    number = 0
+                if number < 1:
+                    print(f'{arg} requires a positive number', file=sys.stderr)
+                    sys.exit(1)
+                if arg == '--workers':
+                    limit = number
+                else:
+                    per_worker = number * 1024 * 1024
+            idx += 2
+            continue
+        if not arg.startswith('-'):
+            paths.append(arg)
+        idx += 1
+
+    try:
+        files = input_files(paths, manifests)
+    except OSError as e:
+        print(f'Cannot read inputs: {e}', file=sys.stderr)
+        sys.exit(1)
+    if not files:
+        print('No input files', file=sys.stderr)
+        sys.exit(1)
+
+    memory = available_memory()
+    if per_worker is None:
+        per_worker = worker_memory(files)
+    workers = pool_size(len(files), available_cores(), memory, per_worker, limit)
+
+    start = time.perf_counter()
+    entries = match_files(files, output_dir, construction_filter, options, workers)
+    elapsed = time.perf_counter() - start
+
+    failed = [entry for entry in entries if not entry['ok']]
+    manifest = {'workers': workers, 'worker_memory': per_worker, 'available_memory': memory,
+                'seconds': round(elapsed, 6), 'files': len(entries), 'failed': len(failed),
+                'options': {key: value for key, value in options.items() if key not in ('jobs', 'index', 'profile')},
+                'construction': construction_filter, 'entries': entries}
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    for entry in failed:
+        print(f'{entry["input"]}: {entry["error"]}', file=sys.stderr)
+    print(f'{len(entries) - len(failed)} of {len(entries)} files matched in {elapsed:.2f} s with {workers} workers', file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
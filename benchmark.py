@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+
+# Benchmarks for surface_match and idf_surfaces.
+# Usage: benchmark.py first-match [surface count]
+#        benchmark.py zone-transform [zone count]
+#        benchmark.py generate [surface count] [output prefix]
+#        benchmark.py suite [surface count] [--save baseline.json] [--compare baseline.json] [--repeat N]
+
+import hashlib
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import idf_surface_draw
+import idf_surfaces
+import surface_match
+
+# Runs of each scenario. The median of them is compared with the baseline.
+REPEAT = 5
+
+# Slowdowns of less than this many seconds are taken for timing noise
+NOISE_FLOOR_SECONDS = 0.05
+
+
+def floor_plate(count: int, seed: int = 0) -> list[surface_match.Plane]:
+    # Ceilings and floors of a story with many small zones: rectangles on one
+    # plane, overlapping their neighbours.
+    rng = random.Random(seed)
+    size = int(count ** 0.5) * 4
+    planes = []
+    for i in range(count):
+        x = rng.uniform(0, size)
+        y = rng.uniform(0, size)
+        w = rng.uniform(2, 8)
+        h = rng.uniform(2, 8)
+        p1 = surface_match.Point(x, y, 3)
+        p2 = surface_match.Point(x + w, y, 3)
+        p3 = surface_match.Point(x + w, y + h, 3)
+        planes.append(surface_match.Plane(surface_match.PlaneEq(p1, p2, p3), f'Surface {i}'))
+    return planes
+
+
+def count_pair_tests(planes: list[surface_match.Plane], first_only: bool) -> tuple[int, int, float]:
+    # Returns (pair tests, matches, seconds) for one check_group call
+    overlap = surface_match.extents_overlap
+    tests = 0
+
+    def counting_overlap(extents, i, j):
+        nonlocal tests
+        tests += 1
+        return overlap(extents, i, j)
+
+    surface_match.extents_overlap = counting_overlap
+    try:
+        start = time.perf_counter()
+        matches = surface_match.check_group(planes, first_only=first_only)
+        elapsed = time.perf_counter() - start
+    finally:
+        surface_match.extents_overlap = overlap
+
+    return tests, len(matches), elapsed
+
+
+def first_match_benchmark(count: int):
+    # Pair tests of the first match search against full --all enumeration
+    planes = floor_plate(count)
+    print(f'{count} coplanar surfaces')
+    print(f'{"mode":<8}{"pair tests":>12}{"matches":>10}{"seconds":>10}')
+    for name, first_only in (('--all', False), ('first', True)):
+        tests, matches, elapsed = count_pair_tests(planes, first_only)
+        print(f'{name:<8}{tests:>12}{matches:>10}{elapsed:>10.3f}')
+
+
+def zone_objects(zones: int, seed: int = 0) -> list[str]:
+    # Flattened IDF objects: zones with random rotation, 6 surfaces each
+    rng = random.Random(seed)
+    lines = []
+    for i in range(zones):
+        rotation = rng.choice([0, 0, 15, 30, 45, 90])
+        lines.append(f'Zone\tZone {i}\t{rotation}\t{rng.uniform(0, 500)}\t{rng.uniform(0, 500)}\t{3 * (i % 20)}')
+        w = rng.uniform(3, 10)
+        d = rng.uniform(3, 10)
+        corners = [(0, 0), (w, 0), (w, d), (0, d)]
+        for k in range(4):
+            (x1, y1), (x2, y2) = corners[k], corners[(k + 1) % 4]
+            vertices = [x1, y1, 3, x1, y1, 0, x2, y2, 0, x2, y2, 3]
+            lines.append('\t'.join(['Wall:Detailed', f'Zone {i} Wall {k}', 'C', f'Zone {i}', '', 'Outdoors', '', '', '', '', '4'] + [str(v) for v in vertices]))
+        floor = [w, 0, 0, 0, 0, 0, 0, d, 0, w, d, 0]
+        ceiling = [0, 0, 3, w, 0, 3, w, d, 3, 0, d, 3]
+        for name, cls, vertices in (('Floor', 'Floor:Detailed', floor), ('Ceiling', 'RoofCeiling:Detailed', ceiling)):
+            lines.append('\t'.join([cls, f'Zone {i} {name}', 'C', f'Zone {i}', '', 'Outdoors', '', '', '', '', '4'] + [str(v) for v in vertices]))
+    return lines
+
+
+def zone_transform_benchmark(zones: int):
+    # Zone to world transform of every surface
+    lines = zone_objects(zones)
+    zone_list, surfaces = idf_surfaces.read_objects(lines)
+    start = time.perf_counter()
+    idf_surfaces.transform_surfaces(zone_list, surfaces)
+    elapsed = time.perf_counter() - start
+    print(f'{zones} zones')
+    print(f'{"surfaces":>10}{"seconds":>10}')
+    print(f'{len(surfaces):>10}{elapsed:>10.3f}')
+
+
+def synthetic_building(surfaces: int, rotations: tuple = (0, 30, 45), zones_per_story: int = 16,
+                       columns: int = 0, stories_per_block: int = 5, seed: int = 0) -> list[str]:
+    # Flattened IDF objects, as read by idf_surfaces.read_objects, for blocks
+    # of stories of box shaped zones with about the given number of surfaces.
+    # Zones of a story sit on a grid of columns (square by default) with
+    # random column widths and row depths, so neighbouring walls, and the
+    # floors and ceilings between stories, are coplanar. A floor plate group
+    # holds about 2 * zones_per_story surfaces, a wall line group
+    # 2 * rows * stories_per_block. Each block turns by the next angle of
+    # rotations, with its zones rotated to match.
+    rng = random.Random(seed)
+    zones = max(1, math.ceil(surfaces / 6))
+    columns = columns or max(1, round(math.sqrt(zones_per_story)))
+    rows = max(1, math.ceil(zones_per_story / columns))
+    height = 3.0
+
+    lines = []
+    block = 0
+    zone = 0
+    while zone < zones:
+        rotation = rotations[block % len(rotations)]
+        (cos, minus_sin, _, _), (sin, _, _, _), _ = idf_surfaces.Zone('', rotation, 0, 0, 0).matrix()
+        widths = [rng.uniform(3, 10) for _ in range(columns)]
+        depths = [rng.uniform(3, 10) for _ in range(rows)]
+        block_x = 1000.0 * block
+
+        for story in range(stories_per_block):
+            for k in range(zones_per_story):
+                if zone >= zones:
+                    break
+                column = k % columns
+                row = k // columns
+                x = sum(widths[:column])
+                y = sum(depths[:row])
+                name = f'Block {block} Story {story} Zone {k}'
+                lines.append(f'Zone\t{name}\t{rotation}\t{block_x + x * cos + y * minus_sin}\t{x * sin + y * cos}\t{height * story}')
+                lines.extend(box_surfaces(name, widths[column], depths[row], height))
+                zone += 1
+        block += 1
+
+    return lines
+
+
+def box_surfaces(zone: str, w: float, d: float, h: float) -> list[str]:
+    # Walls, floor and ceiling of a box zone, in zone coordinates
+    lines = []
+    corners = [(0, 0), (w, 0), (w, d), (0, d)]
+    for k in range(4):
+        (x1, y1), (x2, y2) = corners[k], corners[(k + 1) % 4]
+        vertices = [x1, y1, h, x1, y1, 0, x2, y2, 0, x2, y2, h]
+        lines.append('\t'.join(['Wall:Detailed', f'{zone} Wall {k}', 'C', zone, '', 'Outdoors', '', '', '', '', '4'] + [str(v) for v in vertices]))
+    floor = [w, 0, 0, 0, 0, 0, 0, d, 0, w, d, 0]
+    ceiling = [0, 0, h, w, 0, h, w, d, h, 0, d, h]
+    for name, cls, vertices in (('Floor', 'Floor:Detailed', floor), ('Ceiling', 'RoofCeiling:Detailed', ceiling)):
+        lines.append('\t'.join([cls, f'{zone} {name}', 'C', zone, '', 'Outdoors', '', '', '', '', '4'] + [str(v) for v in vertices]))
+    return lines
+
+
+def surface_rows(objects: list[str]) -> list[str]:
+    # The surface_match.py input for flattened IDF objects, as idf_surfaces.py prints it
+    zones, surfaces = idf_surfaces.read_objects(objects)
+    return ['\t'.join([s.name] + [str(p) for p in s.points]) for s in idf_surfaces.transform_surfaces(zones, surfaces)]
+
+
+def generate(count: int, prefix: str = 'synthetic'):
+    # Write the idf_surfaces.py and surface_match.py inputs of a synthetic building
+    objects = synthetic_building(count)
+    rows = surface_rows(objects)
+    with open(prefix + '.idf.tsv', 'w') as f:
+        f.write('\n'.join(objects) + '\n')
+    with open(prefix + '.tsv', 'w') as f:
+        f.write('\n'.join(rows) + '\n')
+    print(f'{prefix}.idf.tsv: {len(objects)} objects')
+    print(f'{prefix}.tsv: {len(rows)} surfaces')
+
+
+def timed(function, repeat: int = REPEAT) -> tuple[object, float, int]:
+    # Returns (result, median seconds of repeat runs, peak traced memory in
+    # bytes) of function(). Memory is traced on a separate run, as tracing
+    # slows it down.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, statistics.median(times), peak
+
+
+# Runs a command and writes its seconds and ru_maxrss to the file descriptor
+# given first. A child's ru_maxrss includes the memory of the process that
+# forked it, so the command is forked from this small interpreter rather
+# than from the benchmark with its synthetic building in memory.
+MEASURE_COMMAND = """
+import os, sys, time
+start = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    try:
+        os.execv(sys.argv[2], sys.argv[2:])
+    finally:
+        os._exit(127)
+_, status, usage = os.wait4(pid, 0)
+elapsed = time.perf_counter() - start
+os.write(int(sys.argv[1]), f'{elapsed} {usage.ru_maxrss}'.encode())
+sys.exit(os.waitstatus_to_exitcode(status))
+"""
+
+
+def timed_command(args: list[str], input_path: str, repeat: int = REPEAT) -> tuple[bytes, float, int]:
+    # Returns (stdout, median seconds of repeat runs, peak resident memory in
+    # bytes) of a command run with input_path on stdin
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        read_fd, write_fd = os.pipe()
+        try:
+            with open(input_path, 'rb') as stdin, tempfile.TemporaryFile() as stdout:
+                process = subprocess.Popen([sys.executable, '-c', MEASURE_COMMAND, str(write_fd)] + args,
+                                           stdin=stdin, stdout=stdout, pass_fds=(write_fd,))
+                os.close(write_fd)
+                write_fd = None
+                with os.fdopen(read_fd, 'rb') as measured:
+                    read_fd = None
+                    report = measured.read().split()
+                if process.wait() != 0:
+                    raise subprocess.CalledProcessError(process.returncode, args)
+                stdout.seek(0)
+                output = stdout.read()
+        finally:
+            for fd in (read_fd, write_fd):
+                if fd is not None:
+                    os.close(fd)
+
+        times.append(float(report[0]))
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        maxrss = int(report[1])
+        peak = max(peak, maxrss if sys.platform == 'darwin' else maxrss * 1024)
+
+    return output, statistics.median(times), peak
+
+
+def digest(value) -> str:
+    # Short hash of a result, to check it against the baseline
+    if not isinstance(value, bytes):
+        value = repr(value).encode()
+    return hashlib.sha256(value).hexdigest()[:16]
+
+
+def suite(count: int, seed: int = 0, repeat: int = REPEAT) -> dict:
+    # Time every scenario on one synthetic building, median of repeat runs.
+    # Returns, by scenario, seconds, surfaces per second, peak memory and a
+    # digest of the result.
+    here = os.path.dirname(os.path.abspath(__file__))
+    objects = synthetic_building(count, seed=seed)
+    rows = surface_rows(objects)
+    names, coords, vertices, starts = surface_match.read_surface_table(rows)
+    planes = surface_match.table_planes(names, coords)
+    groups = surface_match.group_planes(planes)
+
+    def check_groups():
+        return [[(a.name, b.name) for a, b in surface_match.check_group(group)] for group in groups if len(group) > 1]
+
+    def draw():
+        polygons = idf_surface_draw.read_polygon_file(rows, 3)
+        return idf_surface_draw.write_svg_file(polygons, 1)
+
+    results = {}
+
+    def record(name: str, result, elapsed: float, peak: int):
+        results[name] = {'seconds': round(elapsed, 4), 'surfaces_per_second': round(len(rows) / elapsed if elapsed else 0.0),
+                         'peak_kb': peak // 1024, 'digest': digest(result)}
+
+    sizes = sorted((len(group) for group in groups), reverse=True)
+    print(f'{len(rows)} surfaces, {len(groups)} groups, largest {sizes[:5]}', file=sys.stderr)
+
+    record('group_planes', *timed(lambda: [[plane.name for plane in group] for group in surface_match.group_planes(planes)], repeat))
+    record('check_group', *timed(check_groups, repeat))
+    record('write_svg_file', *timed(draw, repeat))
+
+    with tempfile.TemporaryDirectory() as directory:
+        objects_path = os.path.join(directory, 'building.idf.tsv')
+        rows_path = os.path.join(directory, 'building.tsv')
+        with open(objects_path, 'w') as f:
+            f.write('\n'.join(objects) + '\n')
+        with open(rows_path, 'w') as f:
+            f.write('\n'.join(rows) + '\n')
+
+        commands = [('idf_surfaces.py', ['idf_surfaces.py'], objects_path),
+                    ('surface_match.py', ['surface_match.py'], rows_path),
+                    ('surface_match.py --all', ['surface_match.py', '--all'], rows_path),
+                    ('idf_surface_match.py', ['idf_surface_match.py'], objects_path)]
+        for name, args, input_path in commands:
+            record(name, *timed_command([sys.executable, os.path.join(here, args[0])] + args[1:], input_path, repeat))
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, noise_floor: float = NOISE_FLOOR_SECONDS) -> list[str]:
+    # Differences from the baseline: changed results, and scenarios slower by
+    # more than the tolerance, a fraction of the baseline time, and by more
+    # than the noise floor in seconds
+    problems = []
+    for name, expected in baseline.items():
+        if name not in results:
+            problems.append(f'{name}: missing')
+            continue
+        actual = results[name]
+        if actual['digest'] != expected['digest']:
+            problems.append(f'{name}: result changed')
+        slower = actual['seconds'] - expected['seconds']
+        if slower > expected['seconds'] * tolerance and slower > noise_floor:
+            problems.append(f'{name}: {actual["seconds"]:.3f}s, baseline {expected["seconds"]:.3f}s')
+    return problems
+
+
+def suite_benchmark(argv: list[str]):
+    count = 20000
+    save_path = None
+    compare_path = None
+    tolerance = 0.25
+    repeat = REPEAT
+    idx = 0
+    while idx < len(argv):
+        if argv[idx] in ('--save', '--compare', '--tolerance', '--repeat'):
+            if idx + 1 >= len(argv):
+                print(f'{argv[idx]} requires a value')
+                sys.exit(1)
+            if argv[idx] == '--save':
+                save_path = argv[idx + 1]
+            elif argv[idx] == '--compare':
+                compare_path = argv[idx + 1]
+            elif argv[idx] == '--repeat':
+                repeat = int(argv[idx + 1])
+            else:
+                tolerance = float(argv[idx + 1])
+            idx += 2
+        else:
+            count = int(argv[idx])
+            idx += 1
+
+    results = suite(count, repeat=repeat)
+    print(f'{"scenario":<24}{"seconds":>10}{"surfaces/s":>12}{"peak kB":>10}')
+    for name, result in results.items():
+        print(f'{name:<24}{result["seconds"]:>10.3f}{result["surfaces_per_second"]:>12}{result["peak_kb"]:>10}')
+
+    if save_path is not None:
+        with open(save_path, 'w') as f:
+            json.dump({'surfaces': count, 'results': results}, f, indent=2)
+
+    if compare_path is not None:
+        with open(compare_path) as f:
+            baseline = json.load(f)
+        if baseline['surfaces'] != count:
+            print(f'Baseline is for {baseline["surfaces"]} surfaces, not {count}')
+            sys.exit(1)
+        problems = compare(results, baseline['results'], tolerance)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print('No regressions')
+
+
+def main():
+    scenarios = {'first-match': (first_match_benchmark, 20000),
+                 'zone-transform': (zone_transform_benchmark, 5000)}
+
+    if len(sys.argv) >= 2 and sys.argv[1] == 'suite':
+        suite_benchmark(sys.argv[2:])
+        return
+
+    if len(sys.argv) >= 2 and sys.argv[1] == 'generate':
+        generate(int(sys.argv[2]) if len(sys.argv) > 2 else 20000, *sys.argv[3:4])
+        return
+
+    if len(sys.argv) < 2 or sys.argv[1] not in scenarios:
+        print('Usage: benchmark.py first-match|zone-transform [count]')
+        print('       benchmark.py generate [count] [output prefix]')
+        print('       benchmark.py suite [count] [--save baseline.json] [--compare baseline.json] [--tolerance 0.25] [--repeat 5]')
+        sys.exit(1)
+
+    benchmark, count = scenarios[sys.argv[1]]
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+    benchmark(count)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,20 @@
 #!/usr/bin/env python3
 
+import gzip
+import html
+import io
+import os
 import sys
+from array import array
+from math import ceil, floor
+from typing import Iterable, Iterator, Optional, TextIO
+
+import surface_match
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Polygon:
     def __init__(self, name: str, points: list[tuple[float, float]]) -> None:
@@ -21,21 +35,35 @@ class Polygon:
     def __repr__(self):
         return self.__str__()
 
-def calculate_viewbox(polygons):
-    min_x: float = min(p.min_x() for p in polygons)
-    min_y: float = min(p.min_y() for p in polygons)
-    max_x: float = max(p.max_x() for p in polygons)
-    max_y: float = max(p.max_y() for p in polygons)
+def polygon_bounds(polygons: Iterable[Polygon]) -> Optional[tuple[float, float, float, float]]:
+    # min x, min y, max x, max y of all points in one pass, None if there are none
+    min_x = min_y = float('inf')
+    max_x = max_y = float('-inf')
+    for p in polygons:
+        for x, y in p.points:
+            if x < min_x:
+                min_x = x
+            if x > max_x:
+                max_x = x
+            if y < min_y:
+                min_y = y
+            if y > max_y:
+                max_y = y
+    if min_x > max_x:
+        return None
+    return min_x, min_y, max_x, max_y
+
+def viewbox_string(bounds: Optional[tuple[float, float, float, float]]) -> str:
+    if bounds is None:
+        return "0 0 0 0"
+    min_x, min_y, max_x, max_y = bounds
     return f"{min_x} {min_y} {max_x - min_x} {max_y - min_y}"
 
-def read_polygon_file(filelike, dimensions) -> list[Polygon]:
-    """Expects a file with lines like (3d):
-    name1, x1, y1, x2, y2, x3, y3, ...
-    or (2d):
-    name1, x1, y1, x2, y2, ...
-    """
-    polygons = []
-    #  with open(filename, 'r') as file:
+def calculate_viewbox(polygons):
+    return viewbox_string(polygon_bounds(polygons))
+
+def iter_polygon_file(filelike, dimensions) -> Iterator[Polygon]:
+    # Polygons of read_polygon_file one at a time
     for line in filelike:
         if "\t" in line:
             parts = [p.strip() for p in line.split("\t")]
@@ -45,9 +73,19 @@ def read_polygon_file(filelike, dimensions) -> list[Polygon]:
         coords = [float(x) for x in parts[1:]]
 
         points = [(coords[i], -coords[i+1]) for i in range(0, len(coords), dimensions)]
-        polygons.append(Polygon(name, points))
+        yield Polygon(name, points)
 
-    return polygons
+def read_polygon_file(filelike, dimensions) -> list[Polygon]:
+    """Expects a file with lines like (3d):
+    name1, x1, y1, x2, y2, x3, y3, ...
+    or (2d):
+    name1, x1, y1, x2, y2, ...
+    """
+    return list(iter_polygon_file(filelike, dimensions))
+
+# Polygons whose area is below this fraction of the square of their size
+# are lines, and get the average of their points as centroid
+CENTROID_AREA_TOLERANCE = 1e-9
 
 def find_centroid(polygon: list[tuple[float, float]]):
     if len(polygon) < 3:
@@ -59,57 +97,319 @@ def find_centroid(polygon: list[tuple[float, float]]):
     # Y = SUM[(Yi + Yi+1) * (Xi * Yi+1 - Xi+1 * Yi)] / 6 / A
     # A = 1/2 * SUM[(Xi * Yi+1 - Xi+1 * Yi)]
 
-    # Just return average x and y for now.
-    x = sum(x for x, y in polygon) / len(polygon)
-    y = sum(y for x, y in polygon) / len(polygon)
-    return x, y
-
-    #  area = 0
-    #  for i in range(len(polygon) - 1):
-        #  x1, y1 = polygon[i]
-        #  x2, y2 = polygon[i+1]
-        #  area += x1 * y2 - x2 * y1
-
-    #  area /= 2
-
-    #  if area == 0:
-        #  raise ValueError(f'Polygon has no area. {polygon}')
-
-    #  x = 0
-    #  y = 0
-    #  for i in range(len(polygon) - 1):
-        #  x1, y1 = polygon[i]
-        #  x2, y2 = polygon[i+1]
-        #  x += (x1 + x2) * (x1 * y2 - x2 * y1)
-        #  y += (y1 + y2) * (x1 * y2 - x2 * y1)
-
-    #  x /= 6 * area
-    #  y /= 6 * area
-
-    #  return x, y
-
-def write_svg_file(polygons: list[Polygon], font_size: float) -> str:
+    # Relative to the first point, so far off polygons keep their precision
+    x0, y0 = polygon[0]
+    area2 = 0.0
+    x = 0.0
+    y = 0.0
+    scale = 0.0
+    for i in range(len(polygon)):
+        x1 = polygon[i][0] - x0
+        y1 = polygon[i][1] - y0
+        x2 = polygon[i - len(polygon) + 1][0] - x0
+        y2 = polygon[i - len(polygon) + 1][1] - y0
+        cross = x1 * y2 - x2 * y1
+        area2 += cross
+        x += (x1 + x2) * cross
+        y += (y1 + y2) * cross
+        scale = max(scale, abs(x1), abs(y1))
+
+    if abs(area2) <= 2 * CENTROID_AREA_TOLERANCE * scale * scale:
+        # No area to weigh by, average x and y
+        x = sum(p[0] - x0 for p in polygon) / len(polygon)
+        y = sum(p[1] - y0 for p in polygon) / len(polygon)
+        return x0 + x, y0 + y
+
+    return x0 + x / (3 * area2), y0 + y / (3 * area2)
+
+def polygon_centroids(polygons: list[Polygon], use_numpy: Optional[bool] = None) -> list[tuple[float, float]]:
+    # find_centroid of every polygon, computed for all of them at once with
+    # NumPy if it is installed, unless use_numpy says otherwise
+    if use_numpy is None:
+        use_numpy = np is not None
+    if not use_numpy or not polygons:
+        return [find_centroid(p.points) for p in polygons]
+
+    counts = np.fromiter((len(p.points) for p in polygons), dtype=np.int64, count=len(polygons))
+    if counts.min() < 3:
+        for p in polygons:
+            find_centroid(p.points)
+
+    points = np.array([point for p in polygons for point in p.points], dtype=np.float64)
+    starts = np.zeros(len(polygons), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    origins = points[starts]
+    relative = points - np.repeat(origins, counts, axis=0)
+
+    # Index of the point after each point, wrapping within its polygon
+    following = np.arange(1, len(points) + 1)
+    following[starts + counts - 1] = starts
+    x1 = relative[:, 0]
+    y1 = relative[:, 1]
+    x2 = x1[following]
+    y2 = y1[following]
+    cross = x1 * y2 - x2 * y1
+
+    area2 = np.add.reduceat(cross, starts)
+    x = np.add.reduceat((x1 + x2) * cross, starts)
+    y = np.add.reduceat((y1 + y2) * cross, starts)
+    scale = np.maximum.reduceat(np.abs(relative).max(axis=1), starts)
+
+    lines = np.abs(area2) <= 2 * CENTROID_AREA_TOLERANCE * scale * scale
+    divisor = np.where(lines, 1.0, 3 * area2)
+    means = np.add.reduceat(relative, starts, axis=0) / counts[:, None]
+    centroid_x = origins[:, 0] + np.where(lines, means[:, 0], x / divisor)
+    centroid_y = origins[:, 1] + np.where(lines, means[:, 1], y / divisor)
+    return list(zip(centroid_x.tolist(), centroid_y.tolist()))
+
+def read_matches(filelike) -> list[tuple[str, str]]:
+    # Matched names from the output of surface_match.py, with or without
+    # --metrics
+    matches = []
+    for line in filelike:
+        parts = line.rstrip('\r\n').split('\t')
+        if len(parts) >= 2:
+            matches.append((parts[0], parts[1]))
+    return matches
+
+# Polygons formatted before each write to the output
+WRITE_CHUNK_POLYGONS = 1024
+
+# Polygon styles, without matches, and with matches for the matched and
+# unmatched ones, and the style of the lines joining matched polygons
+STYLE = "fill:none;stroke:black;stroke-width:0.1"
+MATCHED_STYLE = "fill:green;fill-opacity:0.2;stroke:green;stroke-width:0.1"
+UNMATCHED_STYLE = "fill:red;fill-opacity:0.2;stroke:red;stroke-width:0.1"
+CONNECTOR_STYLE = "stroke:blue;stroke-width:0.1"
+
+def write_svg(polygons: Iterable[Polygon], font_size: float, out: TextIO, viewbox: str,
+              min_label: float = 0, size: tuple[int, int] = (2560, 1080),
+              matches: Optional[list[tuple[str, str]]] = None) -> int:
+    # Write the document to out as the polygons come, WRITE_CHUNK_POLYGONS
+    # at a time. Polygons narrower or shorter than min_label get no label.
+    # With matches, pairs of names from read_matches, matched and unmatched
+    # polygons are coloured apart and each pair drawn is joined by a line
+    # between centroids. Returns the number of polygons written.
+    out.write('<?xml version="1.0" encoding="UTF-8" ?>\n')
+    out.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{size[0]}" height="{size[1]}" viewBox="{viewbox}">\n')
+
+    # Centroids of the matched polygons by name, for the connectors
+    matched = None
+    centroids: dict[str, tuple[float, float]] = {}
+    if matches is not None:
+        matched = {name for pair in matches for name in pair}
+
+    count = 0
+    chunk = []
+    for p in polygons:
+        chunk.append(p)
+        if len(chunk) >= WRITE_CHUNK_POLYGONS:
+            out.write(polygon_elements(chunk, font_size, min_label, matched, centroids))
+            count += len(chunk)
+            chunk.clear()
+    out.write(polygon_elements(chunk, font_size, min_label, matched, centroids))
+    count += len(chunk)
+
+    if matches is not None:
+        lines = []
+        drawn = set()
+        for name1, name2 in matches:
+            pair = (name1, name2) if name1 <= name2 else (name2, name1)
+            if pair in drawn or name1 not in centroids or name2 not in centroids:
+                continue
+            drawn.add(pair)
+            (x1, y1), (x2, y2) = centroids[name1], centroids[name2]
+            lines.append(f'  <line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" style="{CONNECTOR_STYLE}" />\n')
+            if len(lines) >= WRITE_CHUNK_POLYGONS:
+                out.write("".join(lines))
+                lines.clear()
+        out.write("".join(lines))
+
+    out.write('</svg>\n')
+    return count
+
+def polygon_elements(polygons: list[Polygon], font_size: float, min_label: float,
+                     matched: Optional[set[str]], centroids: dict[str, tuple[float, float]]) -> str:
+    # Polygon and label elements of write_svg. Adds the centroids of matched
+    # polygons to centroids.
     lines = []
-    viewbox = calculate_viewbox(polygons)
-    lines.append('<?xml version="1.0" encoding="UTF-8" ?>\n')
-    lines.append(f'<svg xmlns="http://www.w3.org/2000/svg" width="2560" height="1080" viewBox="{viewbox}">\n')
+    for p, (centroid_x, centroid_y) in zip(polygons, polygon_centroids(polygons)):
+        if matched is None:
+            style = STYLE
+        elif p.name in matched:
+            style = MATCHED_STYLE
+            centroids[p.name] = (centroid_x, centroid_y)
+        else:
+            style = UNMATCHED_STYLE
 
-    for p in polygons:
         points_str = ' '.join([f'{x},{y}' for x, y in p.points])
-        lines.append(f'  <polygon points="{points_str}" style="fill:none;stroke:black;stroke-width:0.1" />\n')
+        lines.append(f'  <polygon points="{points_str}" style="{style}" />\n')
 
-        centroid_x, centroid_y = find_centroid(p.points)
+        if min_label > 0 and (p.max_x() - p.min_x() < min_label or p.max_y() - p.min_y() < min_label):
+            continue
         lines.append(f'  <text text-anchor="middle" dominant-baseline="middle" x="{centroid_x}" y="{centroid_y}" font-family="Verdana" font-size="{font_size}" fill="black">{p.name}</text>\n')
-
-    lines.append('</svg>\n')
     return "".join(lines)
 
+def write_svg_file(polygons: list[Polygon], font_size: float) -> str:
+    out = io.StringIO()
+    write_svg(polygons, font_size, out, calculate_viewbox(polygons))
+    return out.getvalue()
+
+# Buffer size of the output file
+OUTPUT_BUFFER = 1 << 20
+
+def open_output(path: Optional[str], compress: bool) -> TextIO:
+    # The output file, or stdout if path is None, gzip compressed if
+    # compress is set or the path ends in .svgz
+    if path is None:
+        if compress:
+            return gzip.open(sys.stdout.buffer, 'wt', encoding='utf-8')
+        return sys.stdout
+    if compress or path.lower().endswith('.svgz'):
+        return gzip.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER)
+
+# Pixel size of each tile, and of its picture on the index page
+TILE_PIXELS = 1024
+INDEX_PIXELS = 256
+
+def tile_polygons(polygons: list[Polygon], tile_size: float) -> dict[tuple[int, int], list[Polygon]]:
+    # Polygons by each tile of tile_size square their box overlaps, in input
+    # order. Tile (i, j) covers x from i * tile_size and y from j * tile_size.
+    # A polygon ending on the edge of a tile is not in the next tile
+    tiles: dict[tuple[int, int], list[Polygon]] = {}
+    for p in polygons:
+        first_i = floor(p.min_x() / tile_size)
+        first_j = floor(p.min_y() / tile_size)
+        for i in range(first_i, max(first_i, ceil(p.max_x() / tile_size) - 1) + 1):
+            for j in range(first_j, max(first_j, ceil(p.max_y() / tile_size) - 1) + 1):
+                tiles.setdefault((i, j), []).append(p)
+    return tiles
+
+def iter_polygon_file_3d(filelike) -> Iterator[list]:
+    # Name then all coordinates of each line, as read by iter_polygon_file
+    for line in filelike:
+        parts = line.split("\t") if "\t" in line else line.split(",")
+        yield [parts[0].strip()] + [float(x) for x in parts[1:]]
+
+def plane_polygons(filelike) -> Iterator[tuple[str, list[Polygon]]]:
+    # Polygons of a 3d file grouped by plane as surface_match groups them,
+    # each group in the 2d coordinates of its plane. Yields the plane key and
+    # polygons of each plane in order of first surface. Surfaces with fewer
+    # than 3 points, or on no plane, are left out.
+    names = []
+    coords = array('d')
+    vertices = array('d')
+    starts = array('q', [0])
+    for p in iter_polygon_file_3d(filelike):
+        if len(p) < 10:
+            continue
+        names.append(p[0])
+        coords.extend(p[1:10])
+        vertices.extend(p[1:len(p) - (len(p) - 1) % 3])
+        starts.append(len(vertices))
+
+    table = surface_match.SurfaceTable(names, coords, vertices, starts)
+    for group in surface_match.group_table(table):
+        canonical = table.canonical(group[0])
+        transform_matrix = surface_match.group_transform(table.plane_eq(group[0])) if canonical is not None else None
+        if transform_matrix is None:
+            continue
+        group_table = table.subtable(group)
+        _, projected = surface_match.project_table_polygons(group_table, transform_matrix)
+        yield (surface_match.plane_key(canonical),
+               [Polygon(name, [(x, -y) for x, y in points]) for name, points in zip(group_table.names, projected)])
+
+def write_pages(pages: Iterable[tuple[str, str, list[Polygon]]], font_size: float, directory: str, compress: bool,
+                min_label: float, size: tuple[int, int], matches: Optional[list[tuple[str, str]]] = None) -> list[tuple[str, str, int]]:
+    # Write one SVG for each name, viewbox and polygons of pages into
+    # directory. Returns the file name, name and polygon count of each.
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for name, viewbox, polygons in pages:
+        filename = f'{name}.svgz' if compress else f'{name}.svg'
+        with open_output(os.path.join(directory, filename), compress) as out:
+            count = write_svg(polygons, font_size, out, viewbox, min_label, size, matches)
+        written.append((filename, name, count))
+    return written
+
+def write_tiles(polygons: list[Polygon], font_size: float, directory: str, tile_size: float,
+                compress: bool = False, min_label: float = 0, matches: Optional[list[tuple[str, str]]] = None) -> int:
+    # One SVG per tile of tile_size with any polygon in it, and index.html
+    # laying them out in place. Returns the number of tiles.
+    tiles = tile_polygons(polygons, tile_size)
+    pages = ((f'tile_{i}_{j}', f'{i * tile_size} {j * tile_size} {tile_size} {tile_size}', tiles[i, j])
+             for i, j in sorted(tiles))
+    written = {name: filename for filename, name, count in
+               write_pages(pages, font_size, directory, compress, min_label, (TILE_PIXELS, TILE_PIXELS), matches)}
+
+    lines = ['<!DOCTYPE html>\n', '<html><head><meta charset="utf-8"><title>Tiles</title></head><body>\n',
+             '<table style="border-collapse:collapse">\n']
+    if tiles:
+        columns = range(min(i for i, j in tiles), max(i for i, j in tiles) + 1)
+        for j in range(min(j for i, j in tiles), max(j for i, j in tiles) + 1):
+            lines.append('<tr>')
+            for i in columns:
+                if (i, j) in tiles:
+                    filename = html.escape(written[f'tile_{i}_{j}'])
+                    lines.append(f'<td style="padding:0"><a href="{filename}"><img src="{filename}" width="{INDEX_PIXELS}" height="{INDEX_PIXELS}"></a></td>')
+                else:
+                    lines.append(f'<td style="padding:0;width:{INDEX_PIXELS}px;height:{INDEX_PIXELS}px"></td>')
+            lines.append('</tr>\n')
+    lines.append('</table></body></html>\n')
+    with open(os.path.join(directory, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(''.join(lines))
+    return len(tiles)
+
+def write_planes(planes: Iterable[tuple[str, list[Polygon]]], font_size: float, directory: str,
+                 compress: bool = False, min_label: float = 0, matches: Optional[list[tuple[str, str]]] = None) -> int:
+    # One SVG per plane of plane_polygons, fitted to its polygons, and
+    # index.html listing them. Returns the number of planes.
+    keys = {}
+
+    def keyed_pages():
+        for k, (key, polygons) in enumerate(planes, 1):
+            keys[f'plane_{k}'] = key
+            yield f'plane_{k}', calculate_viewbox(polygons), polygons
+
+    written = write_pages(keyed_pages(), font_size, directory, compress, min_label, (2560, 1080), matches)
+
+    lines = ['<!DOCTYPE html>\n', '<html><head><meta charset="utf-8"><title>Planes</title></head><body>\n', '<ul>\n']
+    for filename, name, count in written:
+        lines.append(f'<li><a href="{html.escape(filename)}">{name}</a> {html.escape(keys[name])}, {count} surfaces</li>\n')
+    lines.append('</ul></body></html>\n')
+    with open(os.path.join(directory, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(''.join(lines))
+    return len(written)
+
 
 def main():
 
     dimensions = 2
     filename = None
     font_size = 1
+    output = None
+    compress = False
+    tile_size = None
+    planes = False
+    min_label = None
+    matches_file = None
+
+    def float_value(option):
+        nonlocal idx
+        if idx >= len(sys.argv):
+            print(f"Error: {option} requires a value")
+            sys.exit(1)
+        a = sys.argv[idx]
+        idx += 1
+        try:
+            value = float(a)
+        except ValueError:
+            value = -1.0
+        if value < 0 or (value == 0 and option == '--tile'):
+            print(f"Error: Invalid {option} value '{a}'")
+            sys.exit(1)
+        return value
 
     idx = 1
     while (idx < len(sys.argv)):
@@ -118,45 +418,98 @@ def main():
         if (a == '-3'):
             dimensions = 3
         elif a == "-h" or a == "--help":
-            print("Usage: idf_surface_draw.py [--fs FONTSIZE] [-3] [filename]")
+            print("Usage: idf_surface_draw.py [--fs FONTSIZE] [-3] [-o OUTPUT] [--gzip] [--tile SIZE | --planes] [--min-label SIZE] [--matches MATCHES] [filename]")
             print("filename: The name of file with contents like: ")
             print("3d")
             print("name1, x1, y1, x2, y2, x3, y3, ...")
             print("2d")
             print("name1, x1, y1, x2, y2, ...")
+            print("The SVG goes to OUTPUT or stdout, gzip compressed with --gzip or if OUTPUT ends in .svgz")
+            print("--tile SIZE: one SVG per SIZE square tile, and index.html, in the OUTPUT directory")
+            print("--planes: one SVG per plane of a 3d file, drawn in the plane, and index.html, in the OUTPUT directory")
+            print("--min-label SIZE: no label on polygons narrower or shorter than SIZE, default FONTSIZE")
+            print("                  with --tile or --planes, else 0")
+            print("--matches MATCHES: surface_match.py output; matched surfaces are drawn green, unmatched red,")
+            print("                   and matched pairs joined by a line between their centroids")
             sys.exit(0)
         elif a == "--fs":
+            font_size = float_value(a)
+        elif a == "--tile":
+            tile_size = float_value(a)
+        elif a == "--min-label":
+            min_label = float_value(a)
+        elif a == "--planes":
+            planes = True
+        elif a == "-o":
             if idx >= len(sys.argv):
-                print("Error: --fs requires a value")
+                print("Error: -o requires a file name")
                 sys.exit(1)
-            a = sys.argv[idx]
+            output = sys.argv[idx]
             idx += 1
-            try:
-                font_size = float(a)
-            except ValueError:
-                print(f"Error: Invalid font size '{a}'")
+        elif a == "--matches":
+            if idx >= len(sys.argv):
+                print("Error: --matches requires a file name")
                 sys.exit(1)
+            matches_file = sys.argv[idx]
+            idx += 1
+        elif a == "--gzip":
+            compress = True
         else:
-            filename = sys.argv[idx]
-
+            filename = a
 
-    if filename is not None:
-        with open(filename, 'r') as file:
-            polygons = read_polygon_file(file, dimensions)
-    elif filename is None and sys.stdin.isatty():
+    if filename is None and sys.stdin.isatty():
         print("Please specify a filename")
         sys.exit(1)
-    elif not sys.stdin.isatty():
-        polygons = read_polygon_file(sys.stdin, dimensions)
-    else:
-        raise ValueError("Should not be possible")
-
 
-    print(f'Found {len(polygons)} polygons', file=sys.stderr)
-    print(polygons, file=sys.stderr)
+    matches = None
+    if matches_file is not None:
+        with open(matches_file, 'r') as file:
+            matches = read_matches(file)
+
+    if tile_size is not None or planes:
+        if output is None:
+            print("Error: --tile and --planes require an output directory, -o OUTPUT")
+            sys.exit(1)
+        if planes and dimensions != 3:
+            print("Error: --planes requires 3d input, -3")
+            sys.exit(1)
+        if min_label is None:
+            min_label = font_size
+
+        file = open(filename, 'r') if filename is not None else sys.stdin
+        try:
+            if planes:
+                count = write_planes(plane_polygons(file), font_size, output, compress, min_label, matches)
+                print(f'Wrote {count} planes', file=sys.stderr)
+            else:
+                polygons = read_polygon_file(file, dimensions)
+                count = write_tiles(polygons, font_size, output, tile_size, compress, min_label, matches)
+                print(f'Found {len(polygons)} polygons, wrote {count} tiles', file=sys.stderr)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        return
+
+    out = open_output(output, compress)
+    try:
+        if filename is not None:
+            # The viewbox comes from a first pass over the file, so the
+            # polygons are never all in memory
+            with open(filename, 'r') as file:
+                viewbox = viewbox_string(polygon_bounds(iter_polygon_file(file, dimensions)))
+                file.seek(0)
+                count = write_svg(iter_polygon_file(file, dimensions), font_size, out, viewbox, min_label or 0, matches=matches)
+        else:
+            # stdin can only be read once
+            polygons = read_polygon_file(sys.stdin, dimensions)
+            count = write_svg(polygons, font_size, out, calculate_viewbox(polygons), min_label or 0, matches=matches)
+    finally:
+        if out is sys.stdout:
+            out.flush()
+        else:
+            out.close()
 
-    output = write_svg_file(polygons, font_size)
-    print(output)
+    print(f'Found {count} polygons', file=sys.stderr)
 
 
 if __name__ == '__main__':
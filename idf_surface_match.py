@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# idf_surfaces.py and surface_match.py --triangles in one process. The world
+# coordinates go straight into the matcher instead of through TSV text.
+
+import sys
+import time
+from array import array
+
+import idf_surfaces
+import surface_match
+
+
+def idf_table(lines, construction_filter=None, idf=False) -> tuple[list[str], array, array, array]:
+    # Names and packed coordinates of the first 3 vertices of each surface,
+    # in the same order as idf_surfaces.py prints them. lines are tab
+    # separated objects, or IDF text if idf is True.
+    if idf:
+        zones, surfaces = idf_surfaces.read_idf(lines)
+    else:
+        zones, surfaces = idf_surfaces.read_objects(lines)
+
+    return surface_table(zones, surfaces, construction_filter)
+
+
+def surface_table(zones, surfaces, construction_filter=None) -> tuple[list[str], array, array, array]:
+    # Same as surface_match.read_surface_table on the output of idf_surfaces.py
+    return points_table(idf_surfaces.transform_surfaces(zones, surfaces, construction_filter))
+
+
+def points_table(surfaces) -> tuple[list[str], array, array, array]:
+    # Same as surface_table, for surfaces already in world coordinates
+    names = []
+    coords = array('d')
+    vertices = array('d')
+    starts = array('q', [0])
+    for s in surfaces:
+        if len(s.points) < 9:
+            print(f'Skipping surface {s.name}: fewer than 3 vertices', file=sys.stderr)
+            continue
+        names.append(s.name)
+        coords.extend(s.points[:9])
+        vertices.extend(s.points[:len(s.points) - len(s.points) % 3])
+        starts.append(len(vertices))
+
+    return names, coords, vertices, starts
+
+
+def main():
+    construction_filter = None
+    if '-h' in sys.argv or '--help' in sys.argv:
+        print('Usage: idf_surface_match.py [-c CONSTRUCTION] [-2] [--all] [--pairwise] [--box] [--metrics] [--backend python|numpy] [--jobs N] [--index PATH] [--profile[=PATH]] [--tol NORMAL[,OFFSET]] [--idf] [input.idf] < input')
+        print('Same input as idf_surfaces.py, same output as surface_match.py --triangles: IDF surfaces')
+        print('are polygons, so one of 3 vertices is a triangle, not a rectangle given by 3 corners')
+        sys.exit(0)
+
+    if '-c' in sys.argv:
+        idx = sys.argv.index('-c')
+        if idx + 1 >= len(sys.argv):
+            print('Missing construction name after -c')
+            sys.exit(1)
+        construction_filter = sys.argv[idx + 1]
+
+    # Options taking a value, so the value isn't mistaken for a file name
+    with_value = {'-c', '--backend', '--jobs', '-j', '--index', '--tol'}
+    args = [sys.argv[0]]
+    idx = 1
+    while idx < len(sys.argv):
+        if sys.argv[idx] in with_value:
+            idx += 2
+            continue
+        args.append(sys.argv[idx])
+        idx += 1
+
+    options = surface_match.match_options(sys.argv)
+    # IDF surfaces are polygons, a 3 vertex one is a triangle, so always as
+    # --triangles
+    options['corner_boxes'] = False
+    profile = surface_match.start_profile() if options['profile'] is not None else None
+    start = time.perf_counter()
+
+    names, coords, vertices, starts = surface_table(*idf_surfaces.read_input(args), construction_filter)
+    if profile is not None:
+        profile.lap('parse', start)
+        profile.count('surfaces', len(names))
+
+    surface_match.print_matches(names, coords, vertices, starts, options)
+    surface_match.write_profile(options['profile'])
+
+
+if __name__ == '__main__':
+    main()
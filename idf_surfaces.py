@@ -1,14 +1,34 @@
 #!/usr/bin/env python3
 import sys
 import math
+import mmap
+import re
 
 class Zone:
     def __init__(self, name, rotation, x_origin, y_origin, z_origin) -> None:
         self.name = name
         self.rotation = float(rotation)
-        self.x_origin = x_origin
-        self.y_origin = y_origin
-        self.z_origin = z_origin
+        self.x_origin = float(x_origin)
+        self.y_origin = float(y_origin)
+        self.z_origin = float(z_origin)
+
+    def rotated(self) -> bool:
+        return abs(self.rotation) > 0.001
+
+    def matrix(self) -> list[list[float]]:
+        # Affine transform from zone to world coordinates, 3 rows of 4:
+        # counter-clockwise rotation about z, then the origin as translation.
+        if self.rotated():
+            radians = math.radians(-self.rotation)
+            cos = math.cos(radians)
+            sin = math.sin(radians)
+        else:
+            cos = 1.0
+            sin = 0.0
+
+        return [[cos, -sin, 0.0, self.x_origin],
+                [sin, cos, 0.0, self.y_origin],
+                [0.0, 0.0, 1.0, self.z_origin]]
 
 class Surface:
     def __init__(self, name: str, construction: str, zone: str, points) -> None:
@@ -17,96 +37,232 @@ class Surface:
         self.points = points
         self.zone = zone
 
-def main():
+class SubSurface(Surface):
+    def __init__(self, name: str, construction: str, host: str, points, surface_type: str = '') -> None:
+        # Window, door or other sub-surface of the host surface. Its vertices
+        # are in the coordinates of the host's zone, set by transform_surfaces.
+        super().__init__(name, construction, '', points)
+        self.host = host
+        self.surface_type = surface_type
+
+# Object classes read from the IDF, lower case
+SURFACE_CLASSES = {'wall:detailed', 'floor:detailed', 'roofceiling:detailed'}
+SUB_SURFACE_CLASSES = {'fenestrationsurface:detailed'}
+IDF_CLASSES = {'zone'} | SURFACE_CLASSES
+
+IDF_SEPARATOR = re.compile('[,;]')
+
+
+def object_record(fields: list[str], sub_surfaces: bool = False):
+    # Zone or Surface from the fields of an IDF object, class name first.
+    # With sub_surfaces, also SubSurface. None for other classes.
+    object_class = fields[0].lower()
+
+    if object_class == 'zone':
+        # Blank origin fields default to 0
+        values = [(f or '0') for f in (fields[2:6] + [''] * 4)[:4]]
+        return Zone(fields[1], *values)
+
+    if object_class in SURFACE_CLASSES:
+        return Surface(fields[1], fields[2], fields[3], fields[11:])
+
+    if sub_surfaces and object_class in SUB_SURFACE_CLASSES:
+        # Name, type, construction, host surface, ..., vertex count, vertices
+        return SubSurface(fields[1], fields[3], fields[4], fields[10:], fields[2])
+
+    return None
 
-    construction_filter = None
-    idx = 1
-    while idx < len(sys.argv):
-        if sys.argv[idx] == '-h':
-            print('Usage: idf_surfaces.py < input.idf > output.idf')
-            sys.exit(0)
-        elif sys.argv[idx] == "-c":
-            if idx + 1 >= len(sys.argv):
-                print('Missing construction name after -c')
-                sys.exit(1)
-            construction_filter = sys.argv[idx + 1]
-            idx += 2
-        else:
-            print('Unrecognized option: ' + sys.argv[idx])
-            sys.exit(1)
 
+def read_objects(lines, sub_surfaces: bool = False) -> tuple[list[Zone], list[Surface]]:
+    # Lines of tab separated IDF objects, one object per line
+    return collect_records(object_record([f.strip() for f in line.split('\t')], sub_surfaces) for line in lines)
+
+
+def read_idf(lines, sub_surfaces: bool = False) -> tuple[list[Zone], list[Surface]]:
+    # Lines of IDF text, see iter_idf_objects
+    classes = IDF_CLASSES | SUB_SURFACE_CLASSES if sub_surfaces else IDF_CLASSES
+    return collect_records(object_record(fields, sub_surfaces) for fields in iter_idf_objects(lines, classes))
+
+
+def collect_records(records) -> tuple[list[Zone], list[Surface]]:
     zones = []
     surfaces = []
 
-    for line in sys.stdin:
-        split_line = [f.strip() for f in line.split('\t')]
+    for record in records:
+        if isinstance(record, Zone):
+            zones.append(record)
+        elif isinstance(record, Surface):
+            surfaces.append(record)
+
+    return zones, surfaces
+
+
+def iter_idf_objects(lines, classes=None):
+    # Yield the fields of each object in IDF text: fields separated by commas,
+    # objects ended by semicolons, comments from '!' to the end of the line.
+    # Objects may span any number of lines. classes is a set of lower case
+    # class names to keep, others are skipped without splitting their fields.
+    fields: list[str] = []
+    partial = ''
+    skipping = False
+
+    for line in lines:
+        code = line.split('!', 1)[0]
+        pos = 0
+        end = len(code)
+
+        while pos < end:
+            if skipping:
+                pos = code.find(';', pos)
+                if pos < 0:
+                    break
+                pos += 1
+                skipping = False
+                continue
 
-        if split_line[0] == 'Zone':
-            z = Zone(split_line[1], split_line[2], split_line[3], split_line[4], split_line[5])
-            zones.append(z)
+            match = IDF_SEPARATOR.search(code, pos)
+            if match is None:
+                partial += code[pos:]
+                break
 
-        elif split_line[0] == 'Wall:Detailed':
-            s = Surface(split_line[1], split_line[2], split_line[3], split_line[11:])
-            surfaces.append(s)
+            fields.append((partial + code[pos:match.start()]).strip())
+            partial = ''
+            pos = match.end()
 
-        elif split_line[0] == 'Floor:Detailed':
-            s = Surface(split_line[1], split_line[2], split_line[3], split_line[11:])
-            surfaces.append(s)
+            if match.group() == ';':
+                if classes is None or fields[0].lower() in classes:
+                    yield fields
+                fields = []
+            elif len(fields) == 1 and classes is not None and fields[0].lower() not in classes:
+                fields = []
+                skipping = True
 
-        elif split_line[0] == 'RoofCeiling:Detailed':
-            s = Surface(split_line[1], split_line[2], split_line[3], split_line[11:])
-            surfaces.append(s)
 
+def idf_file_lines(path: str, use_mmap: bool = True):
+    # Lines of an IDF file, read through a memory map unless use_mmap is False
+    with open(path, 'rb') as f:
+        if use_mmap:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                return
+            with data:
+                for line in iter(data.readline, b''):
+                    yield line.decode('utf-8', errors='replace')
+        else:
+            for line in f:
+                yield line.decode('utf-8', errors='replace')
+
+
+def transform_surfaces(zones: list[Zone], surfaces: list[Surface], construction_filter=None) -> list[Surface]:
+    # Convert the zone relative vertices to world coordinates, in place.
+    # Returns the surfaces passing the construction filter, with float points.
+    # The vertices of all surfaces in a zone are transformed together.
+    # Sub-surfaces take the zone of their host surface.
     zone_dict = { z.name: z for z in zones }
 
+    host_zones = { s.name: s.zone for s in surfaces if not isinstance(s, SubSurface) }
+    for s in surfaces:
+        if isinstance(s, SubSurface):
+            if s.host not in host_zones:
+                raise KeyError(s.host)
+            s.zone = host_zones[s.host]
+
+    transformed = []
+    zone_surfaces: dict[str, list[Surface]] = {}
     for s in surfaces:
         if construction_filter is not None and s.construction != construction_filter:
             continue
 
-        z = zone_dict[s.zone]
-
-        if abs(z.rotation) > 0.001:
-            # Do counter-clockwise rotation first on X-Y coordinates
-            current_x = None
-            current_y = None
-            for i in range(len(s.points)):
-                mod_value = i % 3
-                if mod_value == 0:
-                    current_x = float(s.points[i])
-                elif mod_value == 1:
-                    current_y = float(s.points[i])
-                elif mod_value == 2:
-                    if current_x is None or current_y is None:
-                        raise Exception('Unexpected error')
-
-                    radians = math.radians(-z.rotation)
-                    cos = math.cos(radians)
-                    sin = math.sin(radians)
-
-                    new_x = current_x * cos - current_y * sin
-                    new_y = current_x * sin + current_y * cos
-                    s.points[i - 2] = new_x
-                    s.points[i - 1] = new_y
-
-
-        for i in range(len(s.points)):
-            mod_value = i % 3
-            if mod_value == 0:
-                s.points[i] = float(s.points[i]) + float(z.x_origin)
-            elif mod_value == 1:
-                s.points[i] = float(s.points[i]) + float(z.y_origin)
-            elif mod_value == 2:
-                s.points[i] = float(s.points[i]) + float(z.z_origin)
+        if s.zone not in zone_dict:
+            raise KeyError(s.zone)
+
+        zone_surfaces.setdefault(s.zone, []).append(s)
+        transformed.append(s)
+
+    for zone_name, members in zone_surfaces.items():
+        transform_zone(zone_dict[zone_name], members)
+
+    return transformed
+
+
+def transform_zone(z: Zone, surfaces: list[Surface]):
+    # Apply the zone matrix to every vertex of the surfaces, in place.
+    # Do counter-clockwise rotation first on X-Y coordinates, then translate.
+    (cos, minus_sin, _, x_origin), (sin, _, _, y_origin), (_, _, _, z_origin) = z.matrix()
+    rotated = z.rotated()
 
     for s in surfaces:
-        if construction_filter is not None and s.construction != construction_filter:
-            continue
+        points = [float(p) for p in s.points]
+        count = len(points)
+        i = 0
+        while i + 2 < count:
+            x = points[i]
+            y = points[i + 1]
+            if rotated:
+                points[i] = (x * cos + y * minus_sin) + x_origin
+                points[i + 1] = (x * sin + y * cos) + y_origin
+            else:
+                points[i] = x + x_origin
+                points[i + 1] = y + y_origin
+            points[i + 2] += z_origin
+            i += 3
+
+        # Trailing coordinates of an incomplete vertex are only translated
+        if i < count:
+            points[i] += x_origin
+        if i + 1 < count:
+            points[i + 1] += y_origin
+
+        s.points = points
+
+
+def read_input(argv: list[str], sub_surfaces: bool = False) -> tuple[list[Zone], list[Surface]]:
+    # Zones and surfaces from a native IDF file named in argv, native IDF text
+    # on stdin with --idf, or else tab separated objects on stdin.
+    filenames = [a for a in argv[1:] if not a.startswith('-')]
+    if filenames:
+        return read_idf(idf_file_lines(filenames[-1]), sub_surfaces)
+    if '--idf' in argv:
+        return read_idf(sys.stdin, sub_surfaces)
+    return read_objects(sys.stdin, sub_surfaces)
+
+
+def main():
+
+    construction_filter = None
+    args = [sys.argv[0]]
+    idx = 1
+    while idx < len(sys.argv):
+        if sys.argv[idx] == '-h':
+            print('Usage: idf_surfaces.py [-c CONSTRUCTION] [--idf] [input.idf] < input > output.tsv')
+            print('input.idf or --idf: IDF text, otherwise tab separated objects, one per line')
+            print('Pipe into surface_match.py --triangles to match IDF surfaces of 3 vertices as triangles,')
+            print('as idf_surface_match.py does')
+            sys.exit(0)
+        elif sys.argv[idx] == "-c":
+            if idx + 1 >= len(sys.argv):
+                print('Missing construction name after -c')
+                sys.exit(1)
+            construction_filter = sys.argv[idx + 1]
+            idx += 2
+        elif sys.argv[idx] == '--idf' or not sys.argv[idx].startswith('-'):
+            args.append(sys.argv[idx])
+            idx += 1
+        else:
+            print('Unrecognized option: ' + sys.argv[idx])
+            sys.exit(1)
 
+    zones, surfaces = read_input(args)
+
+    for s in transform_surfaces(zones, surfaces, construction_filter):
         fields = [s.name]
         for p in s.points:
             fields.append(str(p))
 
         print('\t'.join(fields))
 
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# Hosts and partners of windows, doors and other FenestrationSurface:Detailed
+# objects. The host of a sub-surface is the base surface in its plane that
+# contains it, found through a grid of the projected boxes of the plane group
+# rather than by testing every surface. The partner of a sub-surface is the
+# coplanar sub-surface it overlaps, such as the window on the other side of an
+# interzone wall, matched as surface_match.py matches base surfaces.
+
+import sys
+from math import floor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import idf_surface_match
+import idf_surfaces
+import surface_match
+from surface_match import SurfaceTable
+
+
+class BoxGrid:
+    __slots__ = ('extents', 'cell_size', 'cells', 'large')
+
+    def __init__(self, extents: Sequence[float]):
+        """
+        Uniform grid over packed 2D boxes, min x, max x, min y, max y each,
+        with cells sized as in surface_match.first_overlaps. Boxes spanning
+        more than surface_match.LARGE_BOX_CELLS cells are kept in a list
+        instead and always checked.
+        :param extents: the packed boxes
+        """
+        self.extents = extents
+        self.cell_size = surface_match.grid_cell_size(extents)
+
+        # Cell lists and the large boxes are built in index order, so each
+        # stays sorted
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        self.large: List[int] = []
+        for i in range(len(extents) // 4):
+            if surface_match.box_cell_count(extents, i, self.cell_size) > surface_match.LARGE_BOX_CELLS:
+                self.large.append(i)
+                continue
+            for cell in self.box_cells(extents[4 * i], extents[4 * i + 1], extents[4 * i + 2], extents[4 * i + 3]):
+                self.cells.setdefault(cell, []).append(i)
+
+    def box_cells(self, min_x: float, max_x: float, min_y: float, max_y: float):
+        size = self.cell_size
+        for cx in range(floor(min_x / size), floor(max_x / size) + 1):
+            for cy in range(floor(min_y / size), floor(max_y / size) + 1):
+                yield cx, cy
+
+    def containing(self, min_x: float, max_x: float, min_y: float, max_y: float, tolerance: float = 0.000001) -> List[int]:
+        # Boxes containing the given box, within tolerance, in index order.
+        # A containing box on the grid covers the cell of the box's centre.
+        e = self.extents
+        size = self.cell_size
+        found = []
+        candidates = self.cells.get((floor((min_x + max_x) / 2 / size), floor((min_y + max_y) / 2 / size)), [])
+        for i in (sorted(candidates + self.large) if self.large else candidates):
+            if (e[4 * i] <= min_x + tolerance and e[4 * i + 1] >= max_x - tolerance and
+                    e[4 * i + 2] <= min_y + tolerance and e[4 * i + 3] >= max_y - tolerance):
+                found.append(i)
+        return found
+
+
+class HostIndex:
+    def __init__(self, table: SurfaceTable):
+        """
+        Base surfaces grouped by plane, for finding the surface containing a
+        sub-surface. The grid and polygons of a group are built the first
+        time a sub-surface lands in it.
+        :param table: base surfaces with their vertices
+        """
+        self.table = table
+        self.groups = surface_match.group_table(table)
+        self.representatives = [table.canonical(group[0]) for group in self.groups]
+        self.buckets: Dict[Tuple[int, ...], List[int]] = {}
+        for k, representative in enumerate(self.representatives):
+            if representative is not None:
+                self.buckets.setdefault(next(iter(surface_match.bucket_keys(representative))), []).append(k)
+
+        # By group: transform, polygons, then by surface the triangles and
+        # the convex outline or None, and the grid
+        self.planes: Dict[int, Optional[tuple]] = {}
+
+    def plane(self, k: int) -> Optional[tuple]:
+        if k not in self.planes:
+            group = self.table.subtable(self.groups[k])
+            transform_matrix = surface_match.group_transform(group.plane_eq(0))
+            if transform_matrix is None:
+                self.planes[k] = None
+            else:
+                extents, polygons = surface_match.project_table_polygons(group, transform_matrix)
+                self.planes[k] = (transform_matrix, polygons, {}, {}, BoxGrid(extents))
+        return self.planes[k]
+
+    def hosts(self, canonical: Optional[Tuple[float, float, float, float]], vertices: Sequence[float]) -> List[str]:
+        # Names of the base surfaces containing the polygon, in input order
+        if canonical is None:
+            return []
+        k = surface_match.find_group(self.buckets, self.representatives, canonical)
+        if k is None:
+            return []
+        plane = self.plane(k)
+        if plane is None:
+            return []
+
+        transform_matrix, polygons, triangles, convex, grid = plane
+        (t00, t01, t02), (t10, t11, t12), _ = transform_matrix
+        polygon = [(vertices[o] * t00 + vertices[o + 1] * t01 + vertices[o + 2] * t02,
+                    vertices[o] * t10 + vertices[o + 1] * t11 + vertices[o + 2] * t12)
+                   for o in range(0, len(vertices) - 2, 3)]
+
+        found = []
+        polygon_triangles = None
+        for i in grid.containing(min(p[0] for p in polygon), max(p[0] for p in polygon),
+                                 min(p[1] for p in polygon), max(p[1] for p in polygon)):
+            if i not in convex:
+                convex[i] = convex_outline(polygons[i])
+            if convex[i] is not None:
+                # Inside a convex host if every vertex is
+                contained = all(inside_convex(convex[i], p) for p in polygon)
+            else:
+                if polygon_triangles is None:
+                    polygon_triangles = surface_match.triangulate(polygon)
+                if i not in triangles:
+                    triangles[i] = surface_match.triangulate(polygons[i])
+                shared = surface_match.intersection_area(polygon_triangles, triangles[i])
+                area = abs(surface_match.polygon_area(polygon))
+                contained = shared >= area - max(surface_match.AREA_TOLERANCE, area * 0.000001)
+            if contained:
+                found.append(self.groups[k][i])
+        return [self.table.names[i] for i in found]
+
+
+# How far outside the edges of a convex host a sub-surface vertex may be
+CONTAINMENT_TOLERANCE = 0.000001
+
+
+def convex_outline(points: Sequence[Tuple[float, float]]) -> Optional[List[Tuple[float, float]]]:
+    # The points counter-clockwise without repeats if they make a convex
+    # polygon, else None
+    outline = [p for k, p in enumerate(points) if p != points[k - 1]]
+    if surface_match.polygon_area(outline) < 0:
+        outline.reverse()
+    count = len(outline)
+    if count < 3:
+        return None
+    for k in range(count):
+        if surface_match.turn(outline[k - 2], outline[k - 1], outline[k]) < 0:
+            return None
+    return outline
+
+
+def inside_convex(outline: List[Tuple[float, float]], point: Tuple[float, float]) -> bool:
+    # True if the point is inside the counter-clockwise convex outline, or
+    # within CONTAINMENT_TOLERANCE of its edges
+    for k in range(len(outline)):
+        a = outline[k - 1]
+        b = outline[k]
+        dx = b[0] - a[0]
+        dy = b[1] - a[1]
+        cross = dx * (point[1] - a[1]) - dy * (point[0] - a[0])
+        if cross < -CONTAINMENT_TOLERANCE * (dx * dx + dy * dy) ** 0.5:
+            return False
+    return True
+
+
+def sub_surface_hosts(base: SurfaceTable, subs: SurfaceTable, declared: List[str]) -> List[Optional[str]]:
+    # The base surface containing each sub-surface, the declared host if it
+    # is one of several, None if there is none
+    index = HostIndex(base)
+    hosts = []
+    for i in range(len(subs)):
+        vertices = subs.vertices[subs.starts[i]:subs.starts[i + 1]]
+        found = index.hosts(subs.canonical(i), vertices)
+        if declared[i] in found:
+            hosts.append(declared[i])
+        else:
+            hosts.append(found[0] if found else None)
+    return hosts
+
+
+def sub_surface_partners(subs: SurfaceTable) -> Dict[str, str]:
+    # Each matched sub-surface and the sub-surface it overlaps, both ways
+    partners = {}
+    matches = surface_match.match_names(subs.names, subs.coords, subs.vertices, subs.starts, corner_boxes=False)
+    for name1, name2 in matches:
+        partners[name1] = name2
+        partners[name2] = name1
+    return partners
+
+
+def known_hosts(surfaces: List[idf_surfaces.Surface]) -> Tuple[List[idf_surfaces.Surface], List[idf_surfaces.SubSurface]]:
+    # The surfaces less the sub-surfaces whose host was not read, such as
+    # one on a BuildingSurface:Detailed, and those sub-surfaces.
+    # idf_surfaces.transform_surfaces needs the host of every sub-surface.
+    names = {s.name for s in surfaces if not isinstance(s, idf_surfaces.SubSurface)}
+    kept = []
+    unknown = []
+    for s in surfaces:
+        if isinstance(s, idf_surfaces.SubSurface) and s.host not in names:
+            unknown.append(s)
+        else:
+            kept.append(s)
+    return kept, unknown
+
+
+def main():
+    if '-h' in sys.argv or '--help' in sys.argv:
+        print('Usage: sub_surface_match.py [--idf] [input.idf] < input > output.tsv')
+        print('Same input as idf_surfaces.py. Prints each sub-surface with the surface containing it')
+        print('and its partner sub-surface, either empty if there is none')
+        sys.exit(0)
+
+    zones, surfaces = idf_surfaces.read_input(sys.argv, sub_surfaces=True)
+    surfaces, unknown = known_hosts(surfaces)
+    for s in unknown:
+        print(f'Sub-surface {s.name}: host {s.host} was not read, skipped', file=sys.stderr)
+    transformed = idf_surfaces.transform_surfaces(zones, surfaces)
+    base = SurfaceTable(*idf_surface_match.points_table(s for s in transformed if not isinstance(s, idf_surfaces.SubSurface)))
+    sub_list = [s for s in transformed if isinstance(s, idf_surfaces.SubSurface)]
+    subs = SurfaceTable(*idf_surface_match.points_table(sub_list))
+
+    declared_hosts = {s.name: s.host for s in sub_list}
+    declared = [declared_hosts[name] for name in subs.names]
+    hosts = sub_surface_hosts(base, subs, declared)
+    partners = sub_surface_partners(subs)
+
+    for name, host, declared_host in zip(subs.names, hosts, declared):
+        if host != declared_host:
+            print(f'Sub-surface {name}: declared on {declared_host}, contained by {host or "no surface"}', file=sys.stderr)
+        print(f'{name}\t{host or ""}\t{partners.get(name, "")}')
+
+
+if __name__ == '__main__':
+    main()
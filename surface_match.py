@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 
-from typing import List, Tuple, Iterable, Optional
+from typing import Any, Callable, Dict, List, Tuple, Iterable, Iterator, Optional, Sequence, TextIO, Union
 from dataclasses import dataclass
-from itertools import combinations
-from math import sqrt
+from array import array
+from functools import partial, total_ordering
+from itertools import combinations, product
+from math import floor, sqrt
+import hashlib
+import json
+import multiprocessing
+import os
 import sys
+import time
 
 @dataclass
 class Point:
+    __slots__ = ('x', 'y', 'z')
+
     x: float
     y: float
     z: float
@@ -64,6 +73,8 @@ class Point:
 
 
 class PlaneEq:
+    __slots__ = ('p1', 'p2', 'p3', 'normal_vec', 'd')
+
     def __init__(self, p1: Point, p2: Point, p3: Point):
         """
         Plane class
@@ -76,15 +87,28 @@ class PlaneEq:
         self.p2 = p2
         self.p3 = p3
 
-        self.v1 = p2 - p1
-        self.v2 = p3 - p2
-
         self.normal_vec = self.v1.cross(self.v2)
-        self.a: float = self.normal_vec.x
-        self.b: float = self.normal_vec.y
-        self.c: float = self.normal_vec.z
         self.d: float = -(self.normal_vec.dot(p3))
 
+    @property
+    def v1(self) -> Point:
+        return self.p2 - self.p1
+
+    @property
+    def v2(self) -> Point:
+        return self.p3 - self.p2
+
+    @property
+    def a(self) -> float:
+        return self.normal_vec.x
+
+    @property
+    def b(self) -> float:
+        return self.normal_vec.y
+
+    @property
+    def c(self) -> float:
+        return self.normal_vec.z
 
     def points(self) -> List[Point]:
         return [self.p1, self.p2, self.p3]
@@ -140,41 +164,39 @@ class PlaneEq:
         return True
 
     def __iter__(self):
-        self.index = -1
-        return self
-
-    def __next__(self):
-        self.index += 1
-        if self.index > 3:
-            raise StopIteration
-        if self.index == 0:
-            return self.a
-        if self.index == 1:
-            return self.b
-        if self.index == 2:
-            return self.c
-        if self.index == 3:
-            return self.d
-
-    # Define equality, with 0.000001 tolerance
+        # A new generator each time, so the same plane can be iterated from
+        # several places at once.
+        yield self.a
+        yield self.b
+        yield self.c
+        yield self.d
+
+    def key(self) -> Optional['PlaneKey']:
+        # None for degenerate planes (collinear points)
+        canonical = canonical_plane(self)
+        return None if canonical is None else PlaneKey(canonical)
+
+    def close(self, other: 'PlaneEq') -> bool:
+        # Within the grouping tolerances, either way up, the test group_planes
+        # uses. Degenerate planes are close to each other. Not transitive.
+        c1 = canonical_plane(self)
+        c2 = canonical_plane(other)
+        if c1 is None or c2 is None:
+            return c1 is None and c2 is None
+        return canonical_close(c1, c2) or canonical_close(c1, (-c2[0], -c2[1], -c2[2], -c2[3]))
+
+    # Define equality as having the same plane key, so transitive and
+    # consistent with the hash, and equal planes are within the grouping
+    # tolerances. Planes within tolerance either side of a key cell edge are
+    # not equal though, use close for the test group_planes makes.
+    # Degenerate planes are equal to each other.
     def __eq__(self, other):
-        scalar = None
-        for x, y in zip(self, other):
-            if x == 0:
-                if y != 0:
-                    return False
-                continue
-            if y == 0:
-                if x != 0:
-                    return False
-                continue
-            current_scalar = y / x
-            if scalar is None:
-                scalar = current_scalar
-            elif scalar != current_scalar:
-                return False
+        if not isinstance(other, PlaneEq):
+            return NotImplemented
+        return self.key() == other.key()
 
-        return True
+    def __hash__(self):
+        return hash(self.key())
 
     def __str__(self):
         return f'{self.a}x + {self.b}y + {self.c}z + {self.d} = 0'
@@ -203,6 +225,8 @@ def max_z(points: Iterable[Point]) -> float:
 
 
 class Plane:
+    __slots__ = ('plane_eq', 'name')
+
     def __init__(self, plane_eq: PlaneEq, name):
         """
         Plane class
@@ -219,48 +243,410 @@ class Plane:
     def __repr__(self):
         return self.__str__()
 
-def surface_match_lines(lines: list[str]) -> str:
+
+class SurfaceTable:
+    __slots__ = ('names', 'coords', 'normals', 'offsets', 'vertices', 'starts')
+
+    def __init__(self, names: List[str], coords: Sequence[float],
+                 vertices: Optional[Sequence[float]] = None, starts: Optional[Sequence[int]] = None):
+        """
+        Surfaces stored as contiguous arrays instead of one Plane each
+        :param names: surface names
+        :param coords: 9 coordinates per surface, x, y, z of points 1 to 3
+        :param vertices: optional, coordinates of all vertices of every surface
+        :param starts: start of each surface in vertices, plus the end of the last
+        """
+        self.names = names
+        self.coords = coords if isinstance(coords, array) else array('d', coords)
+        self.vertices = vertices
+        self.starts = starts
+
+        # Normal and d of each surface, computed as in PlaneEq
+        self.normals = array('d', bytes(8 * 3 * len(names)))
+        self.offsets = array('d', bytes(8 * len(names)))
+        c = self.coords
+        for i in range(len(names)):
+            o = 9 * i
+            v1x, v1y, v1z = c[o + 3] - c[o], c[o + 4] - c[o + 1], c[o + 5] - c[o + 2]
+            v2x, v2y, v2z = c[o + 6] - c[o + 3], c[o + 7] - c[o + 4], c[o + 8] - c[o + 5]
+            nx = v1y * v2z - v1z * v2y
+            ny = v1z * v2x - v1x * v2z
+            nz = v1x * v2y - v1y * v2x
+            self.normals[3 * i] = nx
+            self.normals[3 * i + 1] = ny
+            self.normals[3 * i + 2] = nz
+            self.offsets[i] = -(nx * c[o + 6] + ny * c[o + 7] + nz * c[o + 8])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index: int) -> 'SurfaceView':
+        return SurfaceView(self, index)
+
+    def plane_eq(self, index: int) -> PlaneEq:
+        o = 9 * index
+        c = self.coords
+        return PlaneEq(Point(c[o], c[o + 1], c[o + 2]), Point(c[o + 3], c[o + 4], c[o + 5]), Point(c[o + 6], c[o + 7], c[o + 8]))
+
+    def canonical(self, index: int) -> Optional[Tuple[float, float, float, float]]:
+        # Same as canonical_plane(self.plane_eq(index))
+        n = self.normals
+        return canonical_values(n[3 * index], n[3 * index + 1], n[3 * index + 2], self.offsets[index])
+
+    def vertex_count(self, index: int) -> int:
+        if self.starts is None:
+            return 3
+        return (self.starts[index + 1] - self.starts[index]) // 3
+
+    def subtable(self, indices: List[int]) -> 'SurfaceTable':
+        coords = array('d')
+        for i in indices:
+            coords.extend(self.coords[9 * i:9 * i + 9])
+
+        if self.vertices is None or self.starts is None:
+            return SurfaceTable([self.names[i] for i in indices], coords)
+
+        vertices = array('d')
+        starts = array('q', [0])
+        for i in indices:
+            vertices.extend(self.vertices[self.starts[i]:self.starts[i + 1]])
+            starts.append(len(vertices))
+        return SurfaceTable([self.names[i] for i in indices], coords, vertices, starts)
+
+
+class SurfaceView:
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table: SurfaceTable, index: int):
+        """
+        A surface of a SurfaceTable, usable in place of a Plane
+        :param table: the table
+        :param index: row of the surface
+        """
+        self.table = table
+        self.index = index
+
+    @property
+    def name(self) -> str:
+        return self.table.names[self.index]
+
+    @property
+    def plane_eq(self) -> PlaneEq:
+        return self.table.plane_eq(self.index)
+
+    def __str__(self):
+        return f'{self.name}: {self.plane_eq}'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class SurfaceParseError(ValueError):
+    def __init__(self, line_number: int, message: str):
+        super().__init__(f'Line {line_number}: {message}')
+        self.line_number = line_number
+
+
+# Number of rows parsed into each preallocated chunk by read_surfaces
+READ_CHUNK_ROWS = 65536
+
+
+def read_surfaces(lines: Iterable[str], chunk_rows: int = READ_CHUNK_ROWS,
+                  on_error: Optional[Callable[[SurfaceParseError], None]] = None) -> Iterator[Tuple[List[str], array, array, array]]:
     # Assume each line is tab separated values.
     # Col 1: Surface Name
     # Col 2-4: X, Y, Z coordinates for point 1
     # Col 5-7: X, Y, Z coordinates for point 2
     # Col 8-10: X, Y, Z coordinates for point 3
-    # Cols ...: Additional columns are ignored
+    # Cols ...: X, Y, Z coordinates of further vertices, up to the first
+    #           column that isn't a number
     # Assumed all points are on plane
+    #
+    # Yields chunks of up to chunk_rows surfaces as (names, coordinates,
+    # vertices, starts). The 9 coordinates of the first 3 points of each
+    # surface are packed into the coordinates array('d'). The coordinates of
+    # all vertices go in the vertices array('d'), surface i running from
+    # starts[i] to starts[i + 1].
+    # Blank lines are skipped. Malformed rows raise SurfaceParseError, or are
+    # passed to on_error and skipped.
+    names: List[str] = []
+    coords = array('d', bytes(8 * 9 * chunk_rows))
+    vertices = array('d')
+    starts = array('q', [0])
+    count = 0
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
 
-    # Create list of planes
+        fields = line.split('\t')
+        try:
+            if len(fields) < 10:
+                raise ValueError(f'expected a name and 9 coordinates, found {len(fields)} fields')
+            offset = 9 * count
+            for i in range(9):
+                coords[offset + i] = float(fields[i + 1])
+        except ValueError as e:
+            error = SurfaceParseError(line_number, str(e))
+            if on_error is None:
+                raise error
+            on_error(error)
+            continue
+
+        vertices.extend(coords[offset:offset + 9])
+        i = 10
+        while i + 3 <= len(fields):
+            try:
+                vertex = (float(fields[i]), float(fields[i + 1]), float(fields[i + 2]))
+            except ValueError:
+                break
+            vertices.extend(vertex)
+            i += 3
+        starts.append(len(vertices))
+
+        names.append(fields[0].strip())
+        count += 1
+
+        if count == chunk_rows:
+            yield names, coords, vertices, starts
+            names = []
+            coords = array('d', bytes(8 * 9 * chunk_rows))
+            vertices = array('d')
+            starts = array('q', [0])
+            count = 0
+
+    if count:
+        yield names, coords[:9 * count], vertices, starts
+
+
+def read_surface_table(lines: Iterable[str], on_error: Optional[Callable[[SurfaceParseError], None]] = None) -> Tuple[List[str], array, array, array]:
+    # All surfaces from read_surfaces as one list of names and one array each
+    # of coordinates, vertices and vertex starts.
+    names: List[str] = []
+    coords = array('d')
+    vertices = array('d')
+    starts = array('q', [0])
+    for chunk_names, chunk_coords, chunk_vertices, chunk_starts in read_surfaces(lines, on_error=on_error):
+        offset = len(vertices)
+        names.extend(chunk_names)
+        coords.extend(chunk_coords)
+        vertices.extend(chunk_vertices)
+        starts.extend(offset + start for start in chunk_starts[1:])
+    return names, coords, vertices, starts
+
+
+def table_planes(names: List[str], coords: Sequence[float]) -> List[Plane]:
     planes = []
-    for line in lines:
-        line = line.split('\t')
-        name = line[0]
-        p1 = Point(float(line[1]), float(line[2]), float(line[3]))
-        p2 = Point(float(line[4]), float(line[5]), float(line[6]))
-        p3 = Point(float(line[7]), float(line[8]), float(line[9]))
-        plane_eq = PlaneEq(p1, p2, p3)
-        planes.append(Plane(plane_eq, name))
+    for i, name in enumerate(names):
+        o = 9 * i
+        p1 = Point(coords[o], coords[o + 1], coords[o + 2])
+        p2 = Point(coords[o + 3], coords[o + 4], coords[o + 5])
+        p3 = Point(coords[o + 6], coords[o + 7], coords[o + 8])
+        planes.append(Plane(PlaneEq(p1, p2, p3), name))
+    return planes
+
+
+def surface_match_lines(lines: list[str]) -> str:
+    # Lines in the format of read_surfaces. Returns the names in each group of
+    # coplanar surfaces, one group per line. For the matches, see iter_matches.
+    names, coords, _, _ = read_surface_table(lines)
+    planes = table_planes(names, coords)
 
     # Group by plane equation
     grouped = group_planes(planes)
     return '\n'.join(['\t'.join([plane.name for plane in group]) for group in grouped])
 
 
-def group_planes(planes: List[Plane]) -> List[List[Plane]]:
-    # Group by plane equation
+# Tolerances used when grouping coplanar surfaces. Normal components are
+# compared after scaling the normal to unit length, so NORMAL_TOLERANCE is
+# close to an angle in radians, the offset in model units. See set_tolerances.
+NORMAL_TOLERANCE = 0.000001
+OFFSET_TOLERANCE = 0.000001
 
-    grouped: List[List[Plane]] = []
+# Size of the hash buckets for the canonical plane values. Much larger than the
+# tolerances so that only values close to a bucket edge need neighbour lookups.
+BUCKET_SIZE = 0.001
 
-    for plane in planes:
-        # Check if plane equation is already in grouped
-        for group in grouped:
-            if plane.plane_eq == group[0].plane_eq:
-                group.append(plane)
-                break
+
+def set_tolerances(normal_tolerance: float, offset_tolerance: float):
+    # Change the grouping tolerances, see --tol. Buckets grow with them, as
+    # a value must not be within tolerance of both edges of its bucket.
+    global NORMAL_TOLERANCE, OFFSET_TOLERANCE, BUCKET_SIZE
+    NORMAL_TOLERANCE = normal_tolerance
+    OFFSET_TOLERANCE = offset_tolerance
+    BUCKET_SIZE = max(0.001, 4 * max(normal_tolerance, offset_tolerance))
+
+
+def plane_z_tolerance(scale: float) -> float:
+    # How far apart the projected z coordinates of surfaces in one group may
+    # be at points about scale from the origin, given the grouping tolerances
+    return 0.000001 + OFFSET_TOLERANCE + 2 * NORMAL_TOLERANCE * scale
+
+
+@total_ordering
+class PlaneKey:
+    __slots__ = ('canonical', 'normal_tolerance', 'offset_tolerance', 'cell')
+
+    def __init__(self, canonical: Tuple[float, float, float, float],
+                 normal_tolerance: Optional[float] = None, offset_tolerance: Optional[float] = None):
+        """
+        Hashable, ordered key of a canonical plane. Values are snapped to cells
+        the size of the tolerances, and keys are equal when their cells are,
+        so equal keys are within tolerance of each other and equality is
+        transitive. Planes within tolerance may still fall in neighbouring
+        cells, group_canonical looks in those too.
+        :param canonical: unit normal and offset, see canonical_plane
+        :param normal_tolerance: cell size of the normal, NORMAL_TOLERANCE by default
+        :param offset_tolerance: cell size of the offset, OFFSET_TOLERANCE by default
+        """
+        self.canonical = canonical
+        self.normal_tolerance = NORMAL_TOLERANCE if normal_tolerance is None else normal_tolerance
+        self.offset_tolerance = OFFSET_TOLERANCE if offset_tolerance is None else offset_tolerance
+        a, b, c, d = canonical
+        n = self.normal_tolerance
+        # Rounded, so round values such as 0 sit in the middle of their cell
+        self.cell = (round(a / n), round(b / n), round(c / n), round(d / self.offset_tolerance))
+
+    def __eq__(self, other):
+        if not isinstance(other, PlaneKey):
+            return NotImplemented
+        return self.cell == other.cell
+
+    def __lt__(self, other):
+        if not isinstance(other, PlaneKey):
+            return NotImplemented
+        return self.cell < other.cell
+
+    def __hash__(self):
+        return hash(self.cell)
+
+    def close(self, other: 'PlaneKey') -> bool:
+        # Within tolerance, the test used for grouping. Not transitive.
+        return (abs(self.canonical[0] - other.canonical[0]) < self.normal_tolerance and
+                abs(self.canonical[1] - other.canonical[1]) < self.normal_tolerance and
+                abs(self.canonical[2] - other.canonical[2]) < self.normal_tolerance and
+                abs(self.canonical[3] - other.canonical[3]) < self.offset_tolerance)
+
+    def __str__(self):
+        return plane_key(self.canonical)
+
+    def __repr__(self):
+        return f'PlaneKey({self})'
+
+
+def canonical_plane(plane_eq: PlaneEq) -> Optional[Tuple[float, float, float, float]]:
+    # Unit normal with the first non-zero component positive, d scaled to match.
+    # Returns None for degenerate planes (collinear points).
+    return canonical_values(plane_eq.a, plane_eq.b, plane_eq.c, plane_eq.d)
+
+
+def canonical_values(a: float, b: float, c: float, d: float) -> Optional[Tuple[float, float, float, float]]:
+    # Same as canonical_plane, from the plane coefficients
+    length = sqrt(a * a + b * b + c * c)
+    if length == 0:
+        return None
+
+    a = a / length
+    b = b / length
+    c = c / length
+    d = d / length
+
+    for value in (a, b, c):
+        if abs(value) > NORMAL_TOLERANCE:
+            if value < 0:
+                return -a, -b, -c, -d
+            break
+
+    return a, b, c, d
+
+
+def bucket_keys(canonical: Tuple[float, float, float, float]) -> Iterable[Tuple[int, ...]]:
+    # Yield the bucket of the canonical values first, then the neighbouring
+    # buckets for every component that sits within tolerance of a bucket edge.
+    options = []
+    for value, tolerance in zip(canonical, (NORMAL_TOLERANCE, NORMAL_TOLERANCE, NORMAL_TOLERANCE, OFFSET_TOLERANCE)):
+        scaled = value / BUCKET_SIZE
+        bucket = floor(scaled)
+        current = [bucket]
+        if (scaled - bucket) * BUCKET_SIZE < tolerance:
+            current.append(bucket - 1)
+        if (bucket + 1 - scaled) * BUCKET_SIZE < tolerance:
+            current.append(bucket + 1)
+        options.append(current)
+
+    return product(*options)
+
+
+def canonical_close(c1: Tuple[float, float, float, float], c2: Tuple[float, float, float, float]) -> bool:
+    return (abs(c1[0] - c2[0]) < NORMAL_TOLERANCE and
+            abs(c1[1] - c2[1]) < NORMAL_TOLERANCE and
+            abs(c1[2] - c2[2]) < NORMAL_TOLERANCE and
+            abs(c1[3] - c2[3]) < OFFSET_TOLERANCE)
+
+
+def group_planes(planes: List[Plane]) -> List[List[Plane]]:
+    # Group by plane equation. Groups are returned in order of first
+    # appearance, members in input order.
+    return [[planes[i] for i in group] for group in group_canonical(canonical_plane(plane.plane_eq) for plane in planes)]
+
+
+def group_table(table: SurfaceTable) -> List[List[int]]:
+    # Same as group_planes, returning lists of rows of the table
+    return group_canonical(table.canonical(i) for i in range(len(table)))
+
+
+def group_canonical(canonicals: Iterable[Optional[Tuple[float, float, float, float]]]) -> List[List[int]]:
+    # Group indices by canonical plane, None for degenerate planes. Each plane
+    # is compared against the first member of the groups found through the
+    # hash buckets of its canonical form, so the work is roughly linear in the
+    # number of planes.
+
+    grouped: List[List[int]] = []
+    representatives: List[Optional[Tuple[float, float, float, float]]] = []
+    buckets: Dict[Tuple[int, ...], List[int]] = {}
+    degenerate: Optional[List[int]] = None
+
+    for i, canonical in enumerate(canonicals):
+        if canonical is None:
+            if degenerate is None:
+                degenerate = [i]
+                grouped.append(degenerate)
+                # Keeps representatives in step with grouped, never compared
+                representatives.append(None)
+            else:
+                degenerate.append(i)
+            continue
+
+        found = find_group(buckets, representatives, canonical)
+        if found is not None:
+            grouped[found].append(i)
         else:
-            grouped.append([plane])
+            key = next(iter(bucket_keys(canonical)))
+            buckets.setdefault(key, []).append(len(grouped))
+            representatives.append(canonical)
+            grouped.append([i])
 
     return grouped
 
 
+def find_group(buckets: Dict[Tuple[int, ...], List[int]], representatives: Sequence[Optional[Tuple[float, float, float, float]]],
+               canonical: Tuple[float, float, float, float]) -> Optional[int]:
+    # The lowest group whose representative is within tolerance of the
+    # canonical plane, None if there is none. buckets holds the groups by the
+    # first of the bucket_keys of their representative.
+    # Also look up the flipped normal, in case noise in a near zero
+    # component changed the sign convention.
+    flipped = (-canonical[0], -canonical[1], -canonical[2], -canonical[3])
+
+    found = None
+    for values in (canonical, flipped):
+        for key in bucket_keys(values):
+            for index in buckets.get(key, ()):
+                if (found is None or index < found) and canonical_close(representatives[index], values):
+                    found = index
+    return found
+
+
 def determinant_2x2(a: float, b: float, c: float, d: float) -> float:
     # a b
     # c d
@@ -325,94 +711,1062 @@ def inverse_3x3(col1, col2, col3) -> Optional[List[List[float]]]:
     return inverse
 
 
-def check_group(planes: List[Plane]) -> List[Tuple[Plane, Plane]]:
-    test_cases = list(combinations(planes, 2))
-
-    # Create new basis vector from first plane to transform from 3D to 2D
+def group_transform(plane_eq: PlaneEq) -> Optional[List[List[float]]]:
+    # Create new basis vector from plane to transform from 3D to 2D
     # Use v1 and normal, take cross product to get 3rd vector
+    # Returns None for degenerate planes.
 
+    if plane_eq.normal_vec.distance() == 0:
+        return None
 
-    v1 = planes[0].plane_eq.v1.normalized()
-    norm_normal = planes[0].plane_eq.normal_vec.normalized()
+    v1 = plane_eq.v1.normalized()
+    norm_normal = plane_eq.normal_vec.normalized()
     v2 = v1.cross(norm_normal).normalized()
 
     transform_matrix = inverse_3x3(v1, v2, norm_normal)
     if transform_matrix is None:
-        return []
+        return None
 
     # Assert that transformation matrix is area perserving, determinant should be 1 or -1.
     d = determinant_3x3(v1, v2, norm_normal)
     assert abs(abs(d) - 1) < 0.000001
 
-    matches = []
-    # Create 2D points
-    for plane1, plane2 in test_cases:
-        # Transform points to 2D
-        plane1_2d = plane1.plane_eq.transform(transform_matrix)
-        plane2_2d = plane2.plane_eq.transform(transform_matrix)
+    return transform_matrix
 
-        # Check if 2D points overlap, z coordinates should equal
-        assert abs(plane1_2d.p1.z - plane2_2d.p1.z) < 0.000001
 
-        # Now check for overlap
-        if plane1_2d.overlap(plane2_2d):
-            matches.append((plane1, plane2))
+class Profile:
+    __slots__ = ('phases', 'counters', 'group_sizes', 'largest_group', 'largest_plane')
 
-    return matches
+    def __init__(self):
+        """
+        Phase times and counters of one run, filled in while PROFILE is set
+        """
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.group_sizes: Dict[str, int] = {}
+        self.largest_group = 0
+        self.largest_plane = ''
+
+    def lap(self, phase: str, since: float) -> float:
+        # Add the time from since to now to phase, and return now
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - since
+        return now
+
+    def count(self, counter: str, amount: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record_groups(self, sizes: List[int], keys: Callable[[int], str]):
+        # Histogram of group sizes in powers of 2, and the largest group.
+        # keys gives the plane key of a group by its position.
+        self.count('groups', len(sizes))
+        for k, size in enumerate(sizes):
+            low = 1 << (size.bit_length() - 1) if size else 0
+            label = str(low) if low < 2 else f'{low}-{2 * low - 1}'
+            self.group_sizes[label] = self.group_sizes.get(label, 0) + 1
+            if size > self.largest_group:
+                self.largest_group = size
+                self.largest_plane = keys(k)
+
+    def summary(self) -> Dict[str, Any]:
+        return {'phases': {phase: round(seconds, 6) for phase, seconds in self.phases.items()},
+                'counters': dict(self.counters),
+                'group_sizes': dict(sorted(self.group_sizes.items(), key=lambda item: int(item[0].split('-')[0]))),
+                'largest_group': {'size': self.largest_group, 'plane': self.largest_plane}}
+
+    def report(self, file=sys.stderr):
+        summary = self.summary()
+        print('Phase seconds:', file=file)
+        for phase, seconds in summary['phases'].items():
+            print(f'  {phase:<12}{seconds:>12.6f}', file=file)
+        print('Counters:', file=file)
+        for counter, value in summary['counters'].items():
+            print(f'  {counter:<18}{value:>12}', file=file)
+        print('Group sizes:', file=file)
+        for label, value in summary['group_sizes'].items():
+            print(f'  {label:<12}{value:>12}', file=file)
+        print(f'Largest group: {self.largest_group} surfaces, plane {self.largest_plane}', file=file)
+
+
+# Set to a Profile to record where the time goes, see --profile. Each hook
+# costs one test of this global when it is None. Groups checked in a pool of
+# processes are not counted.
+PROFILE: Optional[Profile] = None
+
+
+def check_group(planes: List[Plane], pairwise: bool = False, first_only: bool = False) -> List[Tuple[Plane, Plane]]:
+    return [(planes[i], planes[j]) for i, j in check_group_pairs(planes, pairwise, first_only)]
+
+
+def check_group_pairs(planes: List[Plane], pairwise: bool = False, first_only: bool = False) -> List[Tuple[int, int]]:
+    # Same as check_group, returning index pairs into planes.
+    # With first_only, a pair is kept only if neither plane was matched by an
+    # earlier pair, see first_matches.
+    transform_matrix = group_transform(planes[0].plane_eq)
+    if transform_matrix is None:
+        return []
 
+    extents = project_group(planes, transform_matrix)
+    return check_extents(extents, pairwise, first_only)
 
-def main():
 
-    # Check if arguments contains '-2' flag, meaning print both directions of match.
-    # If not, print only one direction
-    print_both = False
+def check_table_pairs(table: SurfaceTable, pairwise: bool = False, first_only: bool = False,
+                      metrics: bool = False, corner_boxes: bool = True) -> List[Tuple]:
+    # Same as check_group_pairs, for a table holding one group. If the table
+    # has the vertices of the surfaces, pairs whose boxes overlap are checked
+    # again on the exact polygons, see exact_overlaps.
+    # With metrics, each pair comes with its overlap, see pair_metrics.
+    # corner_boxes is as in exact_overlaps.
+    if len(table) < 2:
+        return []
 
-    only_first = True
+    profile = PROFILE
+    mark = time.perf_counter() if profile is not None else 0.0
 
-    if any([arg == '-2' for arg in sys.argv]):
-        print_both = True
+    transform_matrix = group_transform(table.plane_eq(0))
+    if profile is not None:
+        mark = profile.lap('transform', mark)
+    if transform_matrix is None:
+        return []
 
-    if any([arg == "--all" or arg == "-a" for arg in sys.argv]):
-        only_first = False
+    overlaps = None
+    polygons = None
+    if table.vertices is not None:
+        extents, polygons = project_table_polygons(table, transform_matrix)
+        overlaps = exact_overlaps(polygons, corner_boxes)
+    else:
+        extents = project_table(table, transform_matrix)
+    if profile is not None:
+        mark = profile.lap('project', mark)
+
+    pairs = check_extents(extents, pairwise, first_only, overlaps)
+    if profile is not None:
+        mark = profile.lap('overlap', mark)
+    if not metrics:
+        return pairs
+
+    results = pair_metrics(extents, polygons, pairs, corner_boxes)
+    if profile is not None:
+        profile.lap('metrics', mark)
+    return results
+
+
+def check_extents(extents: Sequence[float], pairwise: bool = False, first_only: bool = False,
+                  overlaps: Optional[Callable[[int, int], bool]] = None) -> List[Tuple[int, int]]:
+    # Pairs of overlapping boxes in the packed extents. overlaps is an
+    # optional narrow phase test for the pairs whose boxes overlap.
+    if pairwise:
+        pairs = check_pairs(extents)
+    elif first_only:
+        return first_overlaps(extents, overlaps)
+    else:
+        pairs = sweep_and_prune(extents)
+
+    if overlaps is not None:
+        pairs = [(i, j) for i, j in pairs if overlaps(i, j)]
+        if PROFILE is not None:
+            PROFILE.count('exact_pairs', len(pairs))
+
+    return first_matches(pairs) if first_only else pairs
+
+
+# Chunks of groups with fewer estimated pair tests than this are matched in
+# the main process instead of being sent to the pool.
+POOL_MIN_PAIRS = 5000
+
+
+def _check_chunk(check: Callable[[Any], List[Tuple[int, int]]], chunk: List[Tuple[int, Any]]) -> List[Tuple[int, List[Tuple[int, int]]]]:
+    return [(index, check(group)) for index, group in chunk]
+
+
+def match_groups(groups: List[Any], check: Callable[[Any], List[Tuple[int, int]]], jobs: int) -> List[List[Tuple[int, int]]]:
+    return list(iter_match_groups(groups, check, jobs))
+
+
+def iter_match_groups(groups: List[Any], check: Callable[[Any], List[Tuple[int, int]]], jobs: int,
+                      sizes: Optional[List[int]] = None) -> Iterator[List[Tuple[int, int]]]:
+    # Yield the result of check for every group, in the order of groups.
+    # With more than one job, groups are packed into chunks of roughly equal
+    # estimated pair cost and the most expensive chunks are submitted to a
+    # pool of processes first. Cheap chunks are checked in this process when
+    # their turn comes. check must be picklable, e.g. a module level function.
+    # sizes are the number of surfaces in each group, len(group) by default.
+    if sizes is None:
+        sizes = [len(group) for group in groups]
+    costs = [size * (size - 1) // 2 for size in sizes]
+    target = max(POOL_MIN_PAIRS, sum(costs) // (jobs * 4))
+
+    chunks: List[List[Tuple[int, Any]]] = []
+    chunk_costs: List[int] = []
+    current: List[Tuple[int, Any]] = []
+    current_cost = 0
+    for index, group in enumerate(groups):
+        if costs[index] == 0:
+            continue
+        current.append((index, group))
+        current_cost += costs[index]
+        if current_cost >= target:
+            chunks.append(current)
+            chunk_costs.append(current_cost)
+            current = []
+            current_cost = 0
+    if current:
+        chunks.append(current)
+        chunk_costs.append(current_cost)
+
+    pooled = [chunk for chunk, cost in zip(chunks, chunk_costs) if cost >= POOL_MIN_PAIRS]
+    pooled.sort(key=lambda chunk: -sum(costs[index] for index, _ in chunk))
+
+    if jobs < 2 or len(pooled) < 2:
+        for index, group in enumerate(groups):
+            yield check(group) if costs[index] else []
+        return
+
+    pooled_indices = set(index for chunk in pooled for index, _ in chunk)
+    finished: Dict[int, List[Tuple[int, int]]] = {}
+
+    # Workers start with the grouping tolerances of this process
+    with multiprocessing.Pool(min(jobs, len(pooled)), set_tolerances, (NORMAL_TOLERANCE, OFFSET_TOLERANCE)) as pool:
+        pooled_results = pool.imap_unordered(partial(_check_chunk, check), pooled)
+        for index, group in enumerate(groups):
+            if index not in pooled_indices:
+                yield check(group) if costs[index] else []
+                continue
 
-    # Read input from stdin, assume TSV
-    planes = []
+            while index not in finished:
+                finished.update(next(pooled_results))
+            yield finished.pop(index)
 
-    for line in sys.stdin:
-        split_line =  [f.strip() for f in line.split('\t')]
 
-        if len(split_line) < 10:
+def first_matches(pairs: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    # Keep a pair only if neither surface has been matched by an earlier pair
+    matched = set()
+    first = []
+    for i, j in pairs:
+        if i in matched or j in matched:
+            continue
+        matched.add(i)
+        matched.add(j)
+        first.append((i, j))
+    return first
+
+
+def stream_matches(grouped_names: Iterable[List[str]], group_pairs: Iterable[List[Tuple[int, int]]],
+                   print_both: bool) -> Iterator[Tuple[str, str]]:
+    # Yield the matched names one group at a time, pulling the matches of a
+    # group only when the previous group has been written out.
+    # With print_both each group's matches are followed by the reversed pairs.
+    for names, pairs in zip(grouped_names, group_pairs):
+        for i, j in pairs:
+            yield names[i], names[j]
+
+        if print_both:
+            for i, j in pairs:
+                yield names[j], names[i]
+
+
+def stream_metrics(grouped_names: Iterable[List[str]], group_keys: Iterable[str],
+                   group_metrics: Iterable[List[Tuple[int, int, float, float, float]]],
+                   print_both: bool) -> Iterator[Tuple[str, str, float, float, float, str]]:
+    # Same as stream_matches for the results of pair_metrics, yielding
+    # name 1, name 2, area, fraction of 1, fraction of 2 and the plane key.
+    for names, key, results in zip(grouped_names, group_keys, group_metrics):
+        for i, j, area, fraction_i, fraction_j in results:
+            yield names[i], names[j], area, fraction_i, fraction_j, key
+
+        if print_both:
+            for i, j, area, fraction_i, fraction_j in results:
+                yield names[j], names[i], area, fraction_j, fraction_i, key
+
+
+def project_group(planes: List[Plane], transform_matrix: List[List[float]]) -> array:
+    # Transform every plane of the group to 2D once. Returns the 2D extents
+    # packed as min x, max x, min y, max y for each plane in turn.
+    extents = array('d')
+    z = None
+    for plane in planes:
+        plane_2d = plane.plane_eq.transform(transform_matrix)
+
+        # All planes in the group should end up at the same z coordinate
+        if z is None:
+            z = plane_2d.p1.z
+        p1 = plane.plane_eq.p1
+        assert abs(plane_2d.p1.z - z) < plane_z_tolerance(abs(p1.x) + abs(p1.y) + abs(p1.z))
+
+        extents.extend((plane_2d.min_x(), plane_2d.max_x(), plane_2d.min_y(), plane_2d.max_y()))
+
+    return extents
+
+
+def project_table(table: SurfaceTable, transform_matrix: List[List[float]]) -> array:
+    # Same as project_group, straight from the coordinates of the table
+    (t00, t01, t02), (t10, t11, t12), (t20, t21, t22) = transform_matrix
+    c = table.coords
+    extents = array('d', bytes(8 * 4 * len(table)))
+    z = None
+    for i in range(len(table)):
+        o = 9 * i
+        x1, y1, z1, x2, y2, z2, x3, y3, z3 = c[o:o + 9]
+        new_x1 = x1 * t00 + y1 * t01 + z1 * t02
+        new_x2 = x2 * t00 + y2 * t01 + z2 * t02
+        new_x3 = x3 * t00 + y3 * t01 + z3 * t02
+        new_y1 = x1 * t10 + y1 * t11 + z1 * t12
+        new_y2 = x2 * t10 + y2 * t11 + z2 * t12
+        new_y3 = x3 * t10 + y3 * t11 + z3 * t12
+        new_z1 = x1 * t20 + y1 * t21 + z1 * t22
+
+        # All planes in the group should end up at the same z coordinate
+        if z is None:
+            z = new_z1
+        assert abs(new_z1 - z) < plane_z_tolerance(abs(x1) + abs(y1) + abs(z1))
+
+        extents[4 * i] = min(new_x1, new_x2, new_x3)
+        extents[4 * i + 1] = max(new_x1, new_x2, new_x3)
+        extents[4 * i + 2] = min(new_y1, new_y2, new_y3)
+        extents[4 * i + 3] = max(new_y1, new_y2, new_y3)
+
+    return extents
+
+
+def project_table_polygons(table: SurfaceTable, transform_matrix: List[List[float]]) -> Tuple[array, List[List[Tuple[float, float]]]]:
+    # Same as project_table for a table with vertices. The extents cover all
+    # vertices, and the 2D polygons are returned as well.
+    (t00, t01, t02), (t10, t11, t12), (t20, t21, t22) = transform_matrix
+    v = table.vertices
+    starts = table.starts
+    extents = array('d', bytes(8 * 4 * len(table)))
+    polygons = []
+    z = None
+    for i in range(len(table)):
+        polygon = []
+        for o in range(starts[i], starts[i + 1], 3):
+            x, y, z1 = v[o], v[o + 1], v[o + 2]
+            polygon.append((x * t00 + y * t01 + z1 * t02, x * t10 + y * t11 + z1 * t12))
+
+        # All planes in the group should end up at the same z coordinate
+        o = starts[i]
+        new_z1 = v[o] * t20 + v[o + 1] * t21 + v[o + 2] * t22
+        if z is None:
+            z = new_z1
+        assert abs(new_z1 - z) < plane_z_tolerance(abs(v[o]) + abs(v[o + 1]) + abs(v[o + 2]))
+
+        extents[4 * i] = min(p[0] for p in polygon)
+        extents[4 * i + 1] = max(p[0] for p in polygon)
+        extents[4 * i + 2] = min(p[1] for p in polygon)
+        extents[4 * i + 3] = max(p[1] for p in polygon)
+        polygons.append(polygon)
+
+    return extents, polygons
+
+
+# Overlap areas at or below this are taken as surfaces touching along an edge
+AREA_TOLERANCE = 0.000001
+
+
+def exact_overlaps(polygons: List[List[Tuple[float, float]]], corner_boxes: bool = True) -> Callable[[int, int], bool]:
+    # Narrow phase test on the 2D polygons of a group: True if the polygons of
+    # planes i and j overlap by more than AREA_TOLERANCE. Polygons are
+    # triangulated once, the first time they are tested. With corner_boxes,
+    # surfaces with only 3 points are taken as the corners of rectangles, as
+    # in PlaneEq.overlap and the 3 point rows of the original input format,
+    # so for them the box test stands. Without it they are triangles.
+    triangles: Dict[int, List[Tuple[Tuple[float, float], ...]]] = {}
+
+    def overlaps(i: int, j: int) -> bool:
+        if corner_boxes and (len(polygons[i]) < 4 or len(polygons[j]) < 4):
+            return True
+        if i not in triangles:
+            triangles[i] = triangulate(polygons[i])
+        if j not in triangles:
+            triangles[j] = triangulate(polygons[j])
+        return intersection_area(triangles[i], triangles[j]) > AREA_TOLERANCE
+
+    return overlaps
+
+
+def polygon_area(points: Sequence[Tuple[float, float]]) -> float:
+    # Signed area, positive for counter-clockwise points
+    area = 0.0
+    for k in range(len(points)):
+        x1, y1 = points[k - 1]
+        x2, y2 = points[k]
+        area += x1 * y2 - x2 * y1
+    return area / 2
+
+
+def turn(a: Tuple[float, float], b: Tuple[float, float], c: Tuple[float, float]) -> float:
+    # Cross product of b - a and c - b, positive for a left turn at b
+    return (b[0] - a[0]) * (c[1] - b[1]) - (b[1] - a[1]) * (c[0] - b[0])
+
+
+def triangulate(points: Sequence[Tuple[float, float]]) -> List[Tuple[Tuple[float, float], ...]]:
+    # Split a simple polygon, convex or not, into counter-clockwise triangles
+    # by ear clipping.
+    remaining = [p for k, p in enumerate(points) if p != points[k - 1]]
+    if polygon_area(remaining) < 0:
+        remaining.reverse()
+
+    triangles = []
+    while len(remaining) > 3:
+        count = len(remaining)
+        for k in range(count):
+            a, b, c = remaining[k - 1], remaining[k], remaining[(k + 1) % count]
+            corner = turn(a, b, c)
+            if corner == 0:
+                # Collinear, b adds no area
+                del remaining[k]
+                break
+            if corner < 0:
+                continue
+            if any(p not in (a, b, c) and turn(a, b, p) >= 0 and turn(b, c, p) >= 0 and turn(c, a, p) >= 0
+                   for p in remaining):
+                continue
+            triangles.append((a, b, c))
+            del remaining[k]
+            break
+        else:
+            # No ear found, only possible through rounding. Fan the rest.
+            triangles.extend((remaining[0], remaining[k], remaining[k + 1]) for k in range(1, count - 1))
+            return triangles
+
+    if len(remaining) == 3:
+        triangles.append(tuple(remaining))
+    return triangles
+
+
+def clip_convex(subject: Sequence[Tuple[float, float]], clip: Sequence[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    # Sutherland-Hodgman: the part of the subject polygon inside the convex,
+    # counter-clockwise clip polygon.
+    output = list(subject)
+    for k in range(len(clip)):
+        if not output:
+            break
+        c1 = clip[k - 1]
+        c2 = clip[k]
+        dx = c2[0] - c1[0]
+        dy = c2[1] - c1[1]
+
+        current = output
+        output = []
+        previous = current[-1]
+        previous_side = dx * (previous[1] - c1[1]) - dy * (previous[0] - c1[0])
+        for point in current:
+            side = dx * (point[1] - c1[1]) - dy * (point[0] - c1[0])
+            if (side >= 0) != (previous_side >= 0):
+                t = previous_side / (previous_side - side)
+                output.append((previous[0] + t * (point[0] - previous[0]), previous[1] + t * (point[1] - previous[1])))
+            if side >= 0:
+                output.append(point)
+            previous = point
+            previous_side = side
+
+    return output
+
+
+def intersection_area(triangles1: List[Tuple[Tuple[float, float], ...]], triangles2: List[Tuple[Tuple[float, float], ...]]) -> float:
+    # Area shared by two triangulated polygons
+    area = 0.0
+    for t1 in triangles1:
+        min_x1 = min(p[0] for p in t1)
+        max_x1 = max(p[0] for p in t1)
+        min_y1 = min(p[1] for p in t1)
+        max_y1 = max(p[1] for p in t1)
+        for t2 in triangles2:
+            if (min_x1 >= max(p[0] for p in t2) or max_x1 <= min(p[0] for p in t2) or
+                    min_y1 >= max(p[1] for p in t2) or max_y1 <= min(p[1] for p in t2)):
+                continue
+            clipped = clip_convex(t1, t2)
+            if len(clipped) >= 3:
+                area += polygon_area(clipped)
+    return area
+
+
+def pair_metrics(extents: Sequence[float], polygons: Optional[List[List[Tuple[float, float]]]],
+                 pairs: List[Tuple[int, int]], corner_boxes: bool = True) -> List[Tuple[int, int, float, float, float]]:
+    # For each pair of a group, the area shared by the two surfaces and the
+    # fraction of each surface it covers, as (i, j, area, fraction i,
+    # fraction j). Worked out in the same 2D frame as the overlap test, with
+    # the same shapes: the polygons, or the boxes when polygons is None or,
+    # with corner_boxes, for surfaces given by 3 points.
+    triangles: Dict[int, List[Tuple[Tuple[float, float], ...]]] = {}
+    areas: Dict[int, float] = {}
+
+    def shape(i: int):
+        if i not in triangles:
+            if polygons is not None and (len(polygons[i]) >= 4 or not corner_boxes):
+                polygon = polygons[i]
+            else:
+                min_x, max_x, min_y, max_y = extents[4 * i:4 * i + 4]
+                polygon = [(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)]
+            triangles[i] = triangulate(polygon)
+            areas[i] = abs(polygon_area(polygon))
+        return triangles[i], areas[i]
+
+    results = []
+    for i, j in pairs:
+        triangles_i, area_i = shape(i)
+        triangles_j, area_j = shape(j)
+        area = intersection_area(triangles_i, triangles_j)
+        results.append((i, j, area, area / area_i if area_i else 0.0, area / area_j if area_j else 0.0))
+    return results
+
+
+def plane_key(canonical: Optional[Tuple[float, float, float, float]]) -> str:
+    # Text form of a canonical plane for the metrics output, a, b, c, d
+    # rounded to 6 places. Empty for degenerate planes.
+    if canonical is None:
+        return ''
+    return ','.join(f'{round(v, 6) + 0.0:.6f}' for v in canonical)
+
+
+def extents_overlap(extents: Sequence[float], i: int, j: int) -> bool:
+    # Same test as PlaneEq.overlap, on the packed extents of planes i and j.
+    i *= 4
+    j *= 4
+    return (extents[i] < extents[j + 1] and extents[i + 1] > extents[j] and
+            extents[i + 2] < extents[j + 3] and extents[i + 3] > extents[j + 2])
+
+
+def check_pairs(extents: array) -> List[Tuple[int, int]]:
+    # Test every pair in the group. Kept to compare against sweep_and_prune.
+    pairs = [(i, j) for i, j in combinations(range(len(extents) // 4), 2) if extents_overlap(extents, i, j)]
+    if PROFILE is not None:
+        count = len(extents) // 4
+        PROFILE.count('pairs_considered', count * (count - 1) // 2)
+        PROFILE.count('box_pairs', len(pairs))
+    return pairs
+
+
+def sweep_and_prune(extents: array) -> List[Tuple[int, int]]:
+    # Sort the 2D bounding boxes on min x and sweep, keeping the boxes whose
+    # x range is still open in an active list. Only pairs of boxes that are
+    # active at the same time reach the overlap test.
+    # Pairs are returned in the same order as check_pairs.
+    order = sorted(range(len(extents) // 4), key=lambda i: extents[4 * i])
+
+    candidates = []
+    active: List[int] = []
+    considered = 0
+    for i in order:
+        min_x_i = extents[4 * i]
+        active = [j for j in active if extents[4 * j + 1] > min_x_i]
+        considered += len(active)
+        for j in active:
+            if extents_overlap(extents, i, j):
+                candidates.append((j, i) if j < i else (i, j))
+        active.append(i)
+
+    if PROFILE is not None:
+        PROFILE.count('pairs_considered', considered)
+        PROFILE.count('box_pairs', len(candidates))
+
+    candidates.sort()
+    return candidates
+
+
+# Boxes spanning more grid cells than this are kept off the grid of
+# first_overlaps and checked one by one instead
+LARGE_BOX_CELLS = 64
+
+
+def grid_cell_size(extents: Sequence[float]) -> float:
+    # Cell size for a uniform grid over the packed boxes: the median of their
+    # larger sides, so a few huge boxes don't make the cells huge as well
+    count = len(extents) // 4
+    sizes = sorted(max(extents[4 * i + 1] - extents[4 * i], extents[4 * i + 3] - extents[4 * i + 2]) for i in range(count))
+    if not sizes:
+        return 1.0
+    size = sizes[count // 2]
+    if size <= 0:
+        size = sizes[-1]
+    return size if size > 0 else 1.0
+
+
+def box_cell_count(extents: Sequence[float], i: int, cell_size: float) -> int:
+    # Number of grid cells box i spans
+    return ((floor(extents[4 * i + 1] / cell_size) - floor(extents[4 * i] / cell_size) + 1) *
+            (floor(extents[4 * i + 3] / cell_size) - floor(extents[4 * i + 2] / cell_size) + 1))
+
+
+def first_overlaps(extents: Sequence[float], overlaps: Optional[Callable[[int, int], bool]] = None) -> List[Tuple[int, int]]:
+    # Same result as first_matches(sweep_and_prune(extents)) without finding
+    # every overlap. Each plane, in index order, is paired with the lowest
+    # unmatched plane after it that it overlaps. The boxes are indexed on a
+    # uniform grid and a plane leaves the grid once it has been checked or
+    # matched, so later searches only see the planes still looking for a match.
+    # Boxes spanning more than LARGE_BOX_CELLS cells stay off the grid: they
+    # are checked against every plane looking for a match, and every plane
+    # searches them.
+    # overlaps is an optional narrow phase test, as in check_extents.
+    count = len(extents) // 4
+    if count < 2:
+        return []
+
+    cell_size = grid_cell_size(extents)
+
+    def cells(i: int) -> Iterator[Tuple[int, int]]:
+        for cx in range(floor(extents[4 * i] / cell_size), floor(extents[4 * i + 1] / cell_size) + 1):
+            for cy in range(floor(extents[4 * i + 2] / cell_size), floor(extents[4 * i + 3] / cell_size) + 1):
+                yield cx, cy
+
+    # Cell lists and the large boxes are built in index order, so each stays
+    # sorted
+    grid: Dict[Tuple[int, int], List[int]] = {}
+    large: List[int] = []
+    is_large = [False] * count
+    for i in range(count):
+        if box_cell_count(extents, i, cell_size) > LARGE_BOX_CELLS:
+            large.append(i)
+            is_large[i] = True
+            continue
+        for cell in cells(i):
+            grid.setdefault(cell, []).append(i)
+
+    active = [True] * count
+    pairs = []
+    considered = 0
+    box_passed = 0
+
+    def lowest_overlap(i: int, candidates: Iterable[int], best: Optional[int]) -> Optional[int]:
+        # The lowest candidate below best passing both tests, else best.
+        # Candidates come in index order.
+        nonlocal considered, box_passed
+        for j in candidates:
+            if best is not None and j >= best:
+                break
+            considered += 1
+            if extents_overlap(extents, i, j):
+                box_passed += 1
+                if overlaps is None or overlaps(i, j):
+                    return j
+        return best
+
+    for i in range(count):
+        if not active[i]:
             continue
+        active[i] = False
+
+        best = None
+        if is_large[i]:
+            # Every later plane still looking, rather than its many cells
+            best = lowest_overlap(i, (j for j in range(i + 1, count) if active[j]), best)
+        else:
+            for cell in cells(i):
+                members = [j for j in grid[cell] if active[j]]
+                grid[cell] = members
+                best = lowest_overlap(i, members, best)
+            large = [j for j in large if active[j]]
+            best = lowest_overlap(i, large, best)
+
+        if best is not None:
+            active[best] = False
+            pairs.append((i, best))
+
+    if PROFILE is not None:
+        PROFILE.count('pairs_considered', considered)
+        PROFILE.count('box_pairs', box_passed)
+        if overlaps is not None:
+            PROFILE.count('exact_pairs', len(pairs))
+
+    return pairs
+
+
+# Format of the files written by save_index. Files of another version are
+# ignored and rewritten.
+INDEX_VERSION = 1
+
+
+def surface_digests(coords: Sequence[float], vertices: Optional[Sequence[float]] = None,
+                    starts: Optional[Sequence[int]] = None) -> List[str]:
+    # Hash of the geometry of each surface: its 9 coordinates and, if given,
+    # all of its vertices. Names are left out, as they don't change a match.
+    coords = coords if isinstance(coords, array) else array('d', coords)
+    with_vertices = vertices is not None and starts is not None
+    if with_vertices and not isinstance(vertices, array):
+        vertices = array('d', vertices)
+
+    digests = []
+    for i in range(len(coords) // 9):
+        h = hashlib.blake2b(coords[9 * i:9 * i + 9].tobytes(), digest_size=16)
+        if with_vertices:
+            h.update(vertices[starts[i]:starts[i + 1]].tobytes())
+        digests.append(h.hexdigest())
+    return digests
+
+
+def group_digest(digests: List[str], group: List[int], settings: str) -> str:
+    # Hash of the members of a group in order, and of the settings that
+    # change its matches. Groups with the same digest have the same matches.
+    h = hashlib.blake2b(settings.encode(), digest_size=16)
+    for i in group:
+        h.update(digests[i].encode())
+    return h.hexdigest()
+
+
+def load_index(path: str) -> Dict[str, Any]:
+    # The index saved by a previous run, empty if there is none or it can't
+    # be used.
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(index, dict) or index.get('version') != INDEX_VERSION:
+        return {}
+    return index
+
+
+def save_index(path: str, index: Dict[str, Any]):
+    # Write to a temporary file first, so an interrupted run leaves the old
+    # index in place.
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(temp_path, path)
+
+
+def indexed_group_pairs(path: str, names: List[str], digests: List[str], grouped: List[List[int]],
+                        group_keys: List[str], settings: str, make_item: Callable[[List[int]], Any],
+                        check: Callable[[Any], List[Tuple]], jobs: int) -> Iterator[List[Tuple]]:
+    # Same as iter_match_groups on the items of the groups, but only the
+    # groups that aren't in the index at path are checked. The others take
+    # their matches from the index. Once every group has been matched, the
+    # index is rewritten with the current surfaces and groups.
+    index = load_index(path)
+    previous = index.get('groups', {})
+
+    group_digests = [group_digest(digests, group, settings) for group in grouped]
+    stale = [k for k, digest in enumerate(group_digests) if digest not in previous and len(grouped[k]) > 1]
+    checked = iter_match_groups([make_item(grouped[k]) for k in stale], check, jobs, [len(grouped[k]) for k in stale])
+    stale_set = set(stale)
+
+    def save(groups: Dict[str, Any]):
+        save_index(path, {'version': INDEX_VERSION,
+                          'surfaces': dict(zip(names, digests)),
+                          'groups': groups})
+
+    if not grouped:
+        save({})
+
+    groups = {}
+    for k, digest in enumerate(group_digests):
+        if k in stale_set:
+            pairs = next(checked)
+        elif len(grouped[k]) > 1:
+            pairs = [tuple(pair) for pair in previous[digest]['pairs']]
+        else:
+            pairs = []
+        groups[digest] = {'plane': group_keys[k], 'pairs': pairs}
 
-        name = split_line[0]
-        p1 = Point(float(split_line[1]), float(split_line[2]), float(split_line[3]))
-        p2 = Point(float(split_line[4]), float(split_line[5]), float(split_line[6]))
-        p3 = Point(float(split_line[7]), float(split_line[8]), float(split_line[9]))
+        # Saved before the last group is yielded, as the caller may not ask
+        # for more once it has the last group
+        if k == len(grouped) - 1:
+            save(groups)
+        yield pairs
 
-        plane_eq = PlaneEq(p1, p2, p3)
-        planes.append(Plane(plane_eq, name))
 
+def match_options(argv: List[str]) -> Dict[str, Any]:
+    # Matching options shared by the command line tools. Exits on bad values.
 
-    # Group by plane equation
-    grouped = group_planes(planes)
+    # Check if arguments contains '-2' flag, meaning print both directions of match.
+    # If not, print only one direction
+    print_both = False
+
+    only_first = True
+
+    if any([arg == '-2' for arg in argv]):
+        print_both = True
 
-    # Check each group for matches
-    matches: list[Tuple[Plane, Plane]] = []
-    for group in grouped:
-        group_matches = check_group(group)
+    if any([arg == "--all" or arg == "-a" for arg in argv]):
+        only_first = False
 
-        if not print_both:
-            matches.extend(check_group(group))
+    # Test every pair in each group instead of using the sweep, for comparison.
+    pairwise = any([arg == "--pairwise" for arg in argv])
+
+    # Only compare the boxes of the first 3 points, not the polygons.
+    exact = not any([arg == "--box" for arg in argv])
+
+    # Geometry backend, 'python' or 'numpy'
+    backend = 'python'
+    if '--backend' in argv:
+        idx = argv.index('--backend')
+        if idx + 1 >= len(argv) or argv[idx + 1] not in ('python', 'numpy'):
+            print('--backend requires python or numpy', file=sys.stderr)
+            sys.exit(1)
+        backend = argv[idx + 1]
+
+    # Number of processes used to match the groups
+    jobs = 1
+    if '--jobs' in argv or '-j' in argv:
+        idx = argv.index('--jobs') if '--jobs' in argv else argv.index('-j')
+        try:
+            jobs = int(argv[idx + 1])
+        except (IndexError, ValueError):
+            print('--jobs requires a number of processes', file=sys.stderr)
+            sys.exit(1)
+        if jobs < 1:
+            jobs = multiprocessing.cpu_count()
+
+    # Print the overlap area, covered fractions and plane of each match
+    metrics = any([arg == "--metrics" for arg in argv])
+
+    # Surfaces of 3 points are triangles, not 3 corners of a rectangle
+    corner_boxes = not any([arg == "--triangles" for arg in argv])
+
+    # Index file of a previous run, see indexed_group_pairs
+    index = None
+    if '--index' in argv:
+        idx = argv.index('--index')
+        if idx + 1 >= len(argv):
+            print('--index requires a file path', file=sys.stderr)
+            sys.exit(1)
+        index = argv[idx + 1]
+
+    # Grouping tolerances, --tol NORMAL[,OFFSET], see set_tolerances
+    tol = None
+    if '--tol' in argv:
+        idx = argv.index('--tol')
+        try:
+            values = [float(v) for v in argv[idx + 1].split(',')]
+        except (IndexError, ValueError):
+            values = []
+        if len(values) not in (1, 2) or min(values) <= 0:
+            print('--tol requires a tolerance, or normal and offset tolerances separated by a comma', file=sys.stderr)
+            sys.exit(1)
+        tol = (values[0], values[-1])
+
+    # Where the time went: --profile to stderr, --profile=PATH as JSON
+    profile = None
+    for arg in argv:
+        if arg == '--profile':
+            profile = '-'
+        elif arg.startswith('--profile='):
+            profile = arg[len('--profile='):]
+
+    return {'print_both': print_both, 'only_first': only_first, 'pairwise': pairwise, 'exact': exact,
+            'backend': backend, 'jobs': jobs, 'metrics': metrics, 'index': index, 'profile': profile, 'tol': tol,
+            'corner_boxes': corner_boxes}
+
+
+def match_names(names: List[str], coords: Sequence[float], vertices: Optional[Sequence[float]] = None,
+                starts: Optional[Sequence[int]] = None, print_both: bool = False, only_first: bool = True,
+                pairwise: bool = False, exact: bool = True, backend: str = 'python', jobs: int = 1,
+                metrics: bool = False, index: Optional[str] = None, corner_boxes: bool = True) -> Iterator[Tuple]:
+    # Group and match the surfaces of a table, yielding the matched names as
+    # each group is checked. coords holds 9 coordinates per surface. With the
+    # vertices and starts from read_surface_table and exact set, the pairs
+    # whose boxes overlap are checked again on the polygons. Surfaces of 3
+    # vertices are rectangles given by 3 corners with corner_boxes, as in the
+    # original input format, else triangles.
+    # With metrics, the overlap of each match follows the names, see
+    # stream_metrics.
+    # With index, the path of an index file, groups left unchanged since the
+    # run that wrote it are not checked again, see indexed_group_pairs.
+    # The numpy backend raises ImportError if NumPy is not installed.
+    if not exact:
+        vertices = None
+        starts = None
+
+    profile = PROFILE
+    mark = time.perf_counter() if profile is not None else 0.0
+
+    if backend == 'numpy':
+        import surface_match_numpy
+
+        surfaces = surface_match_numpy.coordinates(coords)
+        grouped = surface_match_numpy.group_coordinates(surfaces)
+        make_item = partial(surface_match_numpy.group_item, surfaces, vertices=vertices, starts=starts)
+        check = partial(surface_match_numpy.check_group_item, pairwise=pairwise, first_only=only_first, metrics=metrics,
+                        corner_boxes=corner_boxes)
+        if metrics or index is not None or profile is not None:
+            canonical, degenerate = surface_match_numpy.canonical_planes(surfaces)
+
+            def group_key(group: List[int]) -> str:
+                return plane_key(None if degenerate[group[0]] else tuple(canonical[group[0]].tolist()))
+
+    else:
+        table = SurfaceTable(names, coords, vertices, starts)
+
+        # Group by plane equation
+        grouped = group_table(table)
+        make_item = table.subtable
+        check = partial(check_table_pairs, pairwise=pairwise, first_only=only_first, metrics=metrics,
+                        corner_boxes=corner_boxes)
+
+        def group_key(group: List[int]) -> str:
+            return plane_key(table.canonical(group[0]))
+
+    if metrics or index is not None:
+        group_keys = [group_key(group) for group in grouped]
+
+    if profile is not None:
+        profile.lap('group', mark)
+        profile.record_groups([len(group) for group in grouped], lambda k: group_key(grouped[k]))
+
+    grouped_names = ([names[i] for i in group] for group in grouped)
+    if index is not None:
+        settings = f'only_first={only_first} exact={vertices is not None} metrics={metrics} corner_boxes={corner_boxes}'
+        group_pairs = indexed_group_pairs(index, names, surface_digests(coords, vertices, starts), grouped,
+                                          group_keys, settings, make_item, check, jobs)
+    else:
+        group_pairs = iter_match_groups([make_item(group) for group in grouped], check, jobs,
+                                        [len(group) for group in grouped])
+
+    if metrics:
+        return stream_metrics(grouped_names, group_keys, group_pairs, print_both)
+    return stream_matches(grouped_names, group_pairs, print_both)
+
+
+def make_surface_table(surfaces: Iterable[Tuple[str, Any]]) -> SurfaceTable:
+    # Table of (name, vertices) pairs, the vertices flat x, y, z values or
+    # (x, y, z) points, as sequences or NumPy arrays. Raises ValueError for
+    # a surface without whole vertices, at least 3 of them.
+    names: List[str] = []
+    coords = array('d')
+    vertices = array('d')
+    starts = array('q', [0])
+    for name, points in surfaces:
+        if hasattr(points, 'ravel'):
+            values = array('d')
+            values.frombytes(points.ravel().astype('d').tobytes())
         else:
-            matches.extend(group_matches)
-            matches.extend([(b, a) for a, b in group_matches])
+            points = list(points)
+            if points and isinstance(points[0], Sequence):
+                values = array('d', [v for point in points for v in point])
+            else:
+                values = array('d', points)
+        if len(values) < 9 or len(values) % 3:
+            raise ValueError(f'surface {name}: expected x, y, z of 3 or more vertices, found {len(values)} values')
+
+        names.append(name)
+        coords.extend(values[:9])
+        vertices.extend(values)
+        starts.append(len(vertices))
+    return SurfaceTable(names, coords, vertices, starts)
+
+
+def iter_matches(surfaces: Union[SurfaceTable, Iterable[Tuple[str, Any]]], *, bidirectional: bool = False,
+                 first_only: bool = True, tol: Optional[Union[float, Tuple[float, float]]] = None, exact: bool = True, backend: str = 'python',
+                 metrics: bool = False, corner_boxes: bool = True) -> Iterator[Tuple]:
+    # Matches of surfaces, as surface_match.py prints them, yielded as each
+    # group is checked. surfaces is a SurfaceTable, which can be matched
+    # again without being rebuilt, or (name, vertices) pairs for
+    # make_surface_table. Pairs are (name1, name2), or with metrics the
+    # fields of stream_metrics.
+    # bidirectional and first_only are -2 and the opposite of --all. tol is
+    # a tolerance or normal and offset tolerances, as --tol. The grouping
+    # tolerances are module settings, changed while the matches are read and
+    # put back after, so generators with different tol must not interleave.
+    # Surfaces of 3 vertices are rectangles given by 3 corners, as in
+    # surface_match.py, or triangles with corner_boxes False, as --triangles.
+
+    # Checked here rather than when the first match is read
+    table = surfaces if isinstance(surfaces, SurfaceTable) else make_surface_table(surfaces)
+    tolerances = None
+    if tol is not None:
+        tolerances = (float(tol), float(tol)) if isinstance(tol, (int, float)) else tuple(float(v) for v in tol)
+        if len(tolerances) != 2 or min(tolerances) <= 0:
+            raise ValueError('tol must be a positive tolerance, or normal and offset tolerances')
+    if backend not in ('python', 'numpy'):
+        raise ValueError(f'unknown backend {backend!r}')
+
+    return _table_matches(table, tolerances, dict(print_both=bidirectional, only_first=first_only, exact=exact,
+                                                  backend=backend, metrics=metrics, corner_boxes=corner_boxes))
+
+
+def _table_matches(table: SurfaceTable, tolerances: Optional[Tuple[float, float]], options: Dict[str, Any]) -> Iterator[Tuple]:
+    if tolerances is not None:
+        previous = (NORMAL_TOLERANCE, OFFSET_TOLERANCE)
+        set_tolerances(*tolerances)
+    try:
+        yield from match_names(table.names, table.coords, table.vertices, table.starts, **options)
+    finally:
+        if tolerances is not None:
+            set_tolerances(*previous)
+
+
+def print_matches(names: List[str], coords: Sequence[float], vertices: Optional[Sequence[float]],
+                  starts: Optional[Sequence[int]], options: Dict[str, Any], file: Optional[TextIO] = None) -> int:
+    # Print matches as each group is checked, to file or stdout. Returns the
+    # number of lines printed.
+    if options.get('tol') is not None:
+        set_tolerances(*options['tol'])
+
+    options = {key: value for key, value in options.items() if key not in ('profile', 'tol')}
+    try:
+        matches = match_names(names, coords, vertices, starts, **options)
+    except ImportError:
+        print('The numpy backend requires NumPy to be installed', file=sys.stderr)
+        sys.exit(1)
+
+    profile = PROFILE
+    if profile is not None:
+        start = time.perf_counter()
+        checking = sum(profile.phases.get(phase, 0.0) for phase in CHECK_PHASES)
+
+    lines = 0
+    if options.get('metrics'):
+        for name1, name2, area, fraction1, fraction2, key in matches:
+            print(f'{name1}\t{name2}\t{area:.6f}\t{fraction1:.6f}\t{fraction2:.6f}\t{key}', file=file)
+            lines += 1
+    else:
+        for name1, name2 in matches:
+            print(f'{name1}\t{name2}', file=file)
+            lines += 1
+
+    # Groups are checked as the output asks for them, so output is the time
+    # spent in the loop less the time spent checking
+    if profile is not None:
+        checked = sum(profile.phases.get(phase, 0.0) for phase in CHECK_PHASES) - checking
+        profile.phases['output'] = profile.phases.get('output', 0.0) + time.perf_counter() - start - checked
+        profile.count('matches', lines)
+
+    return lines
+
+
+# Phases recorded while the groups are checked
+CHECK_PHASES = ('transform', 'project', 'overlap', 'metrics')
+
+
+def write_profile(destination: Optional[str]):
+    # Report PROFILE to stderr if destination is '-', or as JSON to the file
+    if PROFILE is None or destination is None:
+        return
+    if destination == '-':
+        PROFILE.report()
+    else:
+        with open(destination, 'w') as f:
+            json.dump(PROFILE.summary(), f, indent=2)
+
+
+def start_profile() -> Profile:
+    global PROFILE
+    PROFILE = Profile()
+    return PROFILE
+
+
+def main():
+    options = match_options(sys.argv)
+    if options['profile'] is not None:
+        start_profile()
+    start = time.perf_counter()
+
+    # Read input from stdin, assume TSV. Report malformed rows and carry on.
+    def report(error: SurfaceParseError):
+        print(f'Skipping {error}', file=sys.stderr)
 
-    # Print matches
-    for match in matches:
-        print(f'{match[0].name}\t{match[1].name}')
+    names, coords, vertices, starts = read_surface_table(sys.stdin, on_error=report)
+    if PROFILE is not None:
+        PROFILE.lap('parse', start)
+        PROFILE.count('surfaces', len(names))
 
-    pass
+    print_matches(names, coords, vertices, starts, options)
+    write_profile(options['profile'])
 
 
 if __name__ == "__main__":
-    main()
+    # Run as the surface_match module that surface_match_numpy imports, so
+    # both see the same PROFILE
+    import surface_match
+    surface_match.main()
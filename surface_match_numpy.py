@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+# Batched NumPy versions of the geometry in surface_match. Surfaces are held as
+# an (N, 3, 3) array: surface, point, coordinate. The arithmetic is written out
+# component by component in the same order as the Point methods so that both
+# backends produce identical results.
+
+from typing import List, Optional, Sequence, Tuple, Union
+import time
+import numpy as np
+
+import surface_match
+
+
+def coordinates(rows: Union[Sequence[Sequence[float]], Sequence[float]]) -> np.ndarray:
+    # Rows of 9 floats, x, y, z for each of the 3 points, or the same packed
+    # into one flat sequence such as the array('d') from read_surface_table.
+    return np.asarray(rows, dtype=float).reshape(-1, 3, 3)
+
+
+def normals(coords: np.ndarray) -> np.ndarray:
+    # Same as PlaneEq.normal_vec, v1 = p2 - p1, v2 = p3 - p2, normal = v1 x v2
+    v1 = coords[:, 1] - coords[:, 0]
+    v2 = coords[:, 2] - coords[:, 1]
+    return np.stack([v1[:, 1] * v2[:, 2] - v1[:, 2] * v2[:, 1],
+                     v1[:, 2] * v2[:, 0] - v1[:, 0] * v2[:, 2],
+                     v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0]], axis=1)
+
+
+def canonical_planes(coords: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Same as surface_match.canonical_plane for every surface. Returns an (N, 4)
+    # array of unit normal and offset, and a mask of the degenerate surfaces.
+    n = normals(coords)
+    p3 = coords[:, 2]
+    d = -(n[:, 0] * p3[:, 0] + n[:, 1] * p3[:, 1] + n[:, 2] * p3[:, 2])
+    length = np.sqrt(n[:, 0] * n[:, 0] + n[:, 1] * n[:, 1] + n[:, 2] * n[:, 2])
+
+    degenerate = length == 0
+    safe_length = np.where(degenerate, 1.0, length)
+    canonical = np.column_stack([n, d]) / safe_length[:, None]
+
+    # Sign of the first normal component above tolerance, +1 if there is none
+    significant = np.abs(canonical[:, :3]) > surface_match.NORMAL_TOLERANCE
+    first = np.argmax(significant, axis=1)
+    leading = canonical[np.arange(len(canonical)), first]
+    flip = significant.any(axis=1) & (leading < 0)
+    canonical[flip] = -canonical[flip]
+
+    return canonical, degenerate
+
+
+def bucket_keys(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Same as surface_match.bucket_keys for every row of values. Returns the
+    # (M, 4) keys and the row of values each came from, the bucket of each
+    # row first, then those of its neighbouring buckets.
+    normal_tolerance = surface_match.NORMAL_TOLERANCE
+    tolerances = np.array([normal_tolerance, normal_tolerance, normal_tolerance, surface_match.OFFSET_TOLERANCE])
+    bucket_size = surface_match.BUCKET_SIZE
+    scaled = values / bucket_size
+    bucket = np.floor(scaled)
+    low = (scaled - bucket) * bucket_size < tolerances
+    high = (bucket + 1 - scaled) * bucket_size < tolerances
+
+    keys = bucket.astype(np.int64)
+    rows = np.arange(len(values))
+    for component in range(4):
+        below = low[rows, component]
+        above = high[rows, component]
+        lower = keys[below]
+        lower[:, component] -= 1
+        upper = keys[above]
+        upper[:, component] += 1
+        keys = np.concatenate([keys, lower, upper])
+        rows = np.concatenate([rows, rows[below], rows[above]])
+    return keys, rows
+
+
+def key_ids(keys: np.ndarray) -> np.ndarray:
+    # Number the distinct rows of (M, 4) bucket keys. Normal buckets span a
+    # few thousand values, so they pack into one integer with the numbered
+    # offset buckets.
+    _, offsets = np.unique(keys[:, 3], return_inverse=True)
+    packed = offsets.reshape(-1).astype(np.int64)
+    for column in range(3):
+        low = keys[:, column].min()
+        packed = packed * (int(keys[:, column].max() - low) + 1) + (keys[:, column] - low)
+    _, ids = np.unique(packed, return_inverse=True)
+    return ids.reshape(-1)
+
+
+def group_coordinates(coords: np.ndarray) -> List[List[int]]:
+    # Same grouping as surface_match.group_planes, returning lists of indices.
+    # Buckets are linked when a surface in one would look into the other.
+    # Where all the surfaces of linked buckets are within tolerance of the
+    # first of them, and look in its bucket, they are one group. The rest go
+    # through surface_match.group_canonical.
+    canonical, degenerate = canonical_planes(coords)
+    normal_tolerance = surface_match.NORMAL_TOLERANCE
+    tolerances = np.array([normal_tolerance, normal_tolerance, normal_tolerance, surface_match.OFFSET_TOLERANCE])
+
+    planes = np.nonzero(~degenerate)[0]
+    values = canonical[planes]
+    count = len(planes)
+    grouped: List[List[int]] = []
+    if count:
+        up_keys, up_rows = bucket_keys(values)
+        down_keys, down_rows = bucket_keys(-values)
+        # The flipped values rarely come near a surface, most of their
+        # buckets have a first normal bucket no surface has
+        near = np.isin(down_keys[:, 0], up_keys[:count, 0])
+        down_keys = down_keys[near]
+        down_rows = down_rows[near]
+
+        # The first count of up_keys are the buckets of the surfaces, where a
+        # group is filed under its first surface
+        ids = key_ids(np.concatenate([up_keys, down_keys]))
+        bucket = ids[:count]
+        lookup_ids = ids[count:]
+        lookup_rows = np.concatenate([up_rows[count:], down_rows])
+        occupied = np.zeros(len(ids), dtype=bool)
+        occupied[bucket] = True
+        hit = occupied[lookup_ids]
+
+        # Linked buckets take the lowest number among them
+        linked = np.arange(len(ids))
+        sources = bucket[lookup_rows[hit]]
+        targets = lookup_ids[hit]
+        while True:
+            lowest = np.minimum(linked[sources], linked[targets])
+            previous = linked.copy()
+            np.minimum.at(linked, sources, lowest)
+            np.minimum.at(linked, targets, lowest)
+            linked = linked[linked]
+            if (linked == previous).all():
+                break
+        component = linked[bucket]
+
+        _, first = np.unique(component, return_index=True)
+        first_of_component = np.zeros(len(ids), dtype=np.int64)
+        first_of_component[component[first]] = first
+        leader = first_of_component[component]
+        close = (np.abs(values - values[leader]) < tolerances).all(axis=1)
+        finds = bucket == bucket[leader]
+        up_lookups = len(up_keys) - count
+        finds[up_rows[count:][lookup_ids[:up_lookups] == bucket[leader[up_rows[count:]]]]] = True
+
+        mixed = np.zeros(len(ids), dtype=bool)
+        mixed[component[~(close & finds)]] = True
+        fast = ~mixed[component]
+
+        # Components in index order of their surfaces, split into groups
+        fast_rows = np.nonzero(fast)[0]
+        order = np.argsort(component[fast_rows], kind='stable')
+        members = planes[fast_rows[order]]
+        sorted_components = component[fast_rows[order]]
+        splits = np.nonzero(sorted_components[1:] != sorted_components[:-1])[0] + 1
+        if len(members):
+            grouped = [group.tolist() for group in np.split(members, splits)]
+        slow = np.sort(np.concatenate([planes[~fast], np.nonzero(degenerate)[0]]))
+    else:
+        slow = np.nonzero(degenerate)[0]
+
+    slow_canonicals = [None if d else tuple(c) for c, d in zip(canonical[slow].tolist(), degenerate[slow].tolist())]
+    slow_list = slow.tolist()
+    grouped.extend([slow_list[k] for k in group] for group in surface_match.group_canonical(slow_canonicals))
+
+    # Groups in order of first appearance, as group_canonical numbers them
+    grouped.sort(key=lambda group: group[0])
+    return grouped
+
+
+def project_group(coords: np.ndarray, transform_matrix: List[List[float]]) -> np.ndarray:
+    # Same as surface_match.project_group. Returns an (N, 4) array of
+    # min x, max x, min y, max y in the 2D frame of the group.
+    x, y, z = coords[:, :, 0], coords[:, :, 1], coords[:, :, 2]
+    t = transform_matrix
+    new_x = x * t[0][0] + y * t[0][1] + z * t[0][2]
+    new_y = x * t[1][0] + y * t[1][1] + z * t[1][2]
+    new_z = x[:, 0] * t[2][0] + y[:, 0] * t[2][1] + z[:, 0] * t[2][2]
+
+    # All planes in the group should end up at the same z coordinate
+    scale = np.abs(x[:, 0]) + np.abs(y[:, 0]) + np.abs(z[:, 0])
+    assert (np.abs(new_z - new_z[0]) < surface_match.plane_z_tolerance(scale)).all()
+
+    return np.column_stack([new_x.min(axis=1), new_x.max(axis=1), new_y.min(axis=1), new_y.max(axis=1)])
+
+
+def check_pairs(extents: np.ndarray) -> List[Tuple[int, int]]:
+    # Test every pair in the group at once
+    min_x, max_x, min_y, max_y = extents.T
+    overlap = ((min_x[:, None] < max_x[None, :]) & (max_x[:, None] > min_x[None, :]) &
+               (min_y[:, None] < max_y[None, :]) & (max_y[:, None] > min_y[None, :]))
+    i, j = np.nonzero(np.triu(overlap, k=1))
+    if surface_match.PROFILE is not None:
+        surface_match.PROFILE.count('pairs_considered', len(extents) * (len(extents) - 1) // 2)
+        surface_match.PROFILE.count('box_pairs', len(i))
+    return list(zip(i.tolist(), j.tolist()))
+
+
+# Candidate pairs the sweep tests at once, bounding its temporary arrays
+SWEEP_CHUNK_PAIRS = 1 << 20
+
+
+def sweep_and_prune(extents: np.ndarray) -> List[Tuple[int, int]]:
+    # Sort on min x. The candidates of each box are the boxes later in the
+    # sorted order that start before it ends. All candidate pairs are tested
+    # together, in chunks of about SWEEP_CHUNK_PAIRS.
+    order = np.argsort(extents[:, 0], kind='stable')
+    sorted_extents = extents[order]
+    min_x, max_x, min_y, max_y = sorted_extents.T
+    ends = np.searchsorted(min_x, max_x, side='left')
+    counts = np.maximum(ends - np.arange(len(order)) - 1, 0)
+    totals = np.cumsum(counts)
+
+    first: List[np.ndarray] = []
+    second: List[np.ndarray] = []
+    position = 0
+    while position < len(order):
+        done = totals[position - 1] if position else 0
+        stop = max(int(np.searchsorted(totals, done + SWEEP_CHUNK_PAIRS, side='right')), position + 1)
+        chunk_counts = counts[position:stop]
+        positions = np.repeat(np.arange(position, stop), chunk_counts)
+        # Each box's candidates follow it, position + 1 onwards
+        starts = np.cumsum(chunk_counts) - chunk_counts
+        others = positions + 1 + np.arange(len(positions)) - np.repeat(starts, chunk_counts)
+        hit = ((max_x[positions] > min_x[others]) & (min_x[positions] < max_x[others]) &
+               (min_y[positions] < max_y[others]) & (max_y[positions] > min_y[others]))
+        first.append(order[positions[hit]])
+        second.append(order[others[hit]])
+        position = stop
+
+    if surface_match.PROFILE is not None:
+        surface_match.PROFILE.count('pairs_considered', int(counts.sum()))
+        surface_match.PROFILE.count('box_pairs', sum(len(found) for found in second))
+
+    if not first:
+        return []
+
+    a = np.concatenate(first)
+    b = np.concatenate(second)
+    i = np.minimum(a, b)
+    j = np.maximum(a, b)
+    sort = np.lexsort((j, i))
+    return list(zip(i[sort].tolist(), j[sort].tolist()))
+
+
+def project_polygons(vertices: np.ndarray, starts: np.ndarray, transform_matrix: List[List[float]]) -> Tuple[np.ndarray, List[List[Tuple[float, float]]]]:
+    # Same as surface_match.project_table_polygons, for the flat vertex
+    # coordinates of a group and the starts of its surfaces.
+    v = vertices.reshape(-1, 3)
+    x, y, z = v[:, 0], v[:, 1], v[:, 2]
+    t = transform_matrix
+    new_x = x * t[0][0] + y * t[0][1] + z * t[0][2]
+    new_y = x * t[1][0] + y * t[1][1] + z * t[1][2]
+
+    first = starts[:-1] // 3
+    new_z = x[first] * t[2][0] + y[first] * t[2][1] + z[first] * t[2][2]
+
+    # All planes in the group should end up at the same z coordinate
+    scale = np.abs(x[first]) + np.abs(y[first]) + np.abs(z[first])
+    assert (np.abs(new_z - new_z[0]) < surface_match.plane_z_tolerance(scale)).all()
+
+    extents = np.column_stack([np.minimum.reduceat(new_x, first), np.maximum.reduceat(new_x, first),
+                               np.minimum.reduceat(new_y, first), np.maximum.reduceat(new_y, first)])
+
+    points = list(zip(new_x.tolist(), new_y.tolist()))
+    bounds = (starts // 3).tolist()
+    polygons = [points[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+    return extents, polygons
+
+
+def group_item(surfaces: np.ndarray, group: List[int], vertices: Optional[Sequence[float]] = None,
+               starts: Optional[Sequence[int]] = None) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+    # The coordinates of a group, plus its vertices and starts if given, for
+    # check_group_item.
+    if vertices is None or starts is None:
+        return surfaces[group], None, None
+
+    all_vertices = np.asarray(vertices, dtype=float)
+    all_starts = np.asarray(starts, dtype=np.int64)
+    pieces = [all_vertices[all_starts[i]:all_starts[i + 1]] for i in group]
+    group_starts = np.concatenate([[0], np.cumsum([len(p) for p in pieces])])
+    return surfaces[group], np.concatenate(pieces), group_starts
+
+
+def check_group_item(item: Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray]],
+                     pairwise: bool = False, first_only: bool = False, metrics: bool = False,
+                     corner_boxes: bool = True) -> List[Tuple]:
+    coords, vertices, starts = item
+    return check_group_coordinates(coords, pairwise, first_only, vertices, starts, metrics, corner_boxes)
+
+
+def check_group_coordinates(coords: np.ndarray, pairwise: bool = False, first_only: bool = False,
+                            vertices: Optional[np.ndarray] = None, starts: Optional[np.ndarray] = None,
+                            metrics: bool = False, corner_boxes: bool = True) -> List[Tuple]:
+    # Same as surface_match.check_table_pairs, returning index pairs into coords.
+    if len(coords) < 2:
+        return []
+
+    profile = surface_match.PROFILE
+    mark = time.perf_counter() if profile is not None else 0.0
+
+    p1, p2, p3 = (surface_match.Point(*(float(v) for v in p)) for p in coords[0])
+    transform_matrix = surface_match.group_transform(surface_match.PlaneEq(p1, p2, p3))
+    if profile is not None:
+        mark = profile.lap('transform', mark)
+    if transform_matrix is None:
+        return []
+
+    overlaps = None
+    polygons = None
+    if vertices is not None and starts is not None:
+        extents, polygons = project_polygons(vertices, starts, transform_matrix)
+        overlaps = surface_match.exact_overlaps(polygons, corner_boxes)
+    else:
+        extents = project_group(coords, transform_matrix)
+    if profile is not None:
+        mark = profile.lap('project', mark)
+
+    if pairwise:
+        pairs = check_pairs(extents)
+    elif first_only:
+        pairs = surface_match.first_overlaps(extents.ravel().tolist(), overlaps)
+    else:
+        pairs = sweep_and_prune(extents)
+
+    if not first_only or pairwise:
+        if overlaps is not None:
+            pairs = [(i, j) for i, j in pairs if overlaps(i, j)]
+            if profile is not None:
+                profile.count('exact_pairs', len(pairs))
+        if first_only:
+            pairs = surface_match.first_matches(pairs)
+    if profile is not None:
+        mark = profile.lap('overlap', mark)
+    if not metrics:
+        return pairs
+
+    results = surface_match.pair_metrics(extents.ravel().tolist(), polygons, pairs, corner_boxes)
+    if profile is not None:
+        profile.lap('metrics', mark)
+    return results
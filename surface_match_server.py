@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+# Long running version of surface_match.py. The surfaces and their plane
+# groups stay in memory between requests, so a change only regroups the
+# surfaces whose plane buckets link them to it, and only the groups it
+# touches are matched again.
+#
+# Requests are JSON objects, one per line, on stdin or a Unix domain socket:
+#   {"op": "add", "name": "S1", "vertices": [x1, y1, z1, x2, y2, z2, ...]}
+#   {"op": "update", "name": "S1", "vertices": [...]}
+#   {"op": "delete", "name": "S1"}
+#   {"op": "query", "name": "S1"}      the surfaces S1 overlaps
+#   {"op": "matches"}                  every match, as surface_match.py prints them
+#   {"op": "load", "path": "in.tsv"}   add the surfaces of a surface_match.py input file
+# Each request is answered by one JSON line, {"ok": true, ...} on success or
+# {"ok": false, "error": "..."}.
+
+from array import array
+from math import isfinite
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import json
+import os
+import signal
+import socketserver
+import sys
+
+import surface_match
+from surface_match import Point, PlaneEq
+
+
+class ResidentSurface:
+    __slots__ = ('order', 'vertices', 'canonical', 'keys', 'group')
+
+    def __init__(self, order: int, vertices: List[float]):
+        """
+        A surface held by a MatchIndex
+        :param order: position of the surface in the input, kept by updates
+        :param vertices: x, y, z of every vertex, at least 3, see checked_vertices
+        """
+        self.order = order
+        self.vertices = vertices
+        self.canonical = surface_match.canonical_plane(PlaneEq(Point(*vertices[0:3]), Point(*vertices[3:6]), Point(*vertices[6:9])))
+        # Buckets group_canonical looks in for this surface, its own first,
+        # none for a degenerate surface
+        self.keys: List[Tuple[int, ...]] = []
+        c = self.canonical
+        if c is not None:
+            # Coordinates near the float limit overflow the plane
+            if not (all(isfinite(v) for v in c) and isfinite(c[3] / surface_match.BUCKET_SIZE)):
+                raise ValueError('vertex coordinates are too large')
+            self.keys = list(surface_match.bucket_keys(c)) + list(surface_match.bucket_keys((-c[0], -c[1], -c[2], -c[3])))
+        self.group: Optional[int] = None
+
+
+class ResidentGroup:
+    __slots__ = ('canonical', 'founder', 'members', 'orders', 'pairs')
+
+    def __init__(self, canonical: Tuple[float, float, float, float], founder: str):
+        """
+        Coplanar surfaces of a MatchIndex
+        :param canonical: canonical plane of the surface the group was made for
+        :param founder: name of that surface
+        """
+        self.canonical = canonical
+        self.founder = founder
+        self.members: List[str] = []
+        self.orders: List[int] = []
+        # Matches by first_only, dropped whenever the members change
+        self.pairs: Dict[bool, List[Tuple[int, int]]] = {}
+
+
+class MatchIndex:
+    def __init__(self, print_both: bool = False, only_first: bool = True, pairwise: bool = False, exact: bool = True,
+                 corner_boxes: bool = True):
+        """
+        Surfaces grouped by plane as they are added, updated and deleted.
+        The surfaces linked to a change are grouped again with
+        surface_match.group_canonical, so the groups are those of a full run
+        on the surfaces in input order. Groups are matched with
+        surface_match.check_table_pairs, the first time they are asked for
+        after a change.
+        :param print_both: matches also list every pair reversed
+        :param only_first: matches only pair each surface once
+        :param pairwise: test every pair in a group instead of the sweep
+        :param exact: check the polygons, not only the boxes of the first 3 points
+        :param corner_boxes: surfaces of 3 points are rectangles given by 3 corners, not triangles
+        """
+        self.print_both = print_both
+        self.only_first = only_first
+        self.pairwise = pairwise
+        self.exact = exact
+        self.corner_boxes = corner_boxes
+
+        self.surfaces: Dict[str, ResidentSurface] = {}
+        self.groups: Dict[int, ResidentGroup] = {}
+        # Surfaces by their own bucket, and by every bucket they look in
+        self.residents: Dict[Tuple[int, ...], Set[str]] = {}
+        self.lookers: Dict[Tuple[int, ...], Set[str]] = {}
+        self.next_group = 0
+        self.next_order = 0
+
+    def add(self, name: str, vertices: List[float]):
+        if name in self.surfaces:
+            raise ValueError(f'surface {name} already exists')
+        surface = ResidentSurface(self.next_order, checked_vertices(vertices))
+        self.next_order += 1
+        self.insert(name, surface)
+        self.regroup(self.linked(name))
+
+    def update(self, name: str, vertices: List[float]):
+        if name not in self.surfaces:
+            raise ValueError(f'no surface {name}')
+        surface = ResidentSurface(self.surfaces[name].order, checked_vertices(vertices))
+        affected = self.linked(name)
+        self.take_out(name)
+        self.insert(name, surface)
+        self.regroup(affected | self.linked(name))
+
+    def delete(self, name: str):
+        if name not in self.surfaces:
+            raise ValueError(f'no surface {name}')
+        affected = self.linked(name)
+        affected.discard(name)
+        self.take_out(name)
+        self.regroup(affected)
+
+    def insert(self, name: str, surface: ResidentSurface):
+        self.surfaces[name] = surface
+        if surface.keys:
+            self.residents.setdefault(surface.keys[0], set()).add(name)
+            for key in surface.keys:
+                self.lookers.setdefault(key, set()).add(name)
+
+    def take_out(self, name: str):
+        # Remove a surface and the group it was in, whose other members are
+        # linked to it and regrouped by the caller
+        surface = self.surfaces.pop(name)
+        if surface.group is not None:
+            del self.groups[surface.group]
+        if surface.keys:
+            self.residents[surface.keys[0]].discard(name)
+            for key in surface.keys:
+                self.lookers[key].discard(name)
+
+    def linked(self, name: str) -> Set[str]:
+        # The surfaces whose grouping can depend on the named one, itself
+        # included: those reached through surfaces looking in each other's
+        # buckets. No group of group_canonical spans two such sets, and the
+        # groups of one only depend on the input order of its surfaces.
+        found = {name}
+        pending = [name]
+        while pending:
+            surface = self.surfaces[pending.pop()]
+            if not surface.keys:
+                continue
+            neighbours = set(self.lookers.get(surface.keys[0], ()))
+            for key in surface.keys:
+                neighbours.update(self.residents.get(key, ()))
+            for other in neighbours - found:
+                found.add(other)
+                pending.append(other)
+        return found
+
+    def regroup(self, names: Set[str]):
+        # Group the named surfaces again with surface_match.group_canonical,
+        # in input order. Degenerate surfaces never match and stay out.
+        for name in names:
+            group_id = self.surfaces[name].group
+            if group_id is not None:
+                self.groups.pop(group_id, None)
+                self.surfaces[name].group = None
+
+        members = sorted((name for name in names if self.surfaces[name].canonical is not None),
+                         key=lambda name: self.surfaces[name].order)
+        for indices in surface_match.group_canonical(self.surfaces[name].canonical for name in members):
+            group = ResidentGroup(self.surfaces[members[indices[0]]].canonical, members[indices[0]])
+            for k in indices:
+                surface = self.surfaces[members[k]]
+                group.members.append(members[k])
+                group.orders.append(surface.order)
+                surface.group = self.next_group
+            self.groups[self.next_group] = group
+            self.next_group += 1
+
+    def group_pairs(self, group: ResidentGroup, first_only: bool) -> List[Tuple[int, int]]:
+        if first_only not in group.pairs:
+            group.pairs[first_only] = surface_match.check_table_pairs(self.group_table(group), self.pairwise, first_only,
+                                                                      corner_boxes=self.corner_boxes)
+        return group.pairs[first_only]
+
+    def group_table(self, group: ResidentGroup) -> surface_match.SurfaceTable:
+        coords = array('d')
+        vertices = array('d')
+        starts = array('q', [0])
+        for name in group.members:
+            surface_vertices = self.surfaces[name].vertices
+            coords.extend(surface_vertices[:9])
+            vertices.extend(surface_vertices)
+            starts.append(len(vertices))
+
+        if not self.exact:
+            return surface_match.SurfaceTable(group.members, coords)
+        return surface_match.SurfaceTable(group.members, coords, vertices, starts)
+
+    def query(self, name: str) -> Dict[str, Any]:
+        # Every surface the named surface overlaps, in input order, and the
+        # one it is paired with in the matches, if any
+        if name not in self.surfaces:
+            raise ValueError(f'no surface {name}')
+        surface = self.surfaces[name]
+        if surface.group is None:
+            return {'name': name, 'plane': '', 'overlaps': [], 'match': None}
+
+        group = self.groups[surface.group]
+        k = group.members.index(name)
+        overlaps = sorted([j for i, j in self.group_pairs(group, False) if i == k] +
+                          [i for i, j in self.group_pairs(group, False) if j == k])
+
+        match = None
+        for i, j in self.group_pairs(group, self.only_first):
+            if i == k or j == k:
+                match = group.members[j if i == k else i]
+                break
+
+        return {'name': name, 'plane': surface_match.plane_key(group.canonical),
+                'overlaps': [group.members[i] for i in overlaps], 'match': match}
+
+    def matches(self) -> List[Tuple[str, str]]:
+        # Same as surface_match.match_names on the surfaces in input order,
+        # groups ordered by their first member
+        groups = sorted(self.groups.values(), key=lambda group: group.orders[0])
+        return list(surface_match.stream_matches((group.members for group in groups),
+                                                 (self.group_pairs(group, self.only_first) for group in groups),
+                                                 self.print_both))
+
+    def load(self, path: str) -> int:
+        # Add the surfaces of a file in the surface_match.py input format
+        with open(path) as f:
+            names, _, vertices, starts = surface_match.read_surface_table(f)
+        # Checked before any is added, then grouped together
+        surfaces = []
+        seen = set()
+        for i, name in enumerate(names):
+            if name in self.surfaces or name in seen:
+                raise ValueError(f'surface {name} already exists')
+            seen.add(name)
+            surfaces.append(ResidentSurface(self.next_order + i, checked_vertices(vertices[starts[i]:starts[i + 1]].tolist())))
+        self.next_order += len(names)
+
+        affected: Set[str] = set()
+        for name, surface in zip(names, surfaces):
+            self.insert(name, surface)
+        for name in names:
+            if name not in affected:
+                affected |= self.linked(name)
+        self.regroup(affected)
+        return len(names)
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        # Carry out one request, returning the response
+        op = request.get('op')
+        if op == 'add':
+            self.add(request['name'], request['vertices'])
+            return {'ok': True}
+        if op == 'update':
+            self.update(request['name'], request['vertices'])
+            return {'ok': True}
+        if op == 'delete':
+            self.delete(request['name'])
+            return {'ok': True}
+        if op == 'query':
+            return {'ok': True, **self.query(request['name'])}
+        if op == 'matches':
+            return {'ok': True, 'matches': [list(pair) for pair in self.matches()]}
+        if op == 'load':
+            return {'ok': True, 'count': self.load(request['path'])}
+        raise ValueError(f'unknown op {op!r}')
+
+
+def checked_vertices(vertices) -> List[float]:
+    # Finite float coordinates of whole vertices, at least 3 of them
+    values = [float(v) for v in vertices]
+    if len(values) < 9:
+        raise ValueError('a surface needs at least 3 vertices')
+    if not all(isfinite(v) for v in values):
+        raise ValueError('vertex coordinates must be finite')
+    return values[:len(values) - len(values) % 3]
+
+
+def respond(index: MatchIndex, line: str) -> Optional[str]:
+    # The JSON response to one request line, None for blank lines
+    if not line.strip():
+        return None
+
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError('a request must be a JSON object')
+        response = index.handle(request)
+    except KeyError as e:
+        response = {'ok': False, 'error': f'missing field {e}'}
+    except (ValueError, TypeError, OSError, surface_match.SurfaceParseError) as e:
+        response = {'ok': False, 'error': str(e)}
+
+    return json.dumps(response)
+
+
+def serve_lines(index: MatchIndex, lines: Iterable[str], write: Callable[[str], Any], flush: Callable[[], Any]):
+    for line in lines:
+        response = respond(index, line)
+        if response is not None:
+            write(response + '\n')
+            flush()
+
+
+def serve_socket(index: MatchIndex, path: str):
+    # Connections are served one at a time, all sharing the same index
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            lines = (line.decode('utf-8') for line in self.rfile)
+            serve_lines(index, lines, lambda text: self.wfile.write(text.encode('utf-8')), self.wfile.flush)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    # Stop on kill as on Ctrl-C, so the socket file is removed
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+
+    with socketserver.UnixStreamServer(path, Handler) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+
+def main():
+    if '-h' in sys.argv or '--help' in sys.argv:
+        print('Usage: surface_match_server.py [-2] [--all] [--pairwise] [--box] [--triangles] [--tol NORMAL[,OFFSET]] [--socket PATH] [input.tsv]')
+        print('Answers JSON line requests on stdin, or on the Unix socket at PATH')
+        sys.exit(0)
+
+    options = surface_match.match_options(sys.argv)
+    if options['tol'] is not None:
+        surface_match.set_tolerances(*options['tol'])
+    index = MatchIndex(options['print_both'], options['only_first'], options['pairwise'], options['exact'],
+                       options['corner_boxes'])
+
+    # Options taking a value, so the value isn't mistaken for a file name
+    with_value = {'--backend', '--jobs', '-j', '--index', '--tol'}
+    socket_path = None
+    files = []
+    idx = 1
+    while idx < len(sys.argv):
+        if sys.argv[idx] in with_value:
+            idx += 2
+            continue
+        if sys.argv[idx] == '--socket':
+            if idx + 1 >= len(sys.argv):
+                print('--socket requires a path', file=sys.stderr)
+                sys.exit(1)
+            socket_path = sys.argv[idx + 1]
+            idx += 2
+            continue
+        if not sys.argv[idx].startswith('-'):
+            files.append(sys.argv[idx])
+        idx += 1
+
+    for path in files:
+        index.load(path)
+
+    if socket_path is None:
+        serve_lines(index, sys.stdin, sys.stdout.write, sys.stdout.flush)
+    else:
+        serve_socket(index, socket_path)
+
+
+if __name__ == '__main__':
+    main()
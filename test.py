@@ -1,5 +1,28 @@
+import collections.abc
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import tempfile
 import unittest
+import batch_match
+import benchmark
+import gzip
+import io
+import idf_surface_draw
+import idf_surface_match
+import idf_surfaces
 import surface_match
+import surface_match_server
+import sub_surface_match
+
+try:
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy_available = False
 
 class TestSurfaceMatching(unittest.TestCase):
 
@@ -101,3 +124,846 @@ class TestSurfaceMatching(unittest.TestCase):
         print(adjugate)
 
 
+    def test_group_planes_tolerance(self):
+        def plane(name, z1, z2, z3):
+            return surface_match.Plane(surface_match.PlaneEq(surface_match.Point(0, 0, z1),
+                                                             surface_match.Point(1, 0, z2),
+                                                             surface_match.Point(1, 1, z3)), name)
+
+        # Offsets straddling a bucket edge, plus floating point noise
+        edge = surface_match.BUCKET_SIZE * 3
+        planes = [plane("A", edge - 1e-9, edge - 1e-9, edge - 1e-9),
+                  plane("B", 2, 2, 2),
+                  plane("C", edge + 1e-9, edge + 1e-9, edge + 1e-9),
+                  plane("D", 2 + 1e-12, 2, 2 - 1e-12)]
+
+        grouped = surface_match.group_planes(planes)
+        self.assertEqual([[p.name for p in g] for g in grouped], [["A", "C"], ["B", "D"]])
+
+    def test_group_planes_opposite_normals(self):
+        p1 = surface_match.Point(0, 0, 1)
+        p2 = surface_match.Point(1, 0, 1)
+        p3 = surface_match.Point(1, 1, 1)
+
+        up = surface_match.Plane(surface_match.PlaneEq(p1, p2, p3), "Up")
+        down = surface_match.Plane(surface_match.PlaneEq(p3, p2, p1), "Down")
+
+        grouped = surface_match.group_planes([up, down])
+        self.assertEqual(len(grouped), 1)
+
+    def test_group_after_degenerate(self):
+        # A degenerate row first must not put later groups out of step
+        lines = ["Line\t0.0\t0.0\t0.0\t1.0\t1.0\t1.0\t2.0\t2.0\t2.0",
+                 "A\t0.0\t0.0\t1.0\t2.0\t0.0\t1.0\t2.0\t2.0\t1.0",
+                 "B\t0.0\t0.0\t2.0\t2.0\t0.0\t2.0\t2.0\t2.0\t2.0",
+                 "C\t1.0\t1.0\t1.0\t3.0\t1.0\t1.0\t3.0\t3.0\t1.0",
+                 "D\t1.0\t1.0\t2.0\t3.0\t1.0\t2.0\t3.0\t3.0\t2.0"]
+        table = surface_match.read_surface_table(lines)
+        grouped = surface_match.group_planes(surface_match.table_planes(table[0], table[1]))
+        self.assertEqual([[plane.name for plane in group] for group in grouped], [["Line"], ["A", "C"], ["B", "D"]])
+        self.assertEqual(surface_match.group_table(surface_match.SurfaceTable(*table)), [[0], [1, 3], [2, 4]])
+        self.assertEqual(list(surface_match.match_names(*table)), [("A", "C"), ("B", "D")])
+        if numpy_available:
+            self.assertEqual(list(surface_match.match_names(*table, backend='numpy')), [("A", "C"), ("B", "D")])
+
+    def test_sweep_matches_pairwise(self):
+        rng = random.Random(42)
+        planes = []
+        for i in range(60):
+            x = rng.randint(0, 20)
+            y = rng.randint(0, 20)
+            w = rng.randint(1, 4)
+            h = rng.randint(1, 4)
+            # Rectangles in the plane x + z = 5, touching edges included
+            p1 = surface_match.Point(x, y, 5 - x)
+            p2 = surface_match.Point(x + w, y, 5 - x - w)
+            p3 = surface_match.Point(x + w, y + h, 5 - x - w)
+            planes.append(surface_match.Plane(surface_match.PlaneEq(p1, p2, p3), f"Plane {i}"))
+
+        pairwise = surface_match.check_group(planes, pairwise=True)
+        swept = surface_match.check_group(planes)
+        self.assertTrue(len(pairwise) > 0)
+        self.assertEqual([(a.name, b.name) for a, b in swept], [(a.name, b.name) for a, b in pairwise])
+
+        pairwise_first = surface_match.check_group(planes, pairwise=True, first_only=True)
+        first = surface_match.check_group(planes, first_only=True)
+        self.assertTrue(len(first) < len(swept))
+        self.assertEqual([(a.name, b.name) for a, b in first], [(a.name, b.name) for a, b in pairwise_first])
+
+    @unittest.skipUnless(numpy_available, "NumPy is not installed")
+    def test_numpy_backend_identical(self):
+        import surface_match_numpy
+
+        rng = random.Random(7)
+        rows = []
+        for i in range(300):
+            # Boxes on a few floors and on walls of a rotated zone
+            x = rng.uniform(0, 30)
+            y = rng.uniform(0, 30)
+            w = rng.uniform(0.5, 6)
+            h = rng.uniform(0.5, 6)
+            if i % 3:
+                z = rng.choice([0.0, 3.0, 6.0])
+                rows.append([x, y, z, x + w, y, z, x + w, y + h, z])
+            else:
+                angle = math.radians(rng.choice([0, 30, 45]))
+                c, s = math.cos(angle), math.sin(angle)
+                rows.append([x * c, x * s, y, (x + w) * c, (x + w) * s, y, (x + w) * c, (x + w) * s, y + h])
+
+        # Floors either side of a bucket edge, some within tolerance of the
+        # first but not of each other, and a degenerate surface
+        for z in (0.0010004, 0.0009998, 0.0010007, 0.0009993, 0.001):
+            rows.append([0, 0, z, 1, 0, z, 1, 1, z])
+        rows.insert(5, [0, 0, 0, 1, 1, 1, 2, 2, 2])
+
+        planes = [surface_match.Plane(surface_match.PlaneEq(surface_match.Point(*row[0:3]),
+                                                            surface_match.Point(*row[3:6]),
+                                                            surface_match.Point(*row[6:9])), i)
+                  for i, row in enumerate(rows)]
+        grouped = surface_match.group_planes(planes)
+
+        coords = surface_match_numpy.coordinates(rows)
+        grouped_numpy = surface_match_numpy.group_coordinates(coords)
+        self.assertEqual([[p.name for p in g] for g in grouped], grouped_numpy)
+
+        for group, indices in zip(grouped, grouped_numpy):
+            expected = [(a.name, b.name) for a, b in surface_match.check_group(group)]
+            for pairwise in (False, True):
+                found = [(indices[i], indices[j]) for i, j in surface_match_numpy.check_group_coordinates(coords[indices], pairwise)]
+                self.assertEqual(found, expected)
+
+            expected_first = [(a.name, b.name) for a, b in surface_match.check_group(group, first_only=True)]
+            found_first = [(indices[i], indices[j]) for i, j in surface_match_numpy.check_group_coordinates(coords[indices], first_only=True)]
+            self.assertEqual(found_first, expected_first)
+
+    def test_match_groups_pool(self):
+        rng = random.Random(3)
+        grouped = []
+        for g in range(6):
+            group = []
+            for i in range(rng.randint(1, 40)):
+                x = rng.uniform(0, 10)
+                y = rng.uniform(0, 10)
+                p1 = surface_match.Point(x, y, g)
+                p2 = surface_match.Point(x + 2, y, g)
+                p3 = surface_match.Point(x + 2, y + 2, g)
+                group.append(surface_match.Plane(surface_match.PlaneEq(p1, p2, p3), f"{g}-{i}"))
+            grouped.append(group)
+
+        expected = [surface_match.check_group_pairs(group) for group in grouped]
+
+        pool_min_pairs = surface_match.POOL_MIN_PAIRS
+        surface_match.POOL_MIN_PAIRS = 1
+        try:
+            found = surface_match.match_groups(grouped, surface_match.check_group_pairs, 2)
+        finally:
+            surface_match.POOL_MIN_PAIRS = pool_min_pairs
+
+        self.assertEqual(found, expected)
+
+    def test_stream_matches(self):
+        grouped_names = [["A", "B", "C"], ["D", "E"]]
+        group_pairs = [[(0, 1), (0, 2), (1, 2)], [(0, 1)]]
+
+        one_way = list(surface_match.stream_matches(grouped_names, group_pairs, False))
+        self.assertEqual(one_way, [("A", "B"), ("A", "C"), ("B", "C"), ("D", "E")])
+
+        both = list(surface_match.stream_matches(grouped_names, group_pairs[1:], True))
+        self.assertEqual(both, [("A", "B"), ("B", "A")])
+
+    def test_first_matches(self):
+        self.assertEqual(surface_match.first_matches([(0, 1), (0, 2), (1, 2), (2, 3)]), [(0, 1), (2, 3)])
+
+    def test_first_overlaps_large_boxes(self):
+        # Small boxes plus a few spanning far more cells than the grid takes
+        rng = random.Random(5)
+        extents = []
+        for i in range(400):
+            x = rng.uniform(0, 50)
+            y = rng.uniform(0, 50)
+            size = rng.choice([1000, 30, 0]) if i % 50 == 7 else rng.uniform(0.1, 2)
+            extents.extend([x, x + size, y, y + size])
+
+        expected = surface_match.first_matches(surface_match.sweep_and_prune(extents))
+        self.assertEqual(surface_match.first_overlaps(extents), expected)
+
+        def odd_sum(i, j):
+            return (i + j) % 2 == 1
+
+        filtered = surface_match.first_matches([(i, j) for i, j in surface_match.sweep_and_prune(extents) if odd_sum(i, j)])
+        self.assertEqual(surface_match.first_overlaps(extents, odd_sum), filtered)
+
+    def test_read_surfaces(self):
+        lines = ["A\t0\t0\t0\t1\t0\t0\t1\t1\t0\textra\n",
+                 "\n",
+                 "B\t0\t0\t0\t1\t0\n",
+                 "C\t0\t0\t0\t1\t0\t0\t1\tx\t0\n",
+                 "D \t0\t0\t1\t1\t0\t1\t1\t1\t1\n"]
+
+        with self.assertRaises(surface_match.SurfaceParseError) as context:
+            surface_match.read_surface_table(lines)
+        self.assertEqual(context.exception.line_number, 3)
+
+        errors = []
+        names, coords, vertices, starts = surface_match.read_surface_table(lines, on_error=errors.append)
+        self.assertEqual(names, ["A", "D"])
+        self.assertEqual(list(coords[9:]), [0, 0, 1, 1, 0, 1, 1, 1, 1])
+        self.assertEqual(list(vertices), list(coords))
+        self.assertEqual(list(starts), [0, 9, 18])
+        self.assertEqual([e.line_number for e in errors], [3, 4])
+
+        chunks = list(surface_match.read_surfaces(lines[:1] * 5, chunk_rows=2, on_error=errors.append))
+        self.assertEqual([len(chunk[0]) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([len(chunk[1]) for chunk in chunks], [18, 18, 9])
+
+        names, coords, vertices, starts = surface_match.read_surface_table(["E\t0\t0\t0\t1\t0\t0\t1\t1\t0\t0\t1\t0\t\n"])
+        self.assertEqual(list(vertices), [0, 0, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0])
+        self.assertEqual(list(starts), [0, 12])
+
+        self.assertEqual(surface_match.surface_match_lines([lines[0], lines[4]]), "A\nD")
+
+    def test_surface_table(self):
+        rng = random.Random(11)
+        names = []
+        coords = []
+        for i in range(200):
+            x = rng.uniform(0, 20)
+            y = rng.uniform(0, 20)
+            z = rng.choice([0.0, 3.0])
+            names.append(f"S{i}")
+            coords.extend([x, y, z, x + 2, y, z + (i % 2), x + 2, y + 2, z + (i % 2)])
+
+        table = surface_match.SurfaceTable(names, coords)
+        planes = surface_match.table_planes(names, coords)
+
+        grouped = surface_match.group_planes(planes)
+        grouped_rows = surface_match.group_table(table)
+        self.assertEqual([[p.name for p in g] for g in grouped], [[names[i] for i in g] for g in grouped_rows])
+
+        for group, rows in zip(grouped, grouped_rows):
+            subtable = table.subtable(rows)
+            for first_only in (False, True):
+                self.assertEqual(surface_match.check_table_pairs(subtable, first_only=first_only),
+                                 surface_match.check_group_pairs(group, first_only=first_only))
+            # Views can stand in for planes
+            self.assertEqual(surface_match.check_group_pairs([table[i] for i in rows]),
+                             surface_match.check_group_pairs(group))
+
+    def test_plane_eq_iteration(self):
+        plane = surface_match.PlaneEq(surface_match.Point(0, 0, 1), surface_match.Point(1, 0, 1), surface_match.Point(1, 1, 1))
+        outer = iter(plane)
+        self.assertEqual(next(outer), 0)
+        self.assertEqual(list(plane), [0, 0, 1, -1])
+        self.assertEqual(list(outer), [0, 1, -1])
+
+    def test_idf_table(self):
+        lines = ["Zone\tZone 1\t90\t10\t0\t0\n",
+                 "Wall:Detailed\tWall 1\tC\tZone 1\t\tOutdoors\t\t\t\t\t4\t0\t0\t3\t0\t0\t0\t5\t0\t0\t5\t0\t3\n",
+                 "Zone\tZone 2\t0\t0\t-5\t0\n",
+                 "Wall:Detailed\tWall 2\tC\tZone 2\t\tOutdoors\t\t\t\t\t4\t10\t0\t3\t10\t0\t0\t10\t5\t0\t10\t5\t3\n"]
+
+        table = idf_surface_match.idf_table(lines)
+
+        zones, surfaces = idf_surfaces.read_objects(lines)
+        printed = ['\t'.join([s.name] + [str(p) for p in s.points]) for s in idf_surfaces.transform_surfaces(zones, surfaces)]
+        self.assertEqual(table, surface_match.read_surface_table(printed))
+
+        self.assertEqual(list(surface_match.match_names(*table, print_both=True)), [("Wall 1", "Wall 2"), ("Wall 2", "Wall 1")])
+
+    def test_transform_surfaces(self):
+        lines = ["Zone\tZone 1\t90\t10\t0\t1\n",
+                 "Zone\tZone 2\t0\t0\t-5\t0\n",
+                 "Wall:Detailed\tWall 1\tC\tZone 1\t\tOutdoors\t\t\t\t\t4\t0\t0\t3\t0\t0\t0\t5\t0\t0\t5\t0\t3\n",
+                 "Floor:Detailed\tFloor 2\tC\tZone 2\t\tOutdoors\t\t\t\t\t3\t1\t2\t0\t3\t2\t0\t3\t4\t0\n",
+                 "Wall:Detailed\tWall 3\tC\tZone 1\t\tOutdoors\t\t\t\t\t3\t1\t0\t0\t0\t1\t0\t0\t0\t1\n"]
+
+        zones, surfaces = idf_surfaces.read_objects(lines)
+        transformed = idf_surfaces.transform_surfaces(zones, surfaces)
+        self.assertEqual([s.name for s in transformed], ["Wall 1", "Floor 2", "Wall 3"])
+        for found, expected in zip(transformed[0].points, [10, 0, 4, 10, 0, 1, 10, -5, 1, 10, -5, 4]):
+            self.assertAlmostEqual(found, expected)
+        self.assertEqual(transformed[1].points, [1, -3, 0, 3, -3, 0, 3, -1, 0])
+
+    def test_iter_idf_objects(self):
+        text = ["Version,9.6;\n",
+                "  Zone,  !- Name; not the end\n",
+                "    Zone 1,   !- Name\n",
+                "    30, 1,\n",
+                "    2, 3;\n",
+                "Schedule:Compact, Always On, Any Number,\n",
+                "  Through: 12/31, !- Field 1; with semicolon\n",
+                "  For: AllDays, Until: 24:00, 1;  Zone, Zone 2, , , , ;\n",
+                "WALL:DETAILED, Wall 1, C, Zone 1, , Outdoors, , , , , 3,\n",
+                "  0, 0, 0,\n  1, 0, 0,\n  1, 0, 1;\n"]
+
+        objects = list(idf_surfaces.iter_idf_objects(text, idf_surfaces.IDF_CLASSES))
+        self.assertEqual(objects, [["Zone", "Zone 1", "30", "1", "2", "3"],
+                                   ["Zone", "Zone 2", "", "", "", ""],
+                                   ["WALL:DETAILED", "Wall 1", "C", "Zone 1", "", "Outdoors", "", "", "", "", "3",
+                                    "0", "0", "0", "1", "0", "0", "1", "0", "1"]])
+
+        self.assertEqual(len(list(idf_surfaces.iter_idf_objects(text))), 5)
+
+        zones, surfaces = idf_surfaces.read_idf(text)
+        self.assertEqual([(z.name, z.rotation, z.x_origin) for z in zones], [("Zone 1", 30, 1), ("Zone 2", 0, 0)])
+        self.assertEqual([(s.name, s.zone, len(s.points)) for s in surfaces], [("Wall 1", "Zone 1", 9)])
+
+    def test_polygon_intersection(self):
+        square = [(0, 0), (2, 0), (2, 2), (0, 2)]
+        # L shape covering the square except its top right quarter, clockwise
+        l_shape = [(0, 0), (0, 2), (1, 2), (1, 1), (2, 1), (2, 0)]
+        notch = [(1.5, 1.5), (2, 1.5), (2, 2), (1.5, 2)]
+
+        self.assertAlmostEqual(surface_match.polygon_area(square), 4)
+        self.assertAlmostEqual(sum(surface_match.polygon_area(t) for t in surface_match.triangulate(l_shape)), 3)
+
+        triangles = [surface_match.triangulate(p) for p in (square, l_shape, notch)]
+        self.assertAlmostEqual(surface_match.intersection_area(triangles[0], triangles[1]), 3)
+        self.assertAlmostEqual(surface_match.intersection_area(triangles[0], triangles[2]), 0.25)
+        self.assertAlmostEqual(surface_match.intersection_area(triangles[1], triangles[2]), 0)
+
+    def test_exact_overlap(self):
+        def row(name, points):
+            return '\t'.join([name] + [str(float(c)) for x, y in points for c in (x, y, 3)])
+
+        lines = [row("L", [(0, 0), (0, 2), (1, 2), (1, 1), (2, 1), (2, 0)]),
+                 row("Notch", [(1.5, 1.5), (2, 1.5), (2, 2), (1.5, 2)]),
+                 # Rotated squares whose corners sit in each other's boxes only
+                 row("Diamond 1", [(5, 4), (6, 5), (5, 6), (4, 5)]),
+                 row("Diamond 2", [(6.6, 5.6), (7.6, 6.6), (6.6, 7.6), (5.6, 6.6)]),
+                 row("Under L", [(0.5, 0.5), (0.5, 0.7), (0.7, 0.7), (0.7, 0.5)])]
+        table = surface_match.read_surface_table(lines)
+
+        exact = list(surface_match.match_names(*table, only_first=False))
+        self.assertEqual(exact, [("L", "Under L")])
+
+        # The boxes of all vertices overlap for three pairs
+        surfaces = surface_match.SurfaceTable(*table)
+        extents, polygons = surface_match.project_table_polygons(surfaces, surface_match.group_transform(surfaces.plane_eq(0)))
+        self.assertEqual(surface_match.check_extents(extents), [(0, 1), (0, 4), (2, 3)])
+        self.assertEqual(surface_match.check_extents(extents, overlaps=surface_match.exact_overlaps(polygons)), [(0, 4)])
+
+        self.assertEqual(list(surface_match.match_names(*table)), [("L", "Under L")])
+        self.assertEqual(list(surface_match.match_names(*table, pairwise=True)), [("L", "Under L")])
+
+        if numpy_available:
+            self.assertEqual(list(surface_match.match_names(*table, only_first=False, backend='numpy')), exact)
+            self.assertEqual(list(surface_match.match_names(*table, backend='numpy')), exact)
+
+    def test_triangles(self):
+        # Two triangles halving a 2 x 2 square, touching along the diagonal,
+        # and a third inside the first
+        lines = ["T1\t0.0\t0.0\t0.0\t2.0\t0.0\t0.0\t2.0\t2.0\t0.0",
+                 "T2\t0.0\t0.0\t0.0\t2.0\t2.0\t0.0\t0.0\t2.0\t0.0",
+                 "T3\t0.5\t0.1\t0.0\t1.5\t0.1\t0.0\t1.5\t1.0\t0.0"]
+        table = surface_match.read_surface_table(lines)
+        key = "0.000000,0.000000,1.000000,0.000000"
+
+        # 3 point rows of the original format are corners of rectangles
+        self.assertEqual(list(surface_match.match_names(*table, only_first=False)),
+                         [("T1", "T2"), ("T1", "T3"), ("T2", "T3")])
+
+        options = surface_match.match_options(['surface_match.py', '--triangles', '--all', '--metrics'])
+        self.assertFalse(options['corner_boxes'])
+        backends = ['python', 'numpy'] if numpy_available else ['python']
+        for backend in backends:
+            matches = list(surface_match.match_names(*table, only_first=False, metrics=True, backend=backend, corner_boxes=False))
+            self.assertEqual([(a, b, round(area, 9), round(f1, 9), round(f2, 9), k) for a, b, area, f1, f2, k in matches],
+                             [("T1", "T3", 0.45, 0.225, 1.0, key)])
+
+        surfaces = [(name, surface_match.SurfaceTable(*table).vertices[9 * i:9 * i + 9]) for i, name in enumerate(["T1", "T2"])]
+        self.assertEqual(list(surface_match.iter_matches(surfaces, metrics=True)), [("T1", "T2", 4.0, 1.0, 1.0, key)])
+        self.assertEqual(list(surface_match.iter_matches(surfaces, metrics=True, corner_boxes=False)), [])
+
+    def test_sub_surfaces(self):
+        lines = ["Zone\tA\t0\t0\t0\t0\n",
+                 "Zone\tB\t0\t10\t0\t0\n",
+                 "Wall:Detailed\tA East\tC\tA\t\tOutdoors\t\t\t\t\t4\t10\t0\t3\t10\t0\t0\t10\t10\t0\t10\t10\t3\n",
+                 "Wall:Detailed\tB West\tC\tB\t\tOutdoors\t\t\t\t\t4\t0\t10\t3\t0\t10\t0\t0\t0\t0\t0\t0\t3\n",
+                 "FenestrationSurface:Detailed\tA Window\tWindow\tG\tA East\t\t0\t\t1\t4\t10\t2\t2\t10\t2\t1\t10\t4\t1\t10\t4\t2\n",
+                 "FenestrationSurface:Detailed\tB Window\tWindow\tG\tB West\t\t0\t\t1\t4\t0\t4\t2\t0\t4\t1\t0\t2\t1\t0\t2\t2\n",
+                 "FenestrationSurface:Detailed\tStray\tWindow\tG\tB West\t\t0\t\t1\t4\t10\t7\t2\t10\t7\t1\t10\t8\t1\t10\t8\t2\n"]
+
+        self.assertEqual(len(idf_surfaces.read_objects(lines)[1]), 2)
+
+        zones, surfaces = idf_surfaces.read_objects(lines, sub_surfaces=True)
+        transformed = idf_surfaces.transform_surfaces(zones, surfaces)
+        base = surface_match.SurfaceTable(*idf_surface_match.points_table(s for s in transformed if not isinstance(s, idf_surfaces.SubSurface)))
+        subs = surface_match.SurfaceTable(*idf_surface_match.points_table(s for s in transformed if isinstance(s, idf_surfaces.SubSurface)))
+        self.assertEqual(subs.names, ["A Window", "B Window", "Stray"])
+
+        # Stray is declared on B West, but zone B's origin puts it beyond A East
+        self.assertEqual(sub_surface_match.sub_surface_hosts(base, subs, ["A East", "B West", "B West"]),
+                         ["A East", "B West", None])
+        self.assertEqual(sub_surface_match.sub_surface_partners(subs), {"A Window": "B Window", "B Window": "A Window"})
+
+        # Containment in a concave host, and a window across its notch
+        l_shape = ["L\t0\t0\t0\t4\t0\t0\t4\t2\t0\t2\t2\t0\t2\t4\t0\t0\t4\t0"]
+        windows = ["In\t0.5\t0.5\t0\t1.5\t0.5\t0\t1.5\t3.5\t0\t0.5\t3.5\t0",
+                   "Across\t1\t1\t0\t3\t1\t0\t3\t3\t0\t1\t3\t0"]
+        hosts = sub_surface_match.sub_surface_hosts(surface_match.SurfaceTable(*surface_match.read_surface_table(l_shape)),
+                                                    surface_match.SurfaceTable(*surface_match.read_surface_table(windows)), ["L", "L"])
+        self.assertEqual(hosts, ["L", None])
+
+        # A window on a BuildingSurface:Detailed, which isn't read, is
+        # reported and skipped
+        building = ["BuildingSurface:Detailed\tBS1\tWall\tC\tA\t\tOutdoors\t\t\t\t\t4\t10\t5\t3\t10\t5\t0\t10\t9\t0\t10\t9\t3\n",
+                    "FenestrationSurface:Detailed\tBS Window\tWindow\tG\tBS1\t\t0\t\t1\t4\t10\t6\t2\t10\t6\t1\t10\t7\t1\t10\t7\t2\n"]
+        argv, stdin = sys.argv, sys.stdin
+        sys.argv = ['sub_surface_match.py']
+        sys.stdin = io.StringIO(''.join(lines + building))
+        out = io.StringIO()
+        err = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                sub_surface_match.main()
+        finally:
+            sys.argv, sys.stdin = argv, stdin
+        self.assertEqual(out.getvalue(), "A Window\tA East\tB Window\nB Window\tB West\tA Window\nStray\t\t\n")
+        self.assertIn("Sub-surface BS Window: host BS1 was not read, skipped", err.getvalue())
+
+        # A host far larger than the rest is kept off the grid but still found
+        extents = [0, 5000, 0, 5000]
+        for i in range(100):
+            extents.extend([i, i + 0.5, 1, 1.5])
+        grid = sub_surface_match.BoxGrid(extents)
+        self.assertEqual(grid.large, [0])
+        self.assertEqual(grid.containing(3.1, 3.2, 1.1, 1.2), [0, 4])
+        self.assertEqual(grid.containing(3.6, 3.7, 1.1, 1.2), [0])
+
+    def test_draw_svg(self):
+        rows = ["A\t0\t0\t0\t4\t0\t0\t4\t2\t0\n", "B, 1, -1, 5, 3, -1, 5, 2, 6, 5\n"]
+        polygons = idf_surface_draw.read_polygon_file(rows, 3)
+        self.assertEqual(idf_surface_draw.polygon_bounds(polygons), (0.0, -6.0, 4.0, 1.0))
+        self.assertEqual(idf_surface_draw.calculate_viewbox([]), "0 0 0 0")
+
+        document = idf_surface_draw.write_svg_file(polygons, 1)
+        self.assertIn('viewBox="0.0 -6.0 4.0 7.0"', document)
+        self.assertEqual(document.count('<polygon '), 2)
+        self.assertTrue(document.endswith('</svg>\n'))
+
+        # Written in chunks and compressed, the same document
+        chunk = idf_surface_draw.WRITE_CHUNK_POLYGONS
+        idf_surface_draw.WRITE_CHUNK_POLYGONS = 1
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'plan.svgz')
+                with idf_surface_draw.open_output(path, False) as out:
+                    count = idf_surface_draw.write_svg(idf_surface_draw.iter_polygon_file(rows, 3), 1, out,
+                                                       idf_surface_draw.calculate_viewbox(polygons))
+                self.assertEqual(count, 2)
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    self.assertEqual(f.read(), document)
+        finally:
+            idf_surface_draw.WRITE_CHUNK_POLYGONS = chunk
+
+    def test_draw_tiles_and_planes(self):
+        rows = ["Big\t0\t0\t0\t15\t0\t0\t15\t5\t0\t0\t5\t0\n",
+                "Small\t12\t1\t0\t12.5\t1\t0\t12.5\t1.5\t0\n",
+                "Wall\t0\t0\t0\t0\t0\t3\t4\t0\t3\t4\t0\t0\n",
+                "Line\t0\t0\t0\t1\t1\t1\t2\t2\t2\n"]
+        polygons = idf_surface_draw.read_polygon_file(rows[:2], 3)
+
+        # y is flipped, so Big covers tiles -1 in y
+        tiles = idf_surface_draw.tile_polygons(polygons, 10)
+        self.assertEqual({cell: [p.name for p in found] for cell, found in tiles.items()},
+                         {(0, -1): ["Big"], (1, -1): ["Big", "Small"]})
+
+        out = io.StringIO()
+        idf_surface_draw.write_svg(polygons, 1, out, "0 0 1 1", min_label=1)
+        self.assertEqual(out.getvalue().count('<polygon '), 2)
+        self.assertEqual(out.getvalue().count('<text '), 1)
+
+        planes = list(idf_surface_draw.plane_polygons(rows))
+        self.assertEqual([(key, [p.name for p in found]) for key, found in planes],
+                         [("0.000000,0.000000,1.000000,0.000000", ["Big", "Small"]),
+                          ("0.000000,1.000000,0.000000,0.000000", ["Wall"])])
+        self.assertEqual(sorted(abs(round(v, 9)) for v in idf_surface_draw.polygon_bounds(planes[1][1])), [0, 0, 3, 4])
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(idf_surface_draw.write_tiles(polygons, 1, directory, 10), 2)
+            self.assertEqual(sorted(os.listdir(directory)), ["index.html", "tile_0_-1.svg", "tile_1_-1.svg"])
+            with open(os.path.join(directory, "index.html")) as f:
+                self.assertEqual(f.read().count("<img "), 2)
+
+            self.assertEqual(idf_surface_draw.write_planes(planes, 1, directory, compress=True), 2)
+            with gzip.open(os.path.join(directory, "plane_2.svgz"), 'rt') as f:
+                self.assertIn(">Wall</text>", f.read())
+
+    def test_draw_matches(self):
+        l_shape = [(0, 0), (4, 0), (4, 2), (2, 2), (2, 4), (0, 4)]
+        centroid = idf_surface_draw.find_centroid(l_shape)
+        self.assertAlmostEqual(centroid[0], 5 / 3)
+        self.assertAlmostEqual(centroid[1], 5 / 3)
+        self.assertEqual(idf_surface_draw.find_centroid([(0, 0), (1, 1), (5, 5)]), (2, 2))
+        with self.assertRaises(ValueError):
+            idf_surface_draw.find_centroid([(0, 0), (1, 1)])
+
+        polygons = [idf_surface_draw.Polygon("L", [(x + 1e6, y) for x, y in l_shape]),
+                    idf_surface_draw.Polygon("Line", [(0, 0), (1, 1), (5, 5)]),
+                    idf_surface_draw.Polygon("Other", [(0, 0), (2, 0), (2, 2), (0, 2)])]
+        expected = [idf_surface_draw.find_centroid(p.points) for p in polygons]
+        self.assertAlmostEqual(expected[0][0], 1e6 + 5 / 3)
+        self.assertEqual(idf_surface_draw.polygon_centroids(polygons, use_numpy=False), expected)
+        if numpy_available:
+            self.assertEqual(idf_surface_draw.polygon_centroids(polygons, use_numpy=True), expected)
+
+        matches = idf_surface_draw.read_matches(["L\tLine\t1.000000\t0.500000\t0.500000\tkey\n", "Line\tL\n", "Gone\tL\n"])
+        self.assertEqual(matches, [("L", "Line"), ("Line", "L"), ("Gone", "L")])
+
+        out = io.StringIO()
+        idf_surface_draw.write_svg(polygons, 1, out, "0 0 1 1", matches=matches)
+        document = out.getvalue()
+        self.assertEqual(document.count(idf_surface_draw.MATCHED_STYLE), 2)
+        self.assertEqual(document.count(idf_surface_draw.UNMATCHED_STYLE), 1)
+        # One line for both directions, none to the missing surface
+        self.assertEqual(document.count('<line '), 1)
+        self.assertIn(f'x1="{expected[0][0]}" y1="{expected[0][1]}" x2="2.0" y2="2.0"', document)
+
+    def test_iter_matches(self):
+        rng = random.Random(11)
+        surfaces = []
+        for i in range(60):
+            x, y, z = rng.randint(0, 8), rng.randint(0, 8), rng.randint(0, 2)
+            points = [(x, y, z), (x + 3, y, z), (x + 3, y + 2, z), (x, y + 2, z)]
+            # Some of 3 vertices, read as corners or as triangles
+            if i % 5 == 0:
+                points = points[:3]
+            surfaces.append((f"S{i}", points if i % 2 else points[::-1]))
+        lines = ['\t'.join([name] + [str(float(c)) for point in points for c in point]) for name, points in surfaces]
+
+        for flags, keywords in (([], {}), (['-2'], {'bidirectional': True}), (['--all'], {'first_only': False}),
+                                (['--box', '-2'], {'exact': False, 'bidirectional': True}),
+                                (['--metrics'], {'metrics': True}), (['--tol', '0.5,0.5'], {'tol': 0.5}),
+                                (['--triangles', '--all'], {'corner_boxes': False, 'first_only': False})):
+            printed = io.StringIO()
+            surface_match.print_matches(*surface_match.read_surface_table(lines), surface_match.match_options(['surface_match.py'] + flags), printed)
+            surface_match.set_tolerances(0.000001, 0.000001)
+
+            matches = surface_match.iter_matches(surfaces, **keywords)
+            self.assertIsInstance(matches, collections.abc.Iterator)
+            if keywords.get('metrics'):
+                text = ''.join(f'{a}\t{b}\t{area:.6f}\t{f1:.6f}\t{f2:.6f}\t{key}\n' for a, b, area, f1, f2, key in matches)
+            else:
+                text = ''.join(f'{a}\t{b}\n' for a, b in matches)
+            self.assertEqual(text, printed.getvalue())
+            self.assertEqual(surface_match.NORMAL_TOLERANCE, 0.000001)
+
+        # Flat values and arrays give the same table, which can be matched again
+        table = surface_match.make_surface_table((name, [c for point in points for c in point]) for name, points in surfaces)
+        first = list(surface_match.iter_matches(table))
+        self.assertEqual(list(surface_match.iter_matches(table)), first)
+        self.assertEqual(list(surface_match.iter_matches(surfaces)), first)
+        if numpy_available:
+            import numpy
+            self.assertEqual(list(surface_match.iter_matches((name, numpy.array(points)) for name, points in surfaces)), first)
+
+        with self.assertRaises(ValueError):
+            surface_match.iter_matches([("Short", [0, 0, 0, 1, 1, 1, 2, 2])])
+        with self.assertRaises(ValueError):
+            surface_match.iter_matches(table, tol=(0.1, 0))
+
+    def test_metrics(self):
+        def row(name, points):
+            return '\t'.join([name] + [str(float(c)) for x, y in points for c in (x, y, 3)])
+
+        lines = [row("L", [(0, 0), (0, 2), (1, 2), (1, 1), (2, 1), (2, 0)]),
+                 row("Square", [(0.5, 0.5), (0.5, 1.5), (1.5, 1.5), (1.5, 0.5)])]
+        table = surface_match.read_surface_table(lines)
+
+        # The square covers half of itself and a sixth of the L
+        results = list(surface_match.match_names(*table, print_both=True, metrics=True))
+        self.assertEqual([r[:2] for r in results], [("L", "Square"), ("Square", "L")])
+        name1, name2, area, fraction1, fraction2, key = results[0]
+        self.assertAlmostEqual(area, 0.75)
+        self.assertAlmostEqual(fraction1, 0.25)
+        self.assertAlmostEqual(fraction2, 0.75)
+        self.assertEqual(key, '0.000000,0.000000,1.000000,-3.000000')
+        self.assertAlmostEqual(results[1][3], 0.75)
+        self.assertAlmostEqual(results[1][4], 0.25)
+
+        # With 3 points, the boxes are compared
+        box = list(surface_match.match_names(*table, exact=False, metrics=True))
+        self.assertAlmostEqual(box[0][2], 0.5)
+
+        if numpy_available:
+            self.assertEqual(list(surface_match.match_names(*table, print_both=True, metrics=True, backend='numpy')), results)
+
+    def test_index(self):
+        rng = random.Random(7)
+        lines = []
+        for i in range(40):
+            x = rng.randint(0, 10)
+            y = rng.randint(0, 10)
+            z = rng.randint(0, 3)
+            lines.append('\t'.join([f"S{i}"] + [str(float(c)) for c in (x, y, z, x + 2, y, z, x + 2, y + 2, z)]))
+
+        checked = []
+        original = surface_match.check_table_pairs
+
+        def counting(table, **kwargs):
+            checked.append(len(table))
+            return original(table, **kwargs)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.json')
+            surface_match.check_table_pairs = counting
+            try:
+                for options in ({}, {'only_first': False}, {'metrics': True, 'print_both': True}):
+                    full = list(surface_match.match_names(*surface_match.read_surface_table(lines), **options))
+                    first = list(surface_match.match_names(*surface_match.read_surface_table(lines), index=path, **options))
+                    self.assertEqual(first, full)
+
+                    # Nothing is checked again on an unchanged input
+                    checked.clear()
+                    again = list(surface_match.match_names(*surface_match.read_surface_table(lines), index=path, **options))
+                    self.assertEqual(again, full)
+                    self.assertEqual(checked, [])
+
+                # Move one surface to another plane, collapse one to a line
+                # and delete another
+                edited = lines[1:]
+                edited[0] = 'S1\t0.0\t0.0\t9.0\t2.0\t0.0\t9.0\t2.0\t2.0\t9.0'
+                edited[1] = 'S2\t0.0\t0.0\t1.0\t1.0\t0.0\t1.0\t2.0\t0.0\t1.0'
+                full = list(surface_match.match_names(*surface_match.read_surface_table(edited), metrics=True, print_both=True))
+                checked.clear()
+                incremental = list(surface_match.match_names(*surface_match.read_surface_table(edited), index=path,
+                                                             metrics=True, print_both=True))
+                self.assertEqual(incremental, full)
+                self.assertTrue(0 < len(checked) < 4)
+            finally:
+                surface_match.check_table_pairs = original
+
+    def test_batch_match(self):
+        objects = ["Zone\tZone 1\t0\t0\t0\t0\n",
+                   "Floor:Detailed\tFloor\tC\tZone 1\t\tOutdoors\t\t\t\t\t4\t0\t0\t3\t4\t0\t3\t4\t4\t3\t0\t4\t3\n",
+                   "RoofCeiling:Detailed\tCeiling\tC\tZone 1\t\tOutdoors\t\t\t\t\t4\t2\t2\t3\t6\t2\t3\t6\t6\t3\t2\t6\t3\n"]
+        broken = ["Wall:Detailed\tWall\tC\tNo zone\t\tOutdoors\t\t\t\t\t3\t0\t0\t0\t1\t0\t0\t1\t1\t0\n"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            for name, lines in (('a.tsv', objects), ('b.tsv', broken), ('c.tsv', objects)):
+                with open(os.path.join(directory, name), 'w') as f:
+                    f.writelines(lines)
+            files = batch_match.input_files([directory], [])
+            self.assertEqual([os.path.basename(path) for path in files], ['a.tsv', 'b.tsv', 'c.tsv'])
+
+            # Outputs never overwrite inputs
+            self.assertEqual(batch_match.output_paths(['x/a.tsv', 'y/a.matches.tsv', 'y/a.tsv'], 'y'),
+                             ['y/a-2.matches.tsv', 'y/a.matches.matches.tsv', 'y/a-3.matches.tsv'])
+
+            options = surface_match.match_options(['batch_match.py', '-2'])
+            output = os.path.join(directory, 'out')
+            entries = batch_match.match_files(files, output, None, options, 2)
+            self.assertEqual([entry['ok'] for entry in entries], [True, False, True])
+            self.assertEqual(entries[0]['surfaces'], 2)
+            self.assertEqual(entries[0]['matches'], 2)
+            self.assertIn('No zone', entries[1]['error'])
+            with open(entries[2]['output']) as f:
+                self.assertEqual(f.read(), "Floor\tCeiling\nCeiling\tFloor\n")
+
+            # Values of surface_match.py options aren't taken for inputs
+            argv = sys.argv
+            sys.argv = ['batch_match.py', '-o', output, '--jobs', '2', '--index', 'x.idx', files[0]]
+            try:
+                with self.assertRaises(SystemExit) as context:
+                    batch_match.main()
+            finally:
+                sys.argv = argv
+            self.assertEqual(context.exception.code, 0)
+            with open(os.path.join(output, 'manifest.json')) as f:
+                self.assertEqual(json.load(f)['files'], 1)
+            self.assertFalse(os.path.exists(entries[1]['output']))
+
+        # The pool is bounded by files, cores, the limit and memory
+        self.assertEqual(batch_match.pool_size(100, 8, None, 1000), 8)
+        self.assertEqual(batch_match.pool_size(3, 8, None, 1000), 3)
+        self.assertEqual(batch_match.pool_size(100, 8, 3500, 1000), 3)
+        self.assertEqual(batch_match.pool_size(100, 8, 500, 1000), 1)
+        self.assertEqual(batch_match.pool_size(100, 8, None, 1000, limit=2), 2)
+
+    def test_match_server(self):
+        rng = random.Random(11)
+        initial = {}
+        for i in range(50):
+            x = rng.randint(0, 10)
+            y = rng.randint(0, 10)
+            z = rng.randint(0, 2)
+            initial[f"S{i}"] = [float(c) for c in (x, y, z, x + 2, y, z, x + 2, y + 2, z, x, y + 2, z)]
+
+        def full_run(rows, **options):
+            lines = ['\t'.join([name] + [str(c) for c in vertices]) for name, vertices in rows.items()]
+            return list(surface_match.match_names(*surface_match.read_surface_table(lines), **options))
+
+        for options in ({}, {'only_first': False, 'print_both': True}):
+            rows = dict(initial)
+            index = surface_match_server.MatchIndex(**options)
+            for name, vertices in rows.items():
+                index.add(name, vertices)
+            self.assertEqual(index.matches(), full_run(rows, **options))
+
+            # Deleting the first surface of a group regroups the others
+            for name in ["S0", "S7", "S13"]:
+                index.delete(name)
+                del rows[name]
+            for name in ["S1", "S20"]:
+                rows[name] = [c + 0.5 if k % 3 != 2 else c for k, c in enumerate(rows[name])]
+                index.update(name, rows[name])
+            rows["New"] = [0.0, 0.0, 1.0, 9.0, 0.0, 1.0, 9.0, 9.0, 1.0]
+            index.add("New", rows["New"])
+            self.assertEqual(index.matches(), full_run(rows, **options))
+
+        response = surface_match_server.respond(index, '{"op": "query", "name": "New"}')
+        query = json.loads(response)
+        self.assertTrue(query["ok"])
+        self.assertEqual(query["overlaps"], sorted((a if b == "New" else b for a, b in full_run(rows, only_first=False) if "New" in (a, b)),
+                                                     key=list(rows).index))
+
+        self.assertFalse(json.loads(surface_match_server.respond(index, '{"op": "delete", "name": "Missing"}'))["ok"])
+
+        # A surface the index can't place is refused without changing it
+        before = index.matches()
+        huge = [0, 0, 0, 1e308, 0, 0, 1e308, 1e308, 0]
+        self.assertFalse(json.loads(surface_match_server.respond(index, json.dumps({"op": "add", "name": "Huge", "vertices": huge})))["ok"])
+        self.assertFalse(json.loads(surface_match_server.respond(index, json.dumps({"op": "update", "name": "New", "vertices": huge})))["ok"])
+        self.assertNotIn("Huge", index.surfaces)
+        self.assertEqual(index.surfaces["New"].vertices, rows["New"])
+        self.assertEqual(index.matches(), before)
+        self.assertFalse(json.loads(surface_match_server.respond(index, 'not json'))["ok"])
+        self.assertIsNone(surface_match_server.respond(index, ''))
+
+    def test_match_server_chained(self):
+        # Planes 0.8e-6 apart, each within tolerance of its neighbours only,
+        # so the groups depend on which surface comes first
+        def square(z):
+            return [0.0, 0.0, z, 2.0, 0.0, z, 2.0, 2.0, z, 0.0, 2.0, z]
+
+        def full_run(rows):
+            lines = ['\t'.join([name] + [repr(c) for c in vertices]) for name, vertices in rows.items()]
+            return list(surface_match.match_names(*surface_match.read_surface_table(lines)))
+
+        rows = {"A": square(0.0), "B": square(0.8e-6), "C": square(1.6e-6)}
+        index = surface_match_server.MatchIndex()
+        for name, vertices in rows.items():
+            index.add(name, vertices)
+        self.assertEqual(index.matches(), [("A", "B")])
+        self.assertEqual(index.matches(), full_run(rows))
+
+        index.update("A", rows["A"])
+        self.assertEqual(index.matches(), full_run(rows))
+
+        rows["D"] = square(2.4e-6)
+        index.add("D", rows["D"])
+        self.assertEqual(index.matches(), full_run(rows))
+
+        rows["B"] = square(3.2e-6)
+        index.update("B", rows["B"])
+        self.assertEqual(index.matches(), full_run(rows))
+
+        del rows["A"]
+        index.delete("A")
+        self.assertEqual(index.matches(), full_run(rows))
+
+        # Random changes along a longer chain
+        rng = random.Random(3)
+        for step in range(200):
+            name = f"S{rng.randint(0, 12)}"
+            vertices = square(0.8e-6 * rng.randint(0, 12))
+            if name not in rows:
+                rows[name] = vertices
+                index.add(name, vertices)
+            elif rng.random() < 0.3:
+                del rows[name]
+                index.delete(name)
+            else:
+                rows[name] = vertices
+                index.update(name, vertices)
+            self.assertEqual(index.matches(), full_run(rows))
+
+    def test_synthetic_building(self):
+        # 2 stories of 2 by 2 zones, the second block turned by 30 degrees
+        objects = benchmark.synthetic_building(96, rotations=(0, 30), zones_per_story=4, stories_per_block=2)
+        rows = benchmark.surface_rows(objects)
+        self.assertEqual(len(rows), 96)
+
+        matches = list(surface_match.match_names(*surface_match.read_surface_table(rows), only_first=False))
+        # Per block, 4 shared walls on each story and 4 ceilings under floors
+        self.assertEqual(len(matches), 2 * (2 * 4 + 4))
+        self.assertIn(("Block 1 Story 0 Zone 0 Ceiling", "Block 1 Story 1 Zone 0 Floor"), matches)
+
+    def test_benchmark_compare(self):
+        # Slowdowns under the noise floor or the tolerance aren't regressions
+        baseline = {'a': {'seconds': 0.01, 'digest': 'x'}, 'b': {'seconds': 1.0, 'digest': 'x'}}
+        self.assertEqual(benchmark.compare({'a': {'seconds': 0.03, 'digest': 'x'}, 'b': {'seconds': 1.2, 'digest': 'x'}}, baseline, 0.25), [])
+        self.assertEqual(benchmark.compare({'a': {'seconds': 0.01, 'digest': 'y'}, 'b': {'seconds': 2.0, 'digest': 'x'}}, baseline, 0.25),
+                         ['a: result changed', 'b: 2.000s, baseline 1.000s'])
+
+        # A command's peak memory isn't that of the benchmark process
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'text')
+            f.flush()
+            padding = b'x' * (100 * 1024 * 1024)
+            output, _, peak = benchmark.timed_command([sys.executable, '-c', 'import sys; sys.stdout.write(sys.stdin.read())'], f.name, 1)
+            del padding
+        self.assertEqual(output, b'text')
+        self.assertLess(peak, 50 * 1024 * 1024)
+
+    def test_profile(self):
+        rows = ['\t'.join([f"S{i}"] + [str(float(c)) for c in (i, 0, 3, i + 2, 0, 3, i + 2, 1, 3)]) for i in range(6)]
+        rows.append("Wall\t0.0\t0.0\t0.0\t1.0\t0.0\t0.0\t1.0\t0.0\t1.0")
+        table = surface_match.read_surface_table(rows)
+
+        profile = surface_match.start_profile()
+        try:
+            matches = list(surface_match.match_names(*table, only_first=False))
+        finally:
+            surface_match.PROFILE = None
+
+        # Neighbouring 2 wide strips overlap, those 2 apart only touch
+        self.assertEqual(len(matches), 5)
+        summary = profile.summary()
+        self.assertEqual(summary['counters']['groups'], 2)
+        self.assertEqual(summary['counters']['box_pairs'], 5)
+        self.assertEqual(summary['counters']['exact_pairs'], 5)
+        self.assertGreaterEqual(summary['counters']['pairs_considered'], 5)
+        self.assertEqual(summary['group_sizes'], {'1': 1, '4-7': 1})
+        self.assertEqual(summary['largest_group'], {'size': 6, 'plane': '0.000000,0.000000,1.000000,-3.000000'})
+        self.assertIn('overlap', summary['phases'])
+
+    def test_plane_key(self):
+        def plane(z1, z2, z3):
+            return surface_match.PlaneEq(surface_match.Point(0, 0, z1), surface_match.Point(1, 0, z2), surface_match.Point(1, 1, z3))
+
+        up = plane(2, 2, 2)
+        down = surface_match.PlaneEq(up.p3, up.p2, up.p1)
+        noisy = plane(2 + 1e-12, 2, 2 - 1e-12)
+        self.assertEqual(up, down)
+        self.assertEqual(up, noisy)
+        self.assertEqual(hash(up), hash(noisy))
+        self.assertEqual(len({up, down, noisy, plane(3, 3, 3)}), 2)
+        self.assertEqual(sorted([plane(3, 3, 3).key(), up.key()]), [plane(3, 3, 3).key(), up.key()])
+        self.assertEqual(str(up.key()), '0.000000,0.000000,1.000000,-2.000000')
+
+        # Within tolerance across a key cell edge: close and grouped, not equal
+        below = plane(2.0000025 - 1e-11, 2.0000025 - 1e-11, 2.0000025 - 1e-11)
+        above = plane(2.0000025 + 1e-11, 2.0000025 + 1e-11, 2.0000025 + 1e-11)
+        self.assertNotEqual(below, above)
+        self.assertTrue(below.close(above))
+        self.assertTrue(below.close(surface_match.PlaneEq(above.p3, above.p2, above.p1)))
+        self.assertFalse(below.close(plane(3, 3, 3)))
+        self.assertEqual(len(surface_match.group_planes([surface_match.Plane(below, 'below'), surface_match.Plane(above, 'above')])), 1)
+
+        # Tilted by a few 1e-6 radians, split by the default tolerances
+        rows = ["Flat\t0.0\t0.0\t2.0\t10.0\t0.0\t2.0\t10.0\t10.0\t2.0",
+                "Tilted\t1.0\t1.0\t2.0\t9.0\t1.0\t2.0\t9.0\t9.0\t2.0001"]
+        table = surface_match.read_surface_table(rows)
+        self.assertFalse(plane(2, 2, 2).close(plane(2, 2, 2.00003)))
+        self.assertEqual(list(surface_match.match_names(*table)), [])
+
+        surface_match.set_tolerances(0.0001, 0.001)
+        try:
+            self.assertTrue(plane(2, 2, 2).close(plane(2, 2, 2.00003)))
+            self.assertEqual(list(surface_match.match_names(*table)), [("Flat", "Tilted")])
+            if numpy_available:
+                self.assertEqual(list(surface_match.match_names(*table, backend='numpy')), [("Flat", "Tilted")])
+        finally:
+            surface_match.set_tolerances(0.000001, 0.000001)